@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# pylint: disable=no-member
+
+# ------------- config ---------------
+
+# terminal's mqtt identifier
+TERMINAL_ID = 'terminal'
+
+# format of rfid records ('auto'/'json')
+# 'auto' - compact binary format when every server in the network supports it, JSON otherwise
+WIRE_FORMAT = 'auto'
+
+# scans are kept in this file until the broker acknowledges them (survive outages and restarts)
+OUTBOX_PATH = 'outbox.dat'  # (default is 'outbox.dat')
+# max number of queued scans (the oldest are dropped when the queue is full)
+OUTBOX_MAX_MESSAGES = 100000  # (default is 100000)
+# max time (in seconds) a queued scan waits to be flushed to disk (fsync)
+OUTBOX_FSYNC_INTERVAL = 0.2  # (default is 0.2)
+# backlog of scans (after outage) is sent in batches of OUTBOX_REPLAY_BATCH scans,
+# at most OUTBOX_REPLAY_RATE scans per second
+OUTBOX_REPLAY_RATE = 200  # (default is 200)
+OUTBOX_REPLAY_BATCH = 50  # (default is 50)
+
+# bursts of scans are sent as one batch message of up to PUBLISH_BATCH_SIZE scans
+# (only if every server accepts batches), 1 - every scan is sent on its own
+PUBLISH_BATCH_SIZE = 16  # (default is 16)
+# max time (in seconds) a scan waits for others to join its batch
+# (longer - fewer messages in bursts, shorter - scans reach the server sooner)
+PUBLISH_BATCH_LINGER = 0.1  # (default is 0.1)
+
+# mqqt broker
+BROKER = '127.0.0.1'
+
+# port
+# if port is set to 0 then default mosquitto port is used
+# TLS default port: 8883
+PORT = 0
+
+# Enable TLS certification
+TLS_ENABLED = False # (True/False)
+
+# Path to .crt file
+# Fill this field if you enable TLS
+TLS_CERT_FILE = ""
+
+# TLS user 
+TLS_USERNAME = ""
+
+TLS_PASSWORD = ""
+
+# ------------------------------------
+
+def configInfo():
+    print('This is only configuration file.\n')
+
+
+if __name__ == "__main__":
+    configInfo()
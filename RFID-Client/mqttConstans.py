@@ -1,6 +1,8 @@
 # MQTT topics
 TERMINAL_DEBUG = 'terminal/debug'
 RFID_RECORD = 'rfid/record'
+# rfid records of one terminal: rfid/record/<terminal_id>
+RFID_RECORD_PREFIX = RFID_RECORD + '/'
 BROADCAST_REQUEST = 'broadcast/request'
 BROADCAST_REPLY = 'broadcast/reply'
 
@@ -10,3 +12,6 @@ JSON_SERVER_ID = 'server_id'
 JSON_RFID_UID = 'rfid_uid'
 JSON_RFID_DATE = 'rfid_date'
 JSON_TEXT = 'text'
+# supported rfid/record formats and terminal indexes (broadcast handshake)
+JSON_FORMATS = 'formats'
+JSON_TERMINAL_INDEXES = 'terminal_indexes'
@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+
+# queue file header: generation (incremented when acknowledged head is cut off)
+__HEADER__ = struct.Struct('<Q')
+# queued message: crc32 of the rest of the frame, topic length, payload length, topic, payload
+__FRAME__ = struct.Struct('<IHI')
+# max number of published messages waiting for acknowledgement (PUBACK)
+__MAX_INFLIGHT__ = 20
+# acknowledged part of the queue file is cut off once it's this big (in bytes)
+__COMPACT_BYTES__ = 1 << 16
+# interval (in seconds) of queue metrics in log (only while anything is queued or happened)
+__STATS_INTERVAL__ = 10
+
+
+class Outbox:
+    """
+    Durable queue of messages for the server - scans survive broker outages and terminal restarts.\n
+    Messages are appended to the queue file (fsync is batched, at most fsyncInterval seconds late),
+    published by sender thread with QoS 1 and removed only after the broker acknowledged them.
+    Offset of the first unacknowledged message is kept in '<path>.head'.\n
+    Backlog (messages queued while the broker was not connected, e.g. during outage or before restart)
+    is replayed in batches of replayBatch messages, at most replayRate messages per second -
+    messages queued while connected aren't rate limited.\n
+    Queue is bounded - the oldest messages are dropped when it holds maxMessages.\n
+    With batchSize > 1, up to batchSize queued messages of the same topic are sent as one batch message
+    (encodeBatch), a message waits at most linger seconds for others to join it.
+    """
+
+    def __init__(self, client, path, maxMessages=100000, fsyncInterval=0.2, replayRate=200, replayBatch=50,
+                 batchSize=1, linger=0.0, encodeBatch=None):
+        """
+        client: paho client (its on_publish has to call onPublish)\n
+        encodeBatch: callable(list of bytes payloads) -> bytes batch payload,
+        or None if batch can't be sent now (messages are then published one by one)
+        """
+        self.__client = client
+        self.__path = path
+        self.__head_path = path + '.head'
+        self.__max_messages = max(1, maxMessages)
+        self.__fsync_interval = fsyncInterval
+        self.__replay_rate = replayRate
+        self.__replay_batch = max(1, replayBatch)
+        self.__batch_size = max(1, batchSize) if encodeBatch is not None else 1
+        self.__linger = linger
+        self.__encode_batch = encodeBatch
+        self.__cond = threading.Condition()
+        # tuple(int frame size, str topic, bytes payload, float time queued) not published yet (in order of the file)
+        self.__pending = deque()
+        # [int frame size, bool acknowledged, bool replayed] published (or dropped) messages after head
+        self.__inflight = deque()
+        # mid -> list of in-flight entries published in one message
+        self.__by_mid = {}
+        # acknowledgements which arrived before mid of the message was registered
+        self.__early_acks = set()
+        # messages and MQTT publishes waiting for acknowledgement
+        self.__unacked = 0
+        self.__unacked_publishes = 0
+        self.__generation = 0
+        self.__head = __HEADER__.size
+        self.__file = None
+        self.__unsynced = False
+        self.__written_head = None
+        self.__tokens = self.__replay_batch
+        self.__last_refill = 0.0
+        self.__next_send = 0.0
+        # number of the oldest pending messages queued before the broker connected (replayed at replayRate)
+        self.__backlog = 0
+        self.__connected = False
+        # set by stop - messages put afterwards are dropped
+        self.__stopping = False
+        self.__sender = threading.Thread(target=self.__run, name='outbox-sender', daemon=True)
+        # acknowledged messages are counted as replayed (backlog) or live
+        self.__stats = {'queued': 0, 'published': 0, 'live': 0, 'replayed': 0, 'dropped': 0}
+
+    def __str__(self):
+        return self.__class__.__name__
+
+    def __load(self):
+        data = b''
+        if os.path.exists(self.__path):
+            with open(self.__path, 'rb') as queueFile:
+                data = queueFile.read()
+        if len(data) < __HEADER__.size:
+            self.__write_new_file(0, b'')
+            return
+
+        (self.__generation,) = __HEADER__.unpack_from(data)
+        (generation, head) = (self.__generation, __HEADER__.size)
+        if os.path.exists(self.__head_path):
+            with open(self.__head_path, 'r') as headFile:
+                (generation, head) = [int(item) for item in headFile.read().split()]
+        # head of previous generation - file was compacted before the head was written
+        self.__head = head if generation == self.__generation and head <= len(data) else __HEADER__.size
+
+        offset = self.__head
+        while offset + __FRAME__.size <= len(data):
+            (crc, topicLength, payloadLength) = __FRAME__.unpack_from(data, offset)
+            end = offset + __FRAME__.size + topicLength + payloadLength
+            if end > len(data) or zlib.crc32(data[offset + 4:end]) != crc:
+                break
+            topic = data[offset + __FRAME__.size:offset + __FRAME__.size + topicLength].decode('utf-8')
+            self.__pending.append((end - offset, topic, data[end - payloadLength:end], 0.0))
+            offset = end
+
+        self.__file = open(self.__path, 'r+b')
+        if offset < len(data):
+            # message torn by crash while it was written
+            logging.warning('[%s] dropped %d damaged bytes at the end of "%s"', self, len(data) - offset, self.__path)
+            self.__file.truncate(offset)
+        self.__file.seek(0, os.SEEK_END)
+        self.__written_head = (self.__generation, self.__head)
+        if len(self.__pending) > 0:
+            logging.info('[%s] %d messages queued from previous run', self, len(self.__pending))
+
+    def __write_new_file(self, generation, frames):
+        temporaryPath = self.__path + '.tmp'
+        with open(temporaryPath, 'wb') as queueFile:
+            queueFile.write(__HEADER__.pack(generation))
+            queueFile.write(frames)
+            queueFile.flush()
+            os.fsync(queueFile.fileno())
+        if self.__file is not None:
+            self.__file.close()
+        os.replace(temporaryPath, self.__path)
+        self.__file = open(self.__path, 'r+b')
+        self.__file.seek(0, os.SEEK_END)
+        self.__generation = generation
+        self.__head = __HEADER__.size
+
+    def __write_head(self, generation, head):
+        temporaryPath = self.__head_path + '.tmp'
+        with open(temporaryPath, 'w') as headFile:
+            headFile.write(f'{generation} {head}')
+            headFile.flush()
+            os.fsync(headFile.fileno())
+        os.replace(temporaryPath, self.__head_path)
+
+    def start(self):
+        with self.__cond:
+            self.__load()
+        self.__sender.start()
+
+    def stop(self):
+        """
+        messages not acknowledged yet stay in the queue file for the next run,
+        messages put after stop is called are dropped
+        """
+        with self.__cond:
+            self.__stopping = True
+            self.__cond.notify_all()
+        self.__sender.join()
+        self.__sync()
+        with self.__cond:
+            self.__file.close()
+
+    def put(self, topic, payload):
+        """
+        payload: str or bytes\n
+        Returns:\n
+        \tbool whether message was queued (False - outbox is stopped, message is dropped)
+        """
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        topic = topic.encode('utf-8')
+        body = __FRAME__.pack(0, len(topic), len(payload))[4:] + topic + payload
+        frame = struct.pack('<I', zlib.crc32(body)) + body
+
+        with self.__cond:
+            if self.__stopping:
+                logging.warning('[%s] stopped, message for "%s" dropped', self, topic.decode('utf-8'))
+                return False
+            if self.__unacked + len(self.__pending) >= self.__max_messages and len(self.__pending) > 0:
+                # the oldest unpublished message is acknowledged as dropped
+                size = self.__pending.popleft()[0]
+                self.__backlog = max(0, self.__backlog - 1)
+                self.__inflight.append([size, True, False])
+                self.__stats['dropped'] += 1
+                self.__advance_head()
+            self.__file.write(frame)
+            self.__file.flush()
+            self.__unsynced = True
+            self.__pending.append((len(frame), topic.decode('utf-8'), payload, time.monotonic()))
+            self.__stats['queued'] += 1
+            self.__cond.notify_all()
+        return True
+
+    def onPublish(self, client, userdata, mid):
+        """
+        paho on_publish callback (network thread) - QoS 1 message was acknowledged
+        """
+        with self.__cond:
+            entries = self.__by_mid.pop(mid, None)
+            if entries is None:
+                self.__early_acks.add(mid)
+                return
+            self.__acknowledge(entries)
+            self.__cond.notify_all()
+
+    def __acknowledge(self, entries):
+        for entry in entries:
+            entry[1] = True
+            self.__stats['replayed' if entry[2] else 'live'] += 1
+        self.__unacked -= len(entries)
+        self.__unacked_publishes -= 1
+        self.__advance_head()
+
+    def __advance_head(self):
+        while len(self.__inflight) > 0 and self.__inflight[0][1]:
+            self.__head += self.__inflight.popleft()[0]
+
+    def getDepth(self):
+        """
+        Returns:\n
+        \tint number of messages not acknowledged by the broker
+        """
+        with self.__cond:
+            return self.__unacked + len(self.__pending)
+
+    def __lingers(self, now):
+        """
+        Returns:\n
+        \tfloat seconds the oldest pending message still waits for a batch to fill up (0 - send now)
+        """
+        if self.__batch_size == 1 or len(self.__pending) == 0 or len(self.__pending) >= self.__batch_size:
+            return 0.0
+        return max(0.0, self.__pending[0][3] + self.__linger - now)
+
+    def __take_batch(self, now):
+        """
+        has to be called with the lock held\n
+        Returns:\n
+        \tlist of tuple(list of in-flight entries, str topic, list of payloads) - messages
+        which can be published now (moved to in-flight), grouped by batch
+        """
+        if not self.__client.is_connected():
+            self.__connected = False
+            return []
+        if not self.__connected:
+            # everything queued until now is replayed
+            self.__connected = True
+            self.__backlog = len(self.__pending)
+        if now < self.__next_send or self.__lingers(now) > 0:
+            return []
+        self.__tokens = min(self.__replay_batch, self.__tokens + (now - self.__last_refill) * self.__replay_rate)
+        self.__last_refill = now
+
+        batch = []
+        while len(self.__pending) > 0 and self.__unacked_publishes < __MAX_INFLIGHT__ and self.__may_send():
+            topic = self.__pending[0][1]
+            (entries, payloads) = ([], [])
+            while len(self.__pending) > 0 and self.__pending[0][1] == topic and \
+                    len(payloads) < self.__batch_size and self.__may_send():
+                message = self.__pending.popleft()
+                entry = [message[0], False, self.__backlog > 0]
+                self.__inflight.append(entry)
+                entries.append(entry)
+                payloads.append(message[2])
+                if self.__backlog > 0:
+                    # only replayed messages are charged
+                    self.__backlog -= 1
+                    self.__tokens -= 1
+            self.__unacked += len(entries)
+            self.__unacked_publishes += 1
+            batch.append((entries, topic, payloads))
+        if self.__backlog > 0 and self.__tokens < 1:
+            # bucket is empty - next batch of backlog once it's full again
+            self.__next_send = now + self.__replay_batch / self.__replay_rate
+        return batch
+
+    def __may_send(self):
+        """
+        Returns:\n
+        \tbool whether the first pending message can be sent (live messages always, backlog while tokens last)
+        """
+        return self.__backlog == 0 or self.__tokens >= 1
+
+    def __publish(self, batch):
+        published = []
+        for (entries, topic, payloads) in batch:
+            payload = self.__encode_batch(payloads) if len(payloads) > 1 else payloads[0]
+            if payload is not None:
+                published.append((entries, self.__client.publish(topic, payload, qos=1).mid))
+            else:
+                # batch isn't accepted by every server
+                published.extend(([entry], self.__client.publish(topic, payload, qos=1).mid)
+                                 for (entry, payload) in zip(entries, payloads))
+
+        with self.__cond:
+            # batch sent one by one is more than one publish to acknowledge
+            self.__unacked_publishes += len(published) - len(batch)
+            for (entries, mid) in published:
+                if mid in self.__early_acks:
+                    self.__acknowledge(entries)
+                else:
+                    self.__by_mid[mid] = entries
+            # the rest are acknowledgements of other (QoS 0) messages
+            self.__early_acks.clear()
+            self.__stats['published'] += len(published)
+
+    def __sync(self):
+        with self.__cond:
+            unsynced = self.__unsynced
+            self.__unsynced = False
+            head = (self.__generation, self.__head)
+            compact = self.__head - __HEADER__.size >= __COMPACT_BYTES__
+        if unsynced:
+            os.fsync(self.__file.fileno())
+        if compact:
+            self.__compact()
+        elif head != self.__written_head:
+            self.__write_head(*head)
+            self.__written_head = head
+
+    def __compact(self):
+        with self.__cond:
+            self.__file.flush()
+            self.__file.seek(self.__head)
+            frames = self.__file.read()
+            # generation is written to the head file only after the new file is in place -
+            # crash in between is recognized by generation of the file being one ahead
+            self.__write_new_file(self.__generation + 1, frames)
+            head = (self.__generation, self.__head)
+        self.__write_head(*head)
+        self.__written_head = head
+
+    def __log_stats(self, interval):
+        with self.__cond:
+            stats = dict(self.__stats)
+            depth = self.__unacked + len(self.__pending)
+            inflight = self.__unacked
+            for key in self.__stats.keys():
+                self.__stats[key] = 0
+        if depth > 0 or any(stats.values()):
+            logging.info('[%s] depth %d (%d in flight), queued %d, acknowledged live %.1f msg/s, '
+                         'replayed %.1f msg/s (%d live, %d replayed in %d publishes), %d dropped',
+                         self, depth, inflight, stats['queued'], stats['live'] / interval,
+                         stats['replayed'] / interval, stats['live'], stats['replayed'],
+                         stats['published'], stats['dropped'])
+
+    def __run(self):
+        self.__last_refill = lastSync = lastStats = time.monotonic()
+        while True:
+            with self.__cond:
+                if self.__stopping:
+                    break
+                now = time.monotonic()
+                batch = self.__take_batch(now)
+                if len(batch) == 0:
+                    timeout = self.__fsync_interval
+                    if len(self.__pending) > 0 and self.__next_send > now:
+                        timeout = min(timeout, self.__next_send - now)
+                    if len(self.__pending) > 0 and self.__lingers(now) > 0:
+                        timeout = min(timeout, self.__lingers(now))
+                    self.__cond.wait(timeout)
+
+            if len(batch) > 0:
+                self.__publish(batch)
+
+            now = time.monotonic()
+            if now - lastSync >= self.__fsync_interval:
+                self.__sync()
+                lastSync = now
+            if now - lastStats >= __STATS_INTERVAL__:
+                self.__log_stats(now - lastStats)
+                lastStats = now
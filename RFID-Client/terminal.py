@@ -10,12 +10,39 @@ import rfid
 import json
 import threading
 from mqttConstans import *
+from wire import FORMAT_BATCH, FORMAT_BINARY, SUPPORTED_FORMATS, encodeBatch, encodeRecord, encodeRecordJson
+from outbox import Outbox
 from zipfile import ZipFile, ZIP_BZIP2
 from datetime import datetime as date
 
 
-# The MQTT client.
-client = mqtt.Client()
+# The MQTT client (client id is matched by broker's ACL of per-terminal topic)
+client = mqtt.Client(client_id=TERMINAL_ID)
+
+# server-id -> formats of rfid/record the server accepts
+__server_formats = {}
+
+
+def __encode_batch(payloads):
+    """
+    Returns:\n
+    \tbytes batch of scans if every known server accepts batches, otherwise None (scans are sent one by one)
+    """
+    if len(__server_formats) == 0 or not all(FORMAT_BATCH in formats for formats in __server_formats.values()):
+        return None
+    return encodeBatch(payloads)
+
+
+# Scans waiting for acknowledgement of the broker (published with QoS 1)
+outbox = Outbox(client, OUTBOX_PATH, OUTBOX_MAX_MESSAGES, OUTBOX_FSYNC_INTERVAL,
+                OUTBOX_REPLAY_RATE, OUTBOX_REPLAY_BATCH,
+                batchSize=PUBLISH_BATCH_SIZE, linger=PUBLISH_BATCH_LINGER, encodeBatch=__encode_batch)
+
+# max delay (in seconds) between attempts to reconnect to the broker
+__MAX_RECONNECT_DELAY__ = 30
+
+# server-id -> index of this terminal for binary records (None - server accepts only JSON)
+__server_indexes = {}
 
 # path to current session log
 __SESSION_LOG_PATH__ = f"{date.now().strftime('%d-%m-%Y-%H-%M-%S')}.log"
@@ -39,8 +66,8 @@ logging.debug('logger configured correctly')
 
 def __call_server(topic, msg_json):
     client.publish(topic, msg_json)
-    logging.info(
-        f'sent MQTT message: [{topic}] {msg_json}')
+    logging.info('sent MQTT message: [%s] %s', topic,
+                 msg_json.hex() if isinstance(msg_json, bytes) else msg_json)
 
 
 def __process_message(client, userdata, msg):
@@ -49,11 +76,33 @@ def __process_message(client, userdata, msg):
     if msg.topic == BROADCAST_REQUEST:
         logging.info(
             f'received broadcast msg from server with id={msg_json[JSON_SERVER_ID]}')
+        # servers older than format negotiation advertise nothing (JSON only)
+        formats = msg_json.get(JSON_FORMATS, [])
+        __server_formats[msg_json[JSON_SERVER_ID]] = set(formats)
+        terminalIndexes = msg_json.get(JSON_TERMINAL_INDEXES, {})
+        if FORMAT_BINARY in formats and TERMINAL_ID in terminalIndexes:
+            __server_indexes[msg_json[JSON_SERVER_ID]] = terminalIndexes[TERMINAL_ID]
+        else:
+            __server_indexes[msg_json[JSON_SERVER_ID]] = None
         reply = json.dumps({JSON_TERMINAL_ID: TERMINAL_ID,
-                            JSON_SERVER_ID: msg_json[JSON_SERVER_ID]})
+                            JSON_SERVER_ID: msg_json[JSON_SERVER_ID],
+                            JSON_FORMATS: list(SUPPORTED_FORMATS)})
         __call_server(BROADCAST_REPLY, reply)
 
 
+def __binary_index():
+    """
+    Returns:\n
+    \tint index of this terminal if every known server accepts binary records with the same index, otherwise None
+    """
+    if WIRE_FORMAT != 'auto':
+        return None
+    indexes = set(__server_indexes.values())
+    if len(indexes) != 1:
+        return None
+    return indexes.pop()
+
+
 def __connect_to_broker():
     if TLS_ENABLED:
         if TLS_CERT_FILE == "":
@@ -63,25 +112,45 @@ def __connect_to_broker():
             client.username_pw_set(
                 username=TLS_USERNAME, password=TLS_PASSWORD)
     
+    client.on_message = __process_message
+    client.on_connect = __on_connect
+    client.on_disconnect = __on_disconnect
+    client.on_publish = outbox.onPublish
+    # broker may be unreachable (also at start) - network thread keeps reconnecting
+    client.reconnect_delay_set(max_delay=__MAX_RECONNECT_DELAY__)
     if PORT == 0:
-        client.connect(BROKER)
+        client.connect_async(BROKER)
     else:
-        client.connect(BROKER, port=PORT)
-    client.on_message = __process_message
+        client.connect_async(BROKER, port=PORT)
     client.loop_start()
+    outbox.start()
+
+
+def __on_connect(client, userdata, flags, rc):
+    if rc != 0:
+        logging.error('connection refused by broker: %s (rc=%d)', BROKER, rc)
+        return
+    # subscriptions don't survive reconnect
     client.subscribe(BROADCAST_REQUEST)
-    logging.info(f'connected to broker: {BROKER}')
+    logging.info('connected to broker: %s, %d scans queued', BROKER, outbox.getDepth())
 
     msg_json = json.dumps(
         {JSON_TERMINAL_ID: TERMINAL_ID, JSON_TEXT: 'Client connected'})
     __call_server(TERMINAL_DEBUG, msg_json)
 
 
+def __on_disconnect(client, userdata, rc):
+    if rc != 0:
+        logging.warning('lost connection to broker: %s (rc=%d), scans are queued until reconnect', BROKER, rc)
+
+
 def __disconnect_from_broker():
     msg_json = json.dumps(
         {JSON_TERMINAL_ID: TERMINAL_ID, JSON_TEXT: 'Client disconnected'})
     __call_server(TERMINAL_DEBUG, msg_json)
-    logging.info(f'disconnected from broker: {BROKER}')
+    # scans not acknowledged yet are sent after next start
+    outbox.stop()
+    logging.info('disconnected from broker: %s, %d scans left queued', BROKER, outbox.getDepth())
     client.disconnect()
     client.loop_stop()
 
@@ -94,10 +163,15 @@ def __rfid_scan_loop(terminal_id):
         if rfid_uid != -1:
             if prev_rfid_uid != rfid_uid:
                 prev_rfid_uid = rfid_uid
-                msg_json = json.dumps({JSON_RFID_UID: rfid_uid, JSON_TERMINAL_ID: TERMINAL_ID,
-                                       JSON_RFID_DATE: date.now().strftime("%d.%m.%Y.%H.%M")})
-                __call_server(
-                    RFID_RECORD, msg_json)
+                terminalIndex = __binary_index()
+                if terminalIndex is None:
+                    msg = encodeRecordJson(rfid_uid, TERMINAL_ID, date.now())
+                else:
+                    msg = encodeRecord(rfid_uid, terminalIndex, date.now())
+                outbox.put(RFID_RECORD_PREFIX + TERMINAL_ID, msg)
+                # published by outbox (possibly in a batch with other scans)
+                logging.debug('queued MQTT message: [%s] %s', RFID_RECORD_PREFIX + TERMINAL_ID,
+                             msg.hex() if isinstance(msg, bytes) else msg)
         else:
             prev_rfid_uid = -1
 
@@ -0,0 +1,6 @@
+#!/usr/bin/env python3
+import os
+import sys
+
+# terminal modules are imported from the RFID-Client directory (as terminal.py does)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+import threading
+import time
+
+import pytest
+
+from outbox import Outbox
+
+# seconds a test waits for the sender thread
+__TIMEOUT__ = 5
+
+
+class FakeClient:
+    """
+    paho client stand-in - publishes are recorded and acknowledged at once (unless acknowledge is False)
+    """
+
+    def __init__(self, connected=True, acknowledge=True):
+        self.connected = connected
+        self.acknowledge = acknowledge
+        self.on_publish = None
+        self.published = []
+        self.__mid = 0
+        self.__lock = threading.Lock()
+
+    def is_connected(self):
+        return self.connected
+
+    def publish(self, topic, payload, qos=0):
+        with self.__lock:
+            self.__mid += 1
+            mid = self.__mid
+            self.published.append((topic, payload))
+        if self.acknowledge:
+            self.on_publish(self, None, mid)
+        return _MessageInfo(mid)
+
+
+class _MessageInfo:
+    def __init__(self, mid):
+        self.mid = mid
+
+
+def _start_outbox(path, client):
+    outbox = Outbox(client, str(path), fsyncInterval=0.01, replayRate=10000, replayBatch=100)
+    client.on_publish = outbox.onPublish
+    outbox.start()
+    return outbox
+
+
+def _wait_until(condition):
+    deadline = time.monotonic() + __TIMEOUT__
+    while not condition():
+        assert time.monotonic() < deadline, 'outbox did not get there in time'
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def queuePath(tmp_path):
+    return tmp_path / 'outbox.dat'
+
+
+def test_messages_queued_while_disconnected_are_replayed_after_restart(queuePath):
+    outbox = _start_outbox(queuePath, FakeClient(connected=False))
+    for index in range(5):
+        outbox.put('rfid/record/T1', f'scan-{index}')
+    outbox.stop()
+
+    client = FakeClient(connected=False)
+    outbox = _start_outbox(queuePath, client)
+    assert outbox.getDepth() == 5
+    client.connected = True
+    _wait_until(lambda: outbox.getDepth() == 0)
+    assert client.published == [('rfid/record/T1', f'scan-{index}'.encode()) for index in range(5)]
+    outbox.stop()
+
+    client = FakeClient()
+    outbox = _start_outbox(queuePath, client)
+    assert outbox.getDepth() == 0
+    outbox.stop()
+    assert client.published == []
+
+
+def test_published_but_unacknowledged_messages_are_replayed(queuePath):
+    client = FakeClient(acknowledge=False)
+    outbox = _start_outbox(queuePath, client)
+    for index in range(3):
+        outbox.put('rfid/record/T1', f'scan-{index}')
+    _wait_until(lambda: len(client.published) == 3)
+    outbox.stop()
+
+    client = FakeClient()
+    outbox = _start_outbox(queuePath, client)
+    _wait_until(lambda: outbox.getDepth() == 0)
+    outbox.stop()
+    assert [payload for (_, payload) in client.published] == [b'scan-0', b'scan-1', b'scan-2']
+
+
+def test_torn_message_is_dropped_on_load(queuePath):
+    outbox = _start_outbox(queuePath, FakeClient(connected=False))
+    outbox.put('rfid/record/T1', 'scan-0')
+    outbox.put('rfid/record/T1', 'scan-1')
+    outbox.stop()
+    # crash in the middle of appending the next message
+    with open(queuePath, 'ab') as queueFile:
+        queueFile.write(b'\x01\x02\x03\x04\x05')
+
+    client = FakeClient(connected=False)
+    outbox = _start_outbox(queuePath, client)
+    assert outbox.getDepth() == 2
+    client.connected = True
+    outbox.put('rfid/record/T1', 'scan-2')
+    _wait_until(lambda: outbox.getDepth() == 0)
+    outbox.stop()
+    assert [payload for (_, payload) in client.published] == [b'scan-0', b'scan-1', b'scan-2']
+
+
+def test_put_after_stop_is_dropped(queuePath):
+    outbox = _start_outbox(queuePath, FakeClient(connected=False))
+    outbox.stop()
+    assert not outbox.put('rfid/record/T1', 'scan-0')
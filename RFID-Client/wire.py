@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+import json
+import struct
+from datetime import datetime, timedelta
+from mqttConstans import *
+
+# rfid/record payload formats (versions are negotiated in broadcast handshake)
+FORMAT_JSON = 1
+FORMAT_BINARY = 2
+FORMAT_BATCH = 3
+SUPPORTED_FORMATS = (FORMAT_JSON, FORMAT_BINARY, FORMAT_BATCH)
+
+# binary rfid/record (little-endian, 19 bytes):
+# format version, rfid-uid, terminal index (assigned by server), seconds since 1970-01-01 (local time)
+__BINARY_RECORD__ = struct.Struct('<BQHq')
+__EPOCH__ = datetime(1970, 1, 1)
+# batch of rfid/record payloads (JSON or binary, mixed):
+# format version, number of records, then every record prefixed by its length
+__BATCH_HEADER__ = struct.Struct('<BH')
+__BATCH_ITEM__ = struct.Struct('<H')
+
+
+def encodeRecord(rfid_uid, terminalIndex, date):
+    """
+    Returns:\n
+    \tbytes binary rfid/record payload
+    """
+    return __BINARY_RECORD__.pack(FORMAT_BINARY, rfid_uid, terminalIndex,
+                                  (date - __EPOCH__) // timedelta(seconds=1))
+
+
+def encodeBatch(payloads):
+    """
+    payloads: list of rfid/record payloads (str JSON or bytes binary)\n
+    Returns:\n
+    \tbytes batch rfid/record payload
+    """
+    parts = [__BATCH_HEADER__.pack(FORMAT_BATCH, len(payloads))]
+    for payload in payloads:
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        parts.append(__BATCH_ITEM__.pack(len(payload)))
+        parts.append(payload)
+    return b''.join(parts)
+
+
+def encodeRecordJson(rfid_uid, terminal_id, date):
+    """
+    Returns:\n
+    \tstr JSON rfid/record payload
+    """
+    return json.dumps({JSON_RFID_UID: rfid_uid, JSON_TERMINAL_ID: terminal_id,
+                       JSON_RFID_DATE: date.strftime("%d.%m.%Y.%H.%M")})
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Operations of src.data.EmployeesDataBase on synthetic databases - addEmployee, addEntry
+(single entries into populated database), getEmployeesDataSummary with and without history,
+generateReport, save (lock hold and background write), checkpoint and load of the database
+written by them. Peak memory and size of the data files are reported for every scale.\n
+Scale is EMPLOYEES:ENTRIES (e.g. 100000:20000000), history is spread chronologically over
+about two scans a day per employee. Every scale runs in its own process (peak RSS of one doesn't
+hide another, load is measured in a fresh process too) in a temporary working directory.
+Results written by --output carry the commit and machine they were measured on, so runs
+of different commits can be compared.
+
+usage (from RFID-Server-App directory):
+    python -m benchmarks.data_layer [--scale 1000:100000 10000:1000000] [--backend pickle sqlite]
+                                    [--ops 2000] [--reports 20] [--json] [--output results.json]
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+__SERVER_DIR__ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, __SERVER_DIR__)
+
+__DEFAULT_SCALES__ = ['1000:100000', '10000:1000000']
+__BACKENDS__ = ('pickle', 'sqlite')
+__TERMINALS__ = [f'terminal-{index}' for index in range(16)]
+__START_DATE__ = datetime.datetime(2019, 1, 1, 6, 0)
+# entries are added to the database in batches of this size while it is populated
+__POPULATE_BATCH__ = 10000
+# history is spread over this many minutes per round of scans (every employee scans once a round)
+__ROUND_MINUTES__ = 12 * 60
+
+
+def __rfid(employee):
+    return 1_000_003 * (employee + 1)
+
+
+def __generate_batches(employees, entries):
+    """
+    Returns:\n
+    \titerator of list of tuple(int rfid-uid, str terminal, datetime date) - chronological history
+    """
+    step = datetime.timedelta(minutes=__ROUND_MINUTES__ / employees)
+    date = __START_DATE__
+    batch = []
+    for index in range(entries):
+        batch.append((__rfid(index % employees), __TERMINALS__[index % len(__TERMINALS__)], date))
+        date += step
+        if len(batch) == __POPULATE_BATCH__:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+def __maxrss_bytes():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def __data_files(dataDir):
+    """
+    Returns:\n
+    \tdict name -> int bytes of files (directories summed) in the data directory
+    """
+    sizes = {}
+    for name in sorted(os.listdir(dataDir)):
+        path = os.path.join(dataDir, name)
+        if os.path.isdir(path):
+            sizes[name] = sum(os.path.getsize(os.path.join(root, file))
+                              for (root, _, files) in os.walk(path) for file in files)
+        else:
+            sizes[name] = os.path.getsize(path)
+    return sizes
+
+
+def __wait_for_save(database, saves):
+    while database.getSaveStats()['saves'] == saves:
+        time.sleep(0.001)
+    return database.getSaveStats()
+
+
+def __timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return (time.perf_counter() - start, result)
+
+
+def __measure_build(backend, employees, entries, ops, reports, seed, dataDir, results):
+    from src.data import EmployeesDataBase
+
+    randomizer = random.Random(seed)
+    database = EmployeesDataBase(backend, dataDir=dataDir)
+    result = {}
+
+    start = time.perf_counter()
+    for employee in range(employees):
+        database.addEmployee(__rfid(employee), name=f'Employee {employee}')
+    result['add_employee_us'] = round((time.perf_counter() - start) / employees * 1e6, 2)
+
+    start = time.perf_counter()
+    for batch in __generate_batches(employees, entries):
+        database.addEntries(batch)
+    seconds = time.perf_counter() - start
+    result['populate_seconds'] = round(seconds, 3)
+    result['populate_entries_per_second'] = round(entries / seconds)
+    result['populated_rss_bytes'] = __maxrss_bytes()
+
+    (seconds, _) = __timed(database.checkpoint)
+    result['checkpoint_seconds'] = round(seconds, 3)
+
+    # single entries after the synthetic history, into random employees
+    date = __START_DATE__ + datetime.timedelta(minutes=__ROUND_MINUTES__ * (entries // employees + 1))
+    sample = [(__rfid(randomizer.randrange(employees)), randomizer.choice(__TERMINALS__),
+               date + datetime.timedelta(minutes=index)) for index in range(ops)]
+    start = time.perf_counter()
+    for (rfid, terminal, entryDate) in sample:
+        database.addEntry(rfid, terminal, entryDate)
+    result['add_entry_us'] = round((time.perf_counter() - start) / ops * 1e6, 2)
+
+    saves = database.getSaveStats()['saves']
+    (seconds, _) = __timed(database.save)
+    stats = __wait_for_save(database, saves)
+    result['save_call_ms'] = round(seconds * 1000, 3)
+    result['save_lock_hold_ms'] = round(stats['last_lock_hold'] * 1000, 3)
+    result['save_seconds'] = round(stats['last_save_duration'], 3)
+
+    (seconds, _) = __timed(database.getEmployeesDataSummary, False)
+    result['summary_seconds'] = round(seconds, 4)
+    (seconds, _) = __timed(database.getEmployeesDataSummary, True)
+    result['summary_with_history_seconds'] = round(seconds, 4)
+
+    reported = [__rfid(randomizer.randrange(employees)) for _ in range(reports)]
+    start = time.perf_counter()
+    for rfid in reported:
+        database.generateReport(rfid)
+    result['report_ms'] = round((time.perf_counter() - start) / max(1, reports) * 1000, 3)
+
+    database.close()
+    result['peak_rss_bytes'] = __maxrss_bytes()
+    results.put(result)
+
+
+def __measure_load(backend, dataDir, results):
+    from src.data import EmployeesDataBase
+
+    before = __maxrss_bytes()
+    (seconds, database) = __timed(EmployeesDataBase, backend, dataDir)
+    employees = len(database.getEmployeesDataSummary(False))
+    result = {
+        'load_seconds': round(seconds, 3),
+        'load_rss_bytes': __maxrss_bytes() - before,
+        'loaded_employees': employees
+    }
+    database.close()
+    results.put(result)
+
+
+def __run_process(target, args):
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=target, args=args + (queue,))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def run(scales, backends, ops, reports, seed=0):
+    """
+    scales: list of tuple(int employees, int entries)\n
+    runs in a temporary working directory (server modules create their files relative to it)\n
+    Returns:\n
+    \tlist of dict results (one for every backend and scale)
+    """
+    results = []
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workDir:
+        os.chdir(workDir)
+        try:
+            for backend in backends:
+                for (employees, entries) in scales:
+                    dataDir = tempfile.mkdtemp(dir=workDir)
+                    result = {'backend': backend, 'employees': employees, 'entries': entries}
+                    result.update(__run_process(
+                        __measure_build, (backend, employees, entries, ops, reports, seed, dataDir)))
+                    files = __data_files(dataDir)
+                    result['data_bytes'] = sum(files.values())
+                    result['data_files'] = files
+                    result.update(__run_process(__measure_load, (backend, dataDir)))
+                    results.append(result)
+        finally:
+            os.chdir(cwd)
+    return results
+
+
+def __commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=__SERVER_DIR__,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def __scale(text):
+    try:
+        (employees, entries) = (int(value) for value in text.split(':'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'"{text}" is not EMPLOYEES:ENTRIES')
+    if employees <= 0 or entries < 0:
+        raise argparse.ArgumentTypeError(f'"{text}" - employees must be positive')
+    return (employees, entries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', type=__scale, nargs='+', default=[__scale(scale) for scale in __DEFAULT_SCALES__],
+                        help='EMPLOYEES:ENTRIES of synthetic database')
+    parser.add_argument('--backend', choices=__BACKENDS__, nargs='+', default=list(__BACKENDS__))
+    parser.add_argument('--ops', type=int, default=2000,
+                        help='number of timed single addEntry calls')
+    parser.add_argument('--reports', type=int, default=20,
+                        help='number of timed generateReport calls')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true',
+                        help='print results as JSON')
+    parser.add_argument('--output',
+                        help='write results with run metadata to JSON file')
+    args = parser.parse_args()
+
+    results = run(args.scale, args.backend, max(1, args.ops), args.reports, args.seed)
+    if args.output is not None:
+        with open(args.output, 'w') as outputFile:
+            json.dump({'date': datetime.datetime.now().isoformat(timespec='seconds'),
+                       'commit': __commit(), 'python': platform.python_version(),
+                       'platform': platform.platform(), 'cpus': os.cpu_count(),
+                       'results': results}, outputFile, indent=4)
+    if args.json:
+        print(json.dumps(results, indent=4))
+    else:
+        for result in results:
+            print(f"{result['backend']} - {result['employees']} employees, {result['entries']} entries:")
+            print(f"\taddEmployee {result['add_employee_us']} us, addEntry {result['add_entry_us']} us, "
+                  f"populated at {result['populate_entries_per_second']} entries/s")
+            print(f"\tsummary {result['summary_seconds']} s, with history "
+                  f"{result['summary_with_history_seconds']} s, report {result['report_ms']} ms")
+            print(f"\tsave {result['save_seconds']} s (lock held {result['save_lock_hold_ms']} ms), "
+                  f"checkpoint {result['checkpoint_seconds']} s, load {result['load_seconds']} s")
+            print(f"\tpeak RSS {result['peak_rss_bytes'] / 2**20:.1f} MiB "
+                  f"(load {result['load_rss_bytes'] / 2**20:.1f} MiB), "
+                  f"data files {result['data_bytes'] / 2**20:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+In-process stand-in for MQTT broker and paho client (subset used by the server and terminals).\n
+FakeClient supports both paho loop styles - loop_start() (network thread) and external loop
+driven through socket callbacks (on_socket_open, loop_read...), so it works with asyncio mode.
+Clients connected with clean_session=False keep their subscriptions while disconnected - QoS 1 messages
+are queued for them and delivered when a client with the same client id connects.
+"""
+import select
+import socket
+import threading
+from collections import deque
+from paho.mqtt.client import MQTT_ERR_INVAL, MQTT_ERR_NO_CONN, MQTT_ERR_SUCCESS, topic_matches_sub
+
+
+class FakeMessage:
+    __slots__ = ('topic', 'payload', 'qos', 'retain', 'mid')
+
+    def __init__(self, topic, payload, qos=0, retain=False, mid=0):
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = retain
+        self.mid = mid
+
+
+class FakeMessageInfo:
+    def __init__(self, mid):
+        self.mid = mid
+        self.rc = MQTT_ERR_SUCCESS
+
+    def wait_for_publish(self, timeout=None):
+        pass
+
+    def is_published(self):
+        return True
+
+
+class FakeBroker:
+    def __init__(self):
+        self.__lock = threading.Lock()
+        # client -> dict str subscription -> int qos
+        self.__subscriptions = {}
+        # client id -> tuple(dict subscriptions, list of queued messages) of disconnected persistent sessions
+        self.__sessions = {}
+        self.__published = 0
+
+    def connect(self, client):
+        (subscriptions, queued) = ({}, [])
+        with self.__lock:
+            if not client.isCleanSession():
+                (subscriptions, queued) = self.__sessions.pop(client.getClientId(), (subscriptions, queued))
+            self.__subscriptions[client] = subscriptions
+        for message in queued:
+            client.deliver(message)
+
+    def disconnect(self, client):
+        with self.__lock:
+            subscriptions = self.__subscriptions.pop(client, None)
+            if subscriptions is not None and not client.isCleanSession():
+                self.__sessions[client.getClientId()] = (subscriptions, [])
+
+    def subscribe(self, client, topic, qos=0):
+        with self.__lock:
+            self.__subscriptions[client][topic] = qos
+
+    def unsubscribe(self, client, topic):
+        with self.__lock:
+            self.__subscriptions.get(client, {}).pop(topic, None)
+
+    def publish(self, message):
+        with self.__lock:
+            self.__published += 1
+            receivers = [client for (client, topics) in self.__subscriptions.items()
+                         if any(topic_matches_sub(topic, message.topic) for topic in topics)]
+            if message.qos > 0:
+                for (subscriptions, queued) in self.__sessions.values():
+                    if any(qos > 0 and topic_matches_sub(topic, message.topic)
+                           for (topic, qos) in subscriptions.items()):
+                        queued.append(message)
+        for client in receivers:
+            client.deliver(message)
+
+    def getPublishedCount(self):
+        return self.__published
+
+
+class FakeClient:
+    """
+    paho.mqtt.client.Client look-alike connected to FakeBroker
+    """
+
+    def __init__(self, broker, client_id="", clean_session=None, userdata=None):
+        self.__broker = broker
+        self.__client_id = client_id
+        # as in paho - persistent session only with client id
+        self.__clean_session = clean_session is not False or client_id == ""
+        self.__userdata = userdata
+        self.__incoming = deque()
+        self.__mid = 0
+        self.__socket_pair = None
+        self.__thread = None
+        self.__running = False
+        self.on_message = None
+        self.on_publish = None
+        self.on_connect = None
+        self.on_disconnect = None
+        self.on_socket_open = None
+        self.on_socket_close = None
+        self.on_socket_register_write = None
+        self.on_socket_unregister_write = None
+
+    def getClientId(self):
+        return self.__client_id
+
+    def isCleanSession(self):
+        return self.__clean_session
+
+    def tls_set(self, *args, **kwargs):
+        pass
+
+    def username_pw_set(self, username, password=None):
+        pass
+
+    def connect(self, host, port=1883, keepalive=60):
+        # readable end becomes readable whenever a message is waiting
+        self.__socket_pair = socket.socketpair()
+        self.__socket_pair[0].setblocking(False)
+        self.__broker.connect(self)
+        if self.on_socket_open is not None:
+            self.on_socket_open(self, self.__userdata, self.__socket_pair[0])
+        if self.on_connect is not None:
+            self.on_connect(self, self.__userdata, {}, 0)
+        return MQTT_ERR_SUCCESS
+
+    def disconnect(self):
+        self.__broker.disconnect(self)
+        if self.__socket_pair is not None:
+            if self.on_socket_close is not None:
+                self.on_socket_close(self, self.__userdata, self.__socket_pair[0])
+            for sock in self.__socket_pair:
+                sock.close()
+            self.__socket_pair = None
+        if self.on_disconnect is not None:
+            self.on_disconnect(self, self.__userdata, 0)
+        return MQTT_ERR_SUCCESS
+
+    def is_connected(self):
+        return self.__socket_pair is not None
+
+    def socket(self):
+        return None if self.__socket_pair is None else self.__socket_pair[0]
+
+    def subscribe(self, topic, qos=0):
+        topics = topic if isinstance(topic, list) else [(topic, qos)]
+        for (subscription, subscriptionQos) in topics:
+            self.__broker.subscribe(self, subscription, subscriptionQos)
+        return (MQTT_ERR_SUCCESS, self.__next_mid())
+
+    def unsubscribe(self, topic):
+        self.__broker.unsubscribe(self, topic)
+        return (MQTT_ERR_SUCCESS, self.__next_mid())
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        elif payload is None:
+            payload = b''
+        mid = self.__next_mid()
+        self.__broker.publish(FakeMessage(topic, payload, qos, retain, mid))
+        # delivered (QoS 0) or acknowledged by broker (QoS 1, 2) right away
+        if self.on_publish is not None:
+            self.on_publish(self, self.__userdata, mid)
+        return FakeMessageInfo(mid)
+
+    def __next_mid(self):
+        self.__mid += 1
+        return self.__mid
+
+    def deliver(self, message):
+        """
+        called by broker (from publisher's thread)
+        """
+        pair = self.__socket_pair
+        if pair is None:
+            return
+        self.__incoming.append(message)
+        try:
+            pair[1].send(b'\0')
+        except OSError:
+            pass
+
+    def loop_read(self, max_packets=1):
+        pair = self.__socket_pair
+        if pair is None:
+            return MQTT_ERR_SUCCESS
+        try:
+            count = len(pair[0].recv(4096))
+        except (BlockingIOError, OSError):
+            count = 0
+        for _ in range(count):
+            if not self.__incoming:
+                break
+            message = self.__incoming.popleft()
+            if self.on_message is not None:
+                self.on_message(self, self.__userdata, message)
+        return MQTT_ERR_SUCCESS
+
+    def loop_write(self, max_packets=1):
+        return MQTT_ERR_SUCCESS
+
+    def loop_misc(self):
+        return MQTT_ERR_SUCCESS if self.__socket_pair is not None else MQTT_ERR_NO_CONN
+
+    def want_write(self):
+        return False
+
+    def __loop_forever(self):
+        while self.__running and self.__socket_pair is not None:
+            try:
+                (readable, _, _) = select.select([self.__socket_pair[0]], [], [], 0.1)
+            except (OSError, ValueError, TypeError):
+                break
+            if readable:
+                self.loop_read()
+
+    def loop_start(self):
+        self.__running = True
+        self.__thread = threading.Thread(target=self.__loop_forever, daemon=True)
+        self.__thread.start()
+        return MQTT_ERR_SUCCESS
+
+    def loop_stop(self, force=False):
+        if self.__thread is None:
+            return MQTT_ERR_INVAL
+        self.__running = False
+        self.__thread.join()
+        self.__thread = None
+        return MQTT_ERR_SUCCESS
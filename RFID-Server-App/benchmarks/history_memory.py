@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Memory used by employees' history: list of 6-tuples (old layout) vs typed columns (storage.History)\n
+Columns are array('q') minutes and array('I') terminal indexes (12 B/entry) with work sessions
+as array('q') starts and ends (16 B/session) - measured 10M entries: 137 B/entry as tuples,
+21-29 B/entry as columns (depends on over-allocation of arrays at the moment RSS peaks).
+
+usage (from RFID-Server-App directory):
+    python -m benchmarks.history_memory [--entries 10000000] [--employees 1000] [--json]
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import resource
+import time
+from src.storage import History, dateToMinutes
+
+__TERMINALS__ = [f'terminal-{index}' for index in range(16)]
+__START_DATE__ = datetime.datetime(2015, 1, 1, 6, 0)
+
+
+def __generate_dates(entries, employees):
+    # every employee scans roughly twice a day, spread over the history period
+    step = datetime.timedelta(minutes=(12 * 60) // max(1, employees // 16 + 1) + 1)
+    date = __START_DATE__
+    for index in range(entries):
+        yield (index % employees, __TERMINALS__[index % len(__TERMINALS__)], date)
+        if index % employees == employees - 1:
+            date += step
+
+
+def __build_tuples(entries, employees):
+    history = {emp: [] for emp in range(employees)}
+    for (emp, terminal, date) in __generate_dates(entries, employees):
+        history[emp].append(
+            tuple([date.day, date.month, date.year, date.hour, date.minute, terminal]))
+    return history
+
+
+def __build_columns(entries, employees):
+    history = {emp: History() for emp in range(employees)}
+    terminalIndex = {terminal: index for (index, terminal) in enumerate(__TERMINALS__)}
+    for (emp, terminal, date) in __generate_dates(entries, employees):
+        history[emp].add(dateToMinutes(date), terminalIndex[terminal])
+    return history
+
+
+__LAYOUTS__ = {
+    'tuples': __build_tuples,
+    'columns': __build_columns
+}
+
+
+def __maxrss_bytes():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def __measure(layout, entries, employees, results):
+    before = __maxrss_bytes()
+    start = time.perf_counter()
+    history = __LAYOUTS__[layout](entries, employees)
+    elapsed = time.perf_counter() - start
+    used = __maxrss_bytes() - before
+    results.put({
+        'layout': layout,
+        'entries': entries,
+        'employees': employees,
+        'build_seconds': round(elapsed, 3),
+        'memory_bytes': used,
+        'bytes_per_entry': round(used / entries, 2)
+    })
+    del history
+
+
+def run(entries, employees):
+    """
+    Returns:\n
+    \tlist of dict results (one for every layout)
+    """
+    results = []
+    queue = multiprocessing.Queue()
+    for layout in __LAYOUTS__.keys():
+        # fresh process for every layout so peak RSS of one doesn't hide the other
+        process = multiprocessing.Process(
+            target=__measure, args=(layout, entries, employees, queue))
+        process.start()
+        results.append(queue.get())
+        process.join()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--entries', type=int, default=10_000_000)
+    parser.add_argument('--employees', type=int, default=1000)
+    parser.add_argument('--json', action='store_true',
+                        help='print results as JSON')
+    args = parser.parse_args()
+
+    results = run(args.entries, args.employees)
+    if args.json:
+        print(json.dumps(results, indent=4))
+    else:
+        for result in results:
+            print(f"{result['layout']:>8}: {result['memory_bytes'] / 2**20:10.1f} MiB "
+                  f"({result['bytes_per_entry']} B/entry, built in {result['build_seconds']} s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+End-to-end load test of the server: simulated terminals send scans through the in-process broker
+(benchmarks.fakebroker) to a real src.server.Server - throughput and latency from scan
+(terminal's outbox) to completion of EmployeesDataBase.addEntries.\n
+Every terminal publishes like terminal.py does - its own client and durable outbox (QoS 1, batches),
+per-terminal topic, binary or JSON records encoded by the terminal's wire module.
+Scan patterns: 'steady' - Poisson arrivals, 'shift-change' - most scans in two bursts
+(shift arrival and departure) on top of a steady trickle.\n
+Server files (whitelist, database, logs) are kept in a temporary working directory.
+
+usage (from RFID-Server-App directory):
+    python -m benchmarks.loadgen [--terminals 8] [--employees 500] [--rate 50 200 800] [--duration 10]
+                                 [--pattern shift-change] [--format binary] [--batch 16] [--linger 0.1]
+                                 [--mode threaded asyncio] [--backend pickle] [--shards 0]
+                                 [--json] [--output results.json]
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+__SERVER_DIR__ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, __SERVER_DIR__)
+# terminal's outbox and wire format (RFID-Client has no package) - after the server,
+# both have config module
+sys.path.append(os.path.join(__SERVER_DIR__, '..', 'RFID-Client'))
+from benchmarks.fakebroker import FakeBroker, FakeClient
+from mqttConstans import RFID_RECORD_PREFIX
+from outbox import Outbox
+from wire import encodeBatch, encodeRecord, encodeRecordJson
+
+__PATTERNS__ = ('steady', 'shift-change')
+__FORMATS__ = ('binary', 'json')
+__MODES__ = ('threaded', 'asyncio')
+# shift-change pattern: share of scans in bursts, burst centres and spread (fractions of duration)
+__BURST_SHARE__ = 0.8
+__BURST_CENTRES__ = (0.25, 0.75)
+__BURST_WIDTH__ = 0.05
+# records are dated one minute apart, so no scan is dropped as duplicate
+__START_DATE__ = datetime.datetime(2021, 3, 1, 6, 0)
+# longest wait for the server to apply all scans (in seconds)
+__DRAIN_TIMEOUT__ = 120
+
+
+def __percentile(values, percentile):
+    values = sorted(values)
+    return values[(len(values) - 1) * percentile // 100] if values else 0.0
+
+
+def __rfid_of(employee):
+    # rfid-uids spread like card serial numbers
+    return 1_000_003 * (employee + 1)
+
+
+def scanSchedule(pattern, scans, duration, terminals, employees, seed=0):
+    """
+    Returns:\n
+    \tlist of tuple(float offset in seconds, int terminal, int rfid-uid) ordered by offset -
+    every employee uses the terminal at their entrance
+    """
+    rng = random.Random(seed)
+    offsets = []
+    for _ in range(scans):
+        if pattern == 'shift-change' and rng.random() < __BURST_SHARE__:
+            offset = rng.gauss(duration * rng.choice(__BURST_CENTRES__), duration * __BURST_WIDTH__)
+        else:
+            offset = rng.uniform(0, duration)
+        offsets.append(min(max(offset, 0.0), duration))
+    offsets.sort()
+
+    schedule = []
+    for offset in offsets:
+        employee = rng.randrange(employees)
+        schedule.append((offset, employee % terminals, __rfid_of(employee)))
+    return schedule
+
+
+def __peak_rate(schedule):
+    """
+    Returns:\n
+    \tint most scans within one second
+    """
+    (peak, first) = (0, 0)
+    for (last, (offset, _, _)) in enumerate(schedule):
+        while schedule[first][0] <= offset - 1.0:
+            first += 1
+        peak = max(peak, last - first + 1)
+    return peak
+
+
+class SimulatedTerminals:
+    """
+    terminals publishing through their own fake client and outbox, like terminal.py
+    """
+
+    def __init__(self, broker, count, queueDir, recordFormat='binary', batchSize=16, linger=0.1):
+        self.__format = recordFormat
+        self.__terminal_ids = [f'terminal-{index}' for index in range(count)]
+        self.__clients = []
+        self.__outboxes = []
+        for terminal_id in self.__terminal_ids:
+            client = FakeClient(broker)
+            # replay limits are out of the way - scans are sent as they come
+            outbox = Outbox(client, os.path.join(queueDir, f'{terminal_id}.dat'), replayRate=1_000_000,
+                            replayBatch=10_000, batchSize=batchSize, linger=linger,
+                            encodeBatch=encodeBatch if batchSize > 1 else None)
+            client.on_publish = outbox.onPublish
+            self.__clients.append(client)
+            self.__outboxes.append(outbox)
+
+    def getTerminalIds(self):
+        return list(self.__terminal_ids)
+
+    def start(self):
+        for (client, outbox) in zip(self.__clients, self.__outboxes):
+            client.connect('broker')
+            outbox.start()
+
+    def stop(self):
+        for (client, outbox) in zip(self.__clients, self.__outboxes):
+            outbox.stop()
+            client.disconnect()
+
+    def scan(self, terminal, rfid_uid, date):
+        """
+        terminal: index of terminal (same as its index on the server - terminals are whitelisted in order)
+        """
+        terminal_id = self.__terminal_ids[terminal]
+        if self.__format == 'json':
+            payload = encodeRecordJson(rfid_uid, terminal_id, date)
+        else:
+            payload = encodeRecord(rfid_uid, terminal, date)
+        self.__outboxes[terminal].put(RFID_RECORD_PREFIX + terminal_id, payload)
+
+
+class TimedDataBase:
+    """
+    database wrapper recording when every entry was applied
+    """
+
+    def __init__(self, database, expected):
+        """
+        expected: number of entries after which completed is set
+        """
+        self.__database = database
+        self.__expected = expected
+        self.__lock = threading.Lock()
+        # (rfid_uid, date) -> time applied
+        self.applied = {}
+        self.completed = threading.Event()
+
+    def addEntries(self, batch, addUnknownEmployees=False):
+        addedEmployees = self.__database.addEntries(batch, addUnknownEmployees)
+        now = time.perf_counter()
+        with self.__lock:
+            for (rfid_uid, _, date) in batch:
+                self.applied[(rfid_uid, date)] = now
+            if len(self.applied) >= self.__expected:
+                self.completed.set()
+        return addedEmployees
+
+    def __getattr__(self, name):
+        return getattr(self.__database, name)
+
+
+def __create_database(backend, shards, dataDir):
+    from src.data import EmployeesDataBase
+    from src.shards import ShardedDataBase
+    if shards > 1:
+        return ShardedDataBase(shards, backend, dataDir)
+    return EmployeesDataBase(backend, dataDir)
+
+
+def __measure(workDir, mode, pattern, terminals, employees, rate, duration, recordFormat,
+              batchSize, linger, backend, shards, seed):
+    from src.aioserver import AsyncServer
+    from src.constants import DATA_DIR
+    from src.server import Server
+
+    schedule = scanSchedule(pattern, int(rate * duration), duration, terminals, employees, seed)
+    # no whitelist of previous measurement
+    shutil.rmtree(DATA_DIR, ignore_errors=True)
+    os.mkdir(DATA_DIR)
+    runDir = tempfile.mkdtemp(dir=workDir)
+
+    database = __create_database(backend, shards, os.path.join(runDir, 'database'))
+    # employees are created up front, only entries are timed
+    for employee in range(employees):
+        database.addEmployee(__rfid_of(employee))
+    timed = TimedDataBase(database, len(schedule))
+
+    broker = FakeBroker()
+    server = Server(timed, clientFactory=lambda **options: FakeClient(broker, **options))
+    asyncServer = None
+    if mode == 'asyncio':
+        asyncServer = AsyncServer(server)
+        asyncServer.start()
+    else:
+        server.run()
+
+    os.mkdir(os.path.join(runDir, 'queues'))
+    simulated = SimulatedTerminals(broker, terminals, os.path.join(runDir, 'queues'),
+                                   recordFormat, batchSize, linger)
+    for terminal_id in simulated.getTerminalIds():
+        server.addTerminal(terminal_id)
+    simulated.start()
+
+    scanned = {}
+    lag = 0.0
+    start = time.perf_counter()
+    for (index, (offset, terminal, rfid_uid)) in enumerate(schedule):
+        delay = start + offset - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            lag = max(lag, -delay)
+        date = __START_DATE__ + datetime.timedelta(minutes=index)
+        scanned[(rfid_uid, date)] = time.perf_counter()
+        simulated.scan(terminal, rfid_uid, date)
+
+    drained = timed.completed.wait(timeout=__DRAIN_TIMEOUT__)
+    simulated.stop()
+    if asyncServer is not None:
+        asyncServer.stop()
+    else:
+        server.stop()
+    ingestStats = server.getIngestStats()
+    database.close()
+    shutil.rmtree(runDir, ignore_errors=True)
+
+    latencies = [applied - scanned[key] for (key, applied) in timed.applied.items() if key in scanned]
+    elapsed = max(timed.applied.values(), default=start) - start
+    return {
+        'mode': mode,
+        'pattern': pattern,
+        'format': recordFormat,
+        'terminals': terminals,
+        'batch': batchSize,
+        'linger': linger,
+        'backend': backend,
+        'shards': shards,
+        'offered_rate': rate,
+        'offered_peak_rate': __peak_rate(schedule),
+        'scans': len(schedule),
+        'applied': len(latencies),
+        'drained': drained,
+        'messages': ingestStats['messages'],
+        'batches': ingestStats['batches'],
+        'duplicates': ingestStats['duplicates'],
+        'throughput': round(len(latencies) / elapsed, 1) if elapsed > 0 else 0.0,
+        'latency_p50_ms': round(__percentile(latencies, 50) * 1000, 2),
+        'latency_p90_ms': round(__percentile(latencies, 90) * 1000, 2),
+        'latency_p99_ms': round(__percentile(latencies, 99) * 1000, 2),
+        'latency_max_ms': round(max(latencies, default=0.0) * 1000, 2),
+        'generator_lag_ms': round(lag * 1000, 2)
+    }
+
+
+def run(modes, rates, pattern='shift-change', terminals=8, employees=500, duration=10.0,
+        recordFormat='binary', batchSize=16, linger=0.1, backend='pickle', shards=0, seed=0):
+    """
+    runs in a temporary working directory (server creates its files relative to it)\n
+    Returns:\n
+    \tlist of dict results (one for every mode and rate)
+    """
+    results = []
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workDir:
+        os.chdir(workDir)
+        try:
+            for mode in modes:
+                for rate in rates:
+                    results.append(__measure(workDir, mode, pattern, terminals, employees, rate, duration,
+                                             recordFormat, batchSize, linger, backend, shards, seed))
+        finally:
+            os.chdir(cwd)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--terminals', type=int, default=8)
+    parser.add_argument('--employees', type=int, default=500)
+    parser.add_argument('--rate', type=float, nargs='+', default=[50, 200, 800],
+                        help='mean scans per second (all terminals)')
+    parser.add_argument('--duration', type=float, default=10.0,
+                        help='seconds of scans for every rate')
+    parser.add_argument('--pattern', choices=__PATTERNS__, default='shift-change')
+    parser.add_argument('--format', choices=__FORMATS__, default='binary')
+    parser.add_argument('--batch', type=int, default=16,
+                        help='scans per MQTT message (terminal PUBLISH_BATCH_SIZE)')
+    parser.add_argument('--linger', type=float, default=0.1,
+                        help='terminal PUBLISH_BATCH_LINGER (in seconds)')
+    parser.add_argument('--mode', choices=__MODES__, nargs='+', default=['threaded'])
+    parser.add_argument('--backend', default='pickle')
+    parser.add_argument('--shards', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true',
+                        help='print results as JSON')
+    parser.add_argument('--output',
+                        help='write results with run metadata to JSON file')
+    args = parser.parse_args()
+
+    results = run(args.mode, args.rate, args.pattern, args.terminals, args.employees, args.duration,
+                  args.format, args.batch, args.linger, args.backend, args.shards, args.seed)
+    if args.output is not None:
+        with open(args.output, 'w') as outputFile:
+            json.dump({'date': datetime.datetime.now().isoformat(timespec='seconds'),
+                       'python': platform.python_version(), 'platform': platform.platform(),
+                       'cpus': os.cpu_count(), 'results': results}, outputFile, indent=4)
+    if args.json:
+        print(json.dumps(results, indent=4))
+    else:
+        for result in results:
+            print(f"{result['mode']:>8}, {result['offered_rate']:>6.0f} scans/s "
+                  f"(peak {result['offered_peak_rate']}/s): {result['applied']}/{result['scans']} applied, "
+                  f"{result['throughput']:.1f} scans/s, latency p50 {result['latency_p50_ms']:.1f} ms "
+                  f"p99 {result['latency_p99_ms']:.1f} ms max {result['latency_max_ms']:.1f} ms, "
+                  f"generator lag {result['generator_lag_ms']:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
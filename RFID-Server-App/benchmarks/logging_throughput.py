@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Ingestion throughput (messages per second through src.ingest.IngestPipeline into the database)
+by logging setup - logging off, file written synchronously by the logging thread (previous setup),
+records queued to listener thread (src.logger), queued with rate-limited per-scan lines
+(IngestPipeline scanLogRate).\n
+Messages are applied as one burst, time to drain the log queue afterwards is reported separately.
+Server files (database, logs) are kept in a temporary working directory.
+
+usage (from RFID-Server-App directory):
+    python -m benchmarks.logging_throughput [--messages 50000] [--employees 500]
+                                            [--rate-limit 20] [--repeat 3] [--json]
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import queue
+import sys
+import tempfile
+import time
+from logging.handlers import QueueListener
+
+__SERVER_DIR__ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, __SERVER_DIR__)
+
+__SETUPS__ = ('off', 'sync', 'queued', 'queued-rate-limited')
+__TERMINALS__ = [f'terminal-{index}' for index in range(16)]
+__START_DATE__ = datetime.datetime(2021, 3, 1, 6, 0)
+__FORMAT__ = '[%(asctime)s][%(levelname)s] %(message)s'
+
+
+def __configure(setup, logPath):
+    """
+    Returns:\n
+    \tQueueListener of queued setups (started), otherwise None
+    """
+    from src.logger import DeferredQueueHandler
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.setLevel(logging.INFO)
+    logging.disable(logging.CRITICAL if setup == 'off' else logging.NOTSET)
+
+    fileHandler = logging.FileHandler(logPath, mode='w')
+    fileHandler.setFormatter(logging.Formatter(__FORMAT__))
+    if setup == 'sync' or setup == 'off':
+        root.addHandler(fileHandler)
+        return None
+
+    logQueue = queue.SimpleQueue()
+    root.addHandler(DeferredQueueHandler(logQueue))
+    listener = QueueListener(logQueue, fileHandler)
+    listener.start()
+    return listener
+
+
+def __measure(setup, messages, employees, rateLimit, workDir):
+    from src.data import EmployeesDataBase
+    from src.ingest import IngestPipeline
+    from src.server import TerminalRegistry
+    from src.wire import encodeRecord
+
+    runDir = tempfile.mkdtemp(dir=workDir)
+    database = EmployeesDataBase(dataDir=runDir)
+    registry = TerminalRegistry()
+    registry.load(__TERMINALS__, {})
+    payloads = [(f'rfid/record/{__TERMINALS__[index % len(__TERMINALS__)]}',
+                 encodeRecord(1_000_003 * (index % employees + 1), 0,
+                              __START_DATE__ + datetime.timedelta(minutes=index)))
+                for index in range(messages)]
+    pipeline = IngestPipeline(database, registry, linger=0.0, duplicateWindow=0,
+                              scanLogRate=rateLimit if setup == 'queued-rate-limited' else 0)
+
+    listener = __configure(setup, os.path.join(runDir, 'latest.log'))
+    pipeline.start()
+    start = time.perf_counter()
+    for (topic, payload) in payloads:
+        pipeline.put(topic, payload)
+    pipeline.stop()
+    applied = time.perf_counter()
+    if listener is not None:
+        listener.stop()
+    drained = time.perf_counter()
+    logging.disable(logging.NOTSET)
+    for handler in list(logging.getLogger().handlers):
+        handler.close()
+
+    with open(os.path.join(runDir, 'latest.log'), 'r') as logFile:
+        lines = sum(1 for _ in logFile)
+    database.close()
+    return (applied - start, drained - applied, lines)
+
+
+def run(setups, messages, employees, rateLimit, repeat):
+    """
+    runs in a temporary working directory (server modules create their files relative to it)\n
+    Returns:\n
+    \tlist of dict results (one for every logging setup, best of repeat runs)
+    """
+    results = []
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workDir:
+        os.chdir(workDir)
+        try:
+            for setup in setups:
+                best = min(__measure(setup, messages, employees, rateLimit, workDir) for _ in range(repeat))
+                (seconds, drain, lines) = best
+                results.append({
+                    'setup': setup,
+                    'messages': messages,
+                    'messages_per_second': round(messages / seconds),
+                    'seconds': round(seconds, 4),
+                    'log_drain_seconds': round(drain, 4),
+                    'log_lines': lines
+                })
+        finally:
+            os.chdir(cwd)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=50000)
+    parser.add_argument('--employees', type=int, default=500)
+    parser.add_argument('--setup', choices=__SETUPS__, nargs='+', default=list(__SETUPS__))
+    parser.add_argument('--rate-limit', type=int, default=20,
+                        help='per-scan lines per second of rate-limited setup')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', action='store_true',
+                        help='print results as JSON')
+    args = parser.parse_args()
+
+    results = run(args.setup, args.messages, args.employees, args.rate_limit, args.repeat)
+    if args.json:
+        print(json.dumps(results, indent=4))
+    else:
+        for result in results:
+            print(f"{result['setup']:>20}: {result['messages_per_second']:>8} messages/s "
+                  f"({result['seconds']:.3f} s, log drained {result['log_drain_seconds']:.3f} s later, "
+                  f"{result['log_lines']} lines)")
+
+
+if __name__ == "__main__":
+    main()
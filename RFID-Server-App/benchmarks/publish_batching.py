@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Burst of scans sent by terminal's outbox through the in-process broker: batch size / linger trade-off -
+MQTT messages and bytes per scan, delivery latency (scan -> server) and server decode cost per scan
+
+usage (from RFID-Server-App directory):
+    python -m benchmarks.publish_batching [--scans 300] [--rate 100] [--batch 1 4 16 64]
+                                          [--linger 0 0.05 0.2] [--json]
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from benchmarks.fakebroker import FakeBroker, FakeClient
+from src.wire import decodeBatch, decodeRecord, encodeBatch, encodeRecord
+
+# terminal's outbox (RFID-Client has no package)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'RFID-Client'))
+from outbox import Outbox
+
+__TOPIC__ = 'rfid/record/terminal-0'
+__START_DATE__ = datetime.datetime(2021, 3, 1, 6, 0)
+
+
+def __percentile(values, percentile):
+    values = sorted(values)
+    return values[(len(values) - 1) * percentile // 100] if values else 0.0
+
+
+def __measure(scans, rate, batchSize, linger):
+    broker = FakeBroker()
+    received = []
+    delivered = [0]
+    done = threading.Event()
+
+    def onMessage(client, userdata, message):
+        received.append((time.perf_counter(), message.payload))
+        delivered[0] += len(decodeBatch(message.payload))
+        if delivered[0] >= scans:
+            done.set()
+
+    server = FakeClient(broker)
+    server.connect('broker')
+    server.on_message = onMessage
+    server.subscribe('rfid/record/+')
+    server.loop_start()
+
+    terminal = FakeClient(broker)
+    with tempfile.TemporaryDirectory() as queueDir:
+        # replay limits are out of the way - only batching is measured
+        outbox = Outbox(terminal, os.path.join(queueDir, 'outbox.dat'), replayRate=1_000_000, replayBatch=10_000,
+                        batchSize=batchSize, linger=linger, encodeBatch=encodeBatch)
+        terminal.on_publish = outbox.onPublish
+        terminal.connect('broker')
+        outbox.start()
+
+        scanned = {}
+        start = time.perf_counter()
+        for index in range(scans):
+            # scans arrive at constant rate
+            delay = start + index / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            scanned[index] = time.perf_counter()
+            outbox.put(__TOPIC__, encodeRecord(index, 0, __START_DATE__ + datetime.timedelta(seconds=index)))
+
+        done.wait(timeout=60)
+        outbox.stop()
+    server.loop_stop()
+
+    latencies = []
+    terminalForIndex = {0: 'terminal-0'}.get
+    decodeStart = time.perf_counter()
+    for (arrived, message) in received:
+        for payload in decodeBatch(message):
+            (rfid_uid, _, _) = decodeRecord(payload, terminalForIndex)
+            latencies.append(arrived - scanned[rfid_uid])
+    decodeSeconds = time.perf_counter() - decodeStart
+
+    return {
+        'batch': batchSize,
+        'linger': linger,
+        'scans': len(latencies),
+        'messages': len(received),
+        'messages_per_scan': round(len(received) / max(1, len(latencies)), 3),
+        'bytes_per_scan': round(sum(len(message) for (_, message) in received) / max(1, len(latencies)), 1),
+        'latency_p50_ms': round(__percentile(latencies, 50) * 1000, 2),
+        'latency_p99_ms': round(__percentile(latencies, 99) * 1000, 2),
+        'decode_ns_per_scan': round(decodeSeconds / max(1, len(latencies)) * 1e9, 1)
+    }
+
+
+def run(scans, rate, batchSizes, lingers):
+    """
+    Returns:\n
+    \tlist of dict results (one for every batch size and linger, batch size 1 only once)
+    """
+    results = []
+    for batchSize in batchSizes:
+        for linger in (lingers if batchSize > 1 else [0.0]):
+            results.append(__measure(scans, rate, batchSize, linger))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scans', type=int, default=300)
+    parser.add_argument('--rate', type=float, default=100,
+                        help='scans per second')
+    parser.add_argument('--batch', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--linger', type=float, nargs='+', default=[0.0, 0.05, 0.2])
+    parser.add_argument('--json', action='store_true',
+                        help='print results as JSON')
+    args = parser.parse_args()
+
+    results = run(args.scans, args.rate, args.batch, args.linger)
+    if args.json:
+        print(json.dumps(results, indent=4))
+    else:
+        for result in results:
+            print(f"batch {result['batch']:>3}, linger {result['linger']:>5.2f} s: "
+                  f"{result['messages_per_scan']:.3f} messages/scan, {result['bytes_per_scan']:.1f} B/scan, "
+                  f"latency p50 {result['latency_p50_ms']:.1f} ms p99 {result['latency_p99_ms']:.1f} ms, "
+                  f"decode {result['decode_ns_per_scan']:.0f} ns/scan")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Ingestion throughput of sharded database (src.shards.ShardedDataBase) by number of shard processes,
+compared with the in-process database (src.data.EmployeesDataBase).\n
+Entries are applied with addEntries in batches like the ingestion pipeline does.
+
+usage (from RFID-Server-App directory):
+    python -m benchmarks.shard_ingest [--shards 1 2 4] [--entries 200000] [--employees 5000]
+                                      [--batch 256] [--backend pickle] [--json]
+"""
+import argparse
+import datetime
+import json
+import os
+import tempfile
+import time
+from src.data import EmployeesDataBase
+from src.shards import ShardedDataBase
+
+__TERMINALS__ = [f'terminal-{index}' for index in range(16)]
+__START_DATE__ = datetime.datetime(2021, 3, 1, 6, 0)
+
+
+def __generate_batches(entries, employees, batchSize):
+    batch = []
+    for index in range(entries):
+        # rfid-uids spread like card serial numbers, time grows for every employee
+        batch.append((1_000_003 * (index % employees + 1), __TERMINALS__[index % len(__TERMINALS__)],
+                      __START_DATE__ + datetime.timedelta(minutes=index // employees)))
+        if len(batch) == batchSize:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def __measure(shards, backend, entries, employees, batchSize):
+    batches = list(__generate_batches(entries, employees, batchSize))
+    with tempfile.TemporaryDirectory() as dataDir:
+        if shards == 0:
+            database = EmployeesDataBase(backend, dataDir)
+        else:
+            database = ShardedDataBase(shards, backend, dataDir)
+        # employees are created up front, only entries are timed
+        database.addEntries(batches[0][:employees], addUnknownEmployees=True)
+
+        start = time.perf_counter()
+        for batch in batches:
+            database.addEntries(batch, addUnknownEmployees=True)
+        ingest = time.perf_counter() - start
+
+        start = time.perf_counter()
+        database.checkpoint()
+        checkpoint = time.perf_counter() - start
+        database.close()
+    return (ingest, checkpoint)
+
+
+def run(shardCounts, backend, entries, employees, batchSize):
+    """
+    Returns:\n
+    \tlist of dict results (in-process database first, then every number of shards)
+    """
+    results = []
+    for shards in [0] + shardCounts:
+        (ingest, checkpoint) = __measure(shards, backend, entries, employees, batchSize)
+        results.append({
+            'shards': shards,
+            'mode': 'in-process' if shards == 0 else 'sharded',
+            'backend': backend,
+            'entries': entries,
+            'batch': batchSize,
+            'cpus': os.cpu_count(),
+            'ingest_seconds': round(ingest, 4),
+            'entries_per_second': round(entries / ingest),
+            'checkpoint_seconds': round(checkpoint, 4)
+        })
+    baseline = results[0]['entries_per_second']
+    for result in results:
+        result['speedup'] = round(result['entries_per_second'] / baseline, 2)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--entries', type=int, default=200_000)
+    parser.add_argument('--employees', type=int, default=5000)
+    parser.add_argument('--batch', type=int, default=256)
+    parser.add_argument('--backend', default='pickle')
+    parser.add_argument('--json', action='store_true',
+                        help='print results as JSON')
+    args = parser.parse_args()
+
+    results = run(args.shards, args.backend, args.entries, args.employees, args.batch)
+    if args.json:
+        print(json.dumps(results, indent=4))
+    else:
+        print(f'{os.cpu_count()} CPUs, backend {args.backend}')
+        for result in results:
+            print(f"{result['mode']:>10} {result['shards']:>2}: {result['entries_per_second']:>9} entries/s "
+                  f"(x{result['speedup']}), checkpoint {result['checkpoint_seconds']:.3f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Per-message decode cost of rfid/record: JSON vs binary wire format (src.wire.decodeRecord)
+
+usage (from RFID-Server-App directory):
+    python -m benchmarks.wire_decode [--messages 200000] [--repeat 5] [--json]
+"""
+import argparse
+import datetime
+import json
+import time
+from src.wire import decodeRecord, encodeRecord, encodeRecordJson
+
+__TERMINALS__ = [f'terminal-{index}' for index in range(16)]
+__START_DATE__ = datetime.datetime(2021, 3, 1, 6, 0)
+
+
+def __generate_records(messages):
+    for index in range(messages):
+        yield (1_000_000 + index % 5000, index % len(__TERMINALS__),
+               __START_DATE__ + datetime.timedelta(minutes=index))
+
+
+__FORMATS__ = {
+    'json': lambda rfid_uid, terminalIndex, date: encodeRecordJson(rfid_uid, __TERMINALS__[terminalIndex], date).encode(),
+    'binary': encodeRecord
+}
+
+
+def __measure(payloads, repeat):
+    terminalForIndex = __TERMINALS__.__getitem__
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for payload in payloads:
+            decodeRecord(payload, terminalForIndex)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run(messages, repeat):
+    """
+    Returns:\n
+    \tlist of dict results (one for every format)
+    """
+    records = list(__generate_records(messages))
+    results = []
+    for (name, encode) in __FORMATS__.items():
+        payloads = [encode(*record) for record in records]
+        seconds = __measure(payloads, repeat)
+        results.append({
+            'format': name,
+            'messages': messages,
+            'payload_bytes': sum(len(payload) for payload in payloads) / messages,
+            'decode_seconds': round(seconds, 4),
+            'ns_per_message': round(seconds / messages * 1e9, 1),
+            'messages_per_second': round(messages / seconds)
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=200_000)
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='best of N runs is reported')
+    parser.add_argument('--json', action='store_true',
+                        help='print results as JSON')
+    args = parser.parse_args()
+
+    results = run(args.messages, args.repeat)
+    if args.json:
+        print(json.dumps(results, indent=4))
+    else:
+        for result in results:
+            print(f"{result['format']:>8}: {result['ns_per_message']:8.1f} ns/message "
+                  f"({result['messages_per_second']} messages/s, {result['payload_bytes']:.1f} B/message)")
+
+
+if __name__ == "__main__":
+    main()
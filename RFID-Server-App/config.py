@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# pylint: disable=no-member
+
+# --------------------- config ----------------------
+
+# mqtt broker
+BROKER = '127.0.0.1'  # (default is '127.0.0.1')
+
+# server identifier - has to be unique for every server instance; records are received by client
+# '<SERVER_ID>-records' with persistent session (records published while the server is down are
+# kept by the broker - see max_queued_messages of mosquitto)
+SERVER_ID = 'server'  # (default is 'server')
+
+# port
+# if port is set to 0 then default mosquitto port is used
+# TLS default port: 8883
+PORT = 0
+
+# terminals are statically assigned to server instances - this instance processes records only of terminals
+# in SERVER_TERMINALS (every instance has its own database, so terminal's records always go to the same one;
+# entrance and leave terminals of an employee should be assigned to the same instance).
+# Instances are not elastic - moving terminals to another instance means changing SERVER_TERMINALS
+# of both and restarting them.
+# False - single server processes records of all terminals
+STATIC_TERMINAL_ASSIGNMENT = False  # (default is False)
+# IDs of terminals assigned to this instance (required with STATIC_TERMINAL_ASSIGNMENT)
+SERVER_TERMINALS = []  # (default is [])
+
+# server broadcast interval (in seconds)
+BROADCAST_INTERVAL = 60  # (default is 60)
+
+# terminal is shown as available for this long (in seconds) after its last message
+# (broadcast reply, rfid record...), longer than broadcast interval so one lost reply doesn't matter
+TERMINAL_PRESENCE_TTL = 150  # (default is 150)
+
+# server mode ('threaded'/'asyncio')
+# 'asyncio' - MQTT, network broadcast, ingestion and autosave run on one event loop (fewer threads)
+SERVER_MODE = 'threaded'  # (default is 'threaded')
+
+# messages from terminals are applied to the database in batches
+# max number of messages in one batch
+INGEST_BATCH_SIZE = 256  # (default is 256)
+# max time (in seconds) a message waits for the batch to fill up
+INGEST_LINGER = 0.05  # (default is 0.05)
+
+# records of the same card on the same terminal closer than this (in seconds) are dropped as duplicates
+# (re-taps, retransmissions after reconnect), 0 - duplicates aren't suppressed
+DUPLICATE_WINDOW = 60  # (default is 60)
+# max number of remembered recent records (bounds memory of duplicate suppression)
+DUPLICATE_CAPACITY = 65536  # (default is 65536)
+
+# database storage engine ('pickle'/'sqlite')
+# existing pickle database is migrated automatically on first start with 'sqlite'
+DATABASE_BACKEND = 'pickle'  # (default is 'pickle')
+
+# number of past months of history kept in the database (0 - keep everything)
+# history is partitioned by month, partitions older than that are archived or dropped
+# applied only on checkpoint - 'pickle' checkpoints hourly, when its journal grows past 16 MB
+# and when the server exits, 'sqlite' only when the server exits
+HISTORY_RETENTION_MONTHS = 0  # (default is 0)
+
+# what happens to history past retention period ('archive'/'drop')
+# archived history is moved to DATA_DIR/archive and no longer included in reports
+HISTORY_RETENTION_POLICY = 'archive'  # (default is 'archive')
+
+# number of database worker processes employees are split between (by rfid-uid)
+# 0 or 1 - database runs in the server process, more - entries are applied on several cores
+# database is migrated automatically when the number of shards changes (between 0 and more shards
+# or between numbers of shards), once sharded it can't be opened unsharded (0/1) again
+# every batch crosses a pipe to the shard processes - with a single core available sharding is
+# about 2x slower than the in-process database (see benchmarks/shard_ingest.py)
+DATABASE_SHARDS = 0  # (default is 0)
+
+# server metrics (stage durations, queue depths, messages per terminal) in Prometheus text format
+# file rewritten every METRICS_INTERVAL seconds, e.g. for node_exporter textfile collector ('' - not written)
+METRICS_FILE = './data/metrics.prom'  # (default is './data/metrics.prom')
+METRICS_INTERVAL = 15  # (default is 15)
+# port of HTTP endpoint http://127.0.0.1:<port>/metrics (0 - no endpoint)
+METRICS_HTTP_PORT = 0  # (default is 0)
+
+# profiling of the running server (--profile <seconds> or main-menu) - cProfile of the ingestion worker
+# and stack samples of all threads, reports are written to PROFILES_DIR/<date>/
+PROFILES_DIR = './profiles'  # (default is './profiles')
+# seconds between stack samples
+PROFILE_SAMPLE_INTERVAL = 0.01  # (default is 0.01)
+# duration (in seconds) offered in main-menu
+PROFILE_DURATION = 60  # (default is 60)
+
+# print logs on exit
+SHOW_LOG_ON_EXIT = False  # (True/False)
+
+# enable logging
+LOGGING_ENABLED = True  # (True/False)
+
+# logs/latest.log is rotated (renamed and compressed to logs/<date>.zip in background)
+# once it is this long (in bytes, 0 - no limit)
+LOG_MAX_BYTES = 10 * 1024 * 1024  # (default is 10 MiB)
+# or this old (in seconds, 0 - no limit)
+LOG_MAX_AGE = 24 * 3600  # (default is 24 hours)
+
+# max number of per-scan log lines (applied entries) written per second, the rest is only counted
+# (logs stay readable and cheap during bursts of scans), 0 - no limit
+LOG_SCAN_RATE_LIMIT = 20  # (default is 20)
+
+# debug mode (show logs with level DEBUG)
+DEBUG_MODE = False  # (True/False)
+
+# Enable TLS certification
+TLS_ENABLED = False # (True/False)
+
+# Path to .crt file
+# Fill this field if you enable TLS
+TLS_CERT_FILE = ""
+
+# TLS user 
+TLS_USERNAME = ""
+
+TLS_PASSWORD = ""
+
+# ---------------------------------------------------
+
+
+def configInfo():
+    print('This is only configuration file.\n')
+
+
+if __name__ == "__main__":
+    configInfo()
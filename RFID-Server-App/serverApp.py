@@ -1,18 +1,36 @@
 #!/usr/bin/env python3
-import src.data as data
-import os
 import time
+# startup is measured from here (see --startup-profile)
+__START_TIME__ = time.perf_counter()
+import os
+import argparse
 import threading
+import datetime
 import src.server as srv
+from concurrent.futures import ThreadPoolExecutor
+from src.metrics import METRICS, MetricsExporter, StartupProfile
+from src.logreader import LogReader
 from src.logger import *
 from config import *
 from operator import itemgetter
 
-# The employees database
-database = data.EmployeesDataBase()
+# The employees database (loaded in background by main)
+database = None
+
+# src.data - imported by the database loader (storage engines aren't needed to connect to the broker)
+data = None
 
 # The MQTT server
-server = srv.Server(database)
+server = None
+
+# Prometheus export of server metrics
+metricsExporter = None
+
+# Times of startup phases
+startupProfile = StartupProfile(__START_TIME__)
+
+# The current (or last) profiling of the server
+profilingSession = None
 
 # The main loop bool value
 __PROGRAM_STATUS__ = True
@@ -21,6 +39,26 @@ dataModified = [False]
 
 __STOP_THREADS__ = False
 
+# lines of log shown at once
+__LOG_PAGE_SIZE__ = 30
+
+
+def __autosave_job(app_modified, database, server):
+    if app_modified[0] or server.dataModified:
+        logging.info('[Autosave] starting job')
+        database.save()
+        stats = database.getSaveStats()
+        logging.info(
+            f"[Autosave] previous save: lock held {stats['last_lock_hold'] * 1000:.2f} ms, "
+            f"took {stats['last_save_duration'] * 1000:.2f} ms "
+            f"(max: {stats['max_lock_hold'] * 1000:.2f} ms / {stats['max_save_duration'] * 1000:.2f} ms)")
+        logging.info(f'[Autosave] ingest: {server.formatIngestStats()}')
+        server.save_whitelist()
+        app_modified[0] = False
+        server.dataModified = False
+    else:
+        logging.info('[Autosave] no changes made -> skipping')
+
 
 def __autosave_loop(app_modified, database, server):
     interval = 30  # in seconds
@@ -29,14 +67,7 @@ def __autosave_loop(app_modified, database, server):
     while True:
         now = time.time()
         if now - lastSave > interval:
-            if app_modified[0] or server.dataModified:
-                logging.info('[Autosave] starting job')
-                database.save()
-                server.save_whitelist()
-                app_modified[0] = False
-                server.dataModified = False
-            else:
-                logging.info('[Autosave] no changes made -> skipping')
+            __autosave_job(app_modified, database, server)
             lastSave = now
         time.sleep(1)
 
@@ -109,6 +140,29 @@ def _selectList(positions, fun, *args, printList=True):
     return (None, None)
 
 
+def _input_report_range():
+    """
+    Returns:\n
+    \ttuple(datetime start, datetime end) of month entered by user or (None, None) for whole history
+    """
+    while True:
+        month = input('Enter month of report (mm.YYYY) or leave empty for whole history:\n')
+        if month.strip() == '':
+            return (None, None)
+        try:
+            start = datetime.datetime.strptime(month.strip(), '%m.%Y')
+        except ValueError:
+            print('--- invalid input (expected format: mm.YYYY) ---')
+            continue
+        break
+
+    if start.month == 12:
+        end = start.replace(year=start.year + 1, month=1)
+    else:
+        end = start.replace(month=start.month + 1)
+    return (start, end)
+
+
 def mainMenu():
     clrScreen()
     print('MQTT Broker address:', BROKER,
@@ -117,7 +171,9 @@ def mainMenu():
     print("[1] Manage terminals")
     print("[2] Manage employees")
     print("[3] Show server logs")
-    print("[4] Stop server and quit")
+    print("[4] Show server metrics")
+    print("[5] Profile server")
+    print("[6] Stop server and quit")
 
     _selectOption(options=_mainMenuOptions)
 
@@ -144,7 +200,8 @@ def manageEmployeesMenu():
     print("[3] Delete an employee from database")
     print("[4] Modify an employee's data")
     print("[5] Generate report for an employee")
-    print('[6] Return to main-menu')
+    print("[6] Generate reports for all employees")
+    print('[7] Return to main-menu')
 
     _selectOption(options=_manageEmployeesMenuOptions)
 
@@ -162,13 +219,114 @@ def modifyEmpDataMenu():
 
 
 def showServerLogs():
-    clrScreen()
-    if LOGGING_ENABLED:
-        for log in getSessionLogs():
-            print(log)
-    else:
+    if not LOGGING_ENABLED:
+        clrScreen()
         print('\t--- logging disabled ---')
-    input('\n\n--- press enter to return to main-menu ---')
+        input('\n\n--- press enter to return to main-menu ---')
+        return
+
+    (level, terminal_id) = (logging.NOTSET, None)
+    reader = LogReader(getSessionLogPath())
+    # None - last page, follows new lines
+    page = None
+    while True:
+        clrScreen()
+        reader.refresh()
+        pages = reader.getPageCount(__LOG_PAGE_SIZE__)
+        if page is not None and page >= pages - 1:
+            page = None
+        for log in reader.getPage(-1 if page is None else page, __LOG_PAGE_SIZE__):
+            print(log)
+
+        filters = []
+        if level != logging.NOTSET:
+            filters.append(f'level >= {logging.getLevelName(level)}')
+        if terminal_id is not None:
+            filters.append(f'terminal {terminal_id}')
+        print(f"\n--- page {pages if page is None else page + 1}/{pages}, {reader.getLineCount()} lines"
+              f"{' (' + ', '.join(filters) + ')' if filters else ''} ---")
+        command = input('[enter] next page / refresh, [p] previous page, [<number>] go to page, [e] end,\n'
+                        '[l <level>] minimal level, [t <terminal-id>] only terminal, [c] clear filters, '
+                        '[q] return to main-menu\n').strip()
+
+        if command == 'q':
+            break
+        elif command == '':
+            page = None if page is None else page + 1
+        elif command == 'p':
+            page = max(0, (pages - 1 if page is None else page) - 1)
+        elif command == 'e':
+            page = None
+        elif command.isdigit():
+            page = min(max(0, int(command) - 1), pages - 1)
+        elif command.startswith('l ') and isinstance(logging.getLevelName(command[2:].strip().upper()), int):
+            level = logging.getLevelName(command[2:].strip().upper())
+            reader = LogReader(getSessionLogPath(), level, terminal_id)
+            page = None
+        elif command.startswith('t ') and command[2:].strip() != '':
+            terminal_id = command[2:].strip()
+            reader = LogReader(getSessionLogPath(), level, terminal_id)
+            page = None
+        elif command == 'c':
+            (level, terminal_id) = (logging.NOTSET, None)
+            reader = LogReader(getSessionLogPath())
+            page = None
+
+
+def showServerMetrics():
+    while True:
+        clrScreen()
+        print('(<-- main-menu)')
+        print('\n--- Server metrics ---\n')
+        for line in METRICS.summary():
+            print(line)
+        print(f'\ningest: {server.formatIngestStats()}')
+
+        if input('\n\n--- press enter to refresh, enter q to return to main-menu ---\n').strip().lower() == 'q':
+            break
+
+
+def startProfiling(duration):
+    global profilingSession
+    from src.profiler import ProfilingSession
+    profilingSession = ProfilingSession(server, duration, PROFILES_DIR, PROFILE_SAMPLE_INTERVAL)
+    profilingSession.start()
+
+
+def profileServer():
+    while True:
+        clrScreen()
+        print('(<-- main-menu)')
+        print('\n--- Profile server ---\n')
+        running = profilingSession is not None and profilingSession.isRunning()
+        if profilingSession is None:
+            print('server was not profiled yet')
+        elif running:
+            print(f'profiling... reports will be written to "{profilingSession.getReportDir()}"')
+        else:
+            print('reports of the last profiling:')
+            for path in profilingSession.getReports():
+                print(f'\t{path}')
+
+        if running:
+            command = input('\n\n--- press enter to refresh, enter s to stop profiling now, '
+                            'enter q to return to main-menu ---\n').strip().lower()
+            if command == 's':
+                profilingSession.stop()
+        else:
+            command = input('\n\n--- enter duration of profiling in seconds '
+                            f'(empty - {PROFILE_DURATION} s), enter q to return to main-menu ---\n').strip().lower()
+            if command == '':
+                startProfiling(PROFILE_DURATION)
+            elif command != 'q':
+                try:
+                    duration = float(command)
+                except ValueError:
+                    continue
+                if duration > 0:
+                    startProfiling(duration)
+        if command == 'q':
+            break
 
 
 def addTerminal():
@@ -227,7 +385,7 @@ def showTerminalsNet():
             print(terminal_id,
                   f'[on whitelist = {terminal_id in server.getWhitelist()}]', sep=sep)
     else:
-        print('--- No terminals found in previous scan ---')
+        print(f'--- No terminals seen in last {TERMINAL_PRESENCE_TTL} seconds ---')
         print('Try again after next scan (server broadcast interval)')
 
     print(
@@ -252,8 +410,13 @@ def showTerminalsWhitelist():
             for i in range(max(id_len) - len(terminal_id)):
                 sep += ' '
 
+            stats = server.getTerminalStats(terminal_id)
+            last_scan = 'never' if stats['last_scan'] is None else \
+                datetime.datetime.fromtimestamp(stats['last_scan']).strftime('%d.%m.%Y %H:%M:%S')
             print(
-                terminal_id, f'[isAvailable: {terminal_id in server.getAvailableTerminals()}]', sep=sep)
+                terminal_id, f'[isAvailable: {server.isTerminalAvailable(terminal_id)}]',
+                f"[scans: {stats['scans']}, last scan: {last_scan}, errors: {stats['errors']}, "
+                f"duplicates: {stats['duplicates']}]", sep=sep)
     else:
         print('--- No terminals on whitelist ---')
 
@@ -339,12 +502,34 @@ def generateReport():
         _get_employees_summary_sorted(), None, printList=False)
     if emp_data != None:
         rfid_uid = emp_data[2]
+        (start, end) = _input_report_range()
         try:
-            path = database.generateReport(rfid_uid)
+            path = database.generateReport(rfid_uid, start, end)
+            workTime = database.getWorkTime(rfid_uid, start, end)
             print('generated report')
             print(f'path to file: {os.path.abspath(path)}')
+            print(f'total work time: {workTime // 3600} h {workTime % 3600 // 60} min')
         except data.NoDataError:
-            print(f'selected employee has no entries yet')
+            print(f'selected employee has no entries in selected period')
+
+    input('\n\n--- press enter to return to previous menu ---')
+    manageEmployeesMenu()
+
+
+def generateAllReports():
+    clrScreen()
+    print('(<-- manage employees menu)')
+    print('\n--- Generate reports for all employees ---\n')
+
+    (start, end) = _input_report_range()
+    startTime = time.time()
+    manifest = database.generateReports(start=start, end=end)
+    if len(manifest) > 0:
+        for (rfid_uid, path, seconds) in manifest:
+            print(f'{os.path.abspath(path)} ({round(seconds * 1000, 1)} ms)')
+        print(f'\ngenerated {len(manifest)} reports in {round(time.time() - startTime, 2)} seconds')
+    else:
+        print('--- no employee has entries in selected period ---')
 
     input('\n\n--- press enter to return to previous menu ---')
     manageEmployeesMenu()
@@ -411,7 +596,7 @@ def modifyName():
 
 # The main-menu options
 _mainMenuOptions = (manageTerminalsMenu, manageEmployeesMenu,
-                    showServerLogs, endMainLoop)
+                    showServerLogs, showServerMetrics, profileServer, endMainLoop)
 
 # The manage terminals menu options
 _manageTerminalsMenuOptions = (
@@ -419,28 +604,119 @@ _manageTerminalsMenuOptions = (
 
 # The manage employees menu options
 _manageEmployeesMenuOptions = (
-    showEmployees, addEmployee, removeEmployee, modifyEmpDataMenu, generateReport, mainMenu)
+    showEmployees, addEmployee, removeEmployee, modifyEmpDataMenu, generateReport, generateAllReports, mainMenu)
 
 # The modify employee's data menu options
 _modifyEmpDataMenuOptions = (modifyName, modifyRFID, manageEmployeesMenu)
 
 
-def main():
-    server.run()
-    autosaver = threading.Thread(target=__autosave_loop, args=(
-        dataModified, database, server), daemon=True)
-    autosaver.start()
+def _open_database():
+    """
+    runs in background while the server is connecting to the broker
+    """
+    global data
+    import src.data as data
+    if DATABASE_SHARDS > 1:
+        # multiprocessing is imported only when the database is sharded
+        from src.shards import ShardedDataBase
+        opened = ShardedDataBase(DATABASE_SHARDS, backend=DATABASE_BACKEND,
+                                 retentionMonths=HISTORY_RETENTION_MONTHS,
+                                 retentionPolicy=HISTORY_RETENTION_POLICY)
+    else:
+        opened = data.EmployeesDataBase(backend=DATABASE_BACKEND,
+                                        retentionMonths=HISTORY_RETENTION_MONTHS,
+                                        retentionPolicy=HISTORY_RETENTION_POLICY)
+    startupProfile.mark('database_loaded')
+    return opened
+
+
+def __log_startup_profile(server):
+    server.waitForFirstIngest()
+    startupProfile.mark('first_ingest')
+    logging.info('[Startup] time since start:')
+    for line in startupProfile.format():
+        logging.info('[Startup] %s', line)
+
+
+def main(profileStartup=False, profileDuration=0):
+    """
+    profileStartup: startup phases are logged once the first message is ingested
+    and exported as metrics\n
+    profileDuration: server is profiled for this many seconds from startup (0 - not profiled)
+    """
+    global database, server, metricsExporter
+    startupProfile.mark('imports')
+    if profileStartup:
+        startupProfile.register(METRICS)
+
+    # broker connection and ingestion come up first - messages are queued until the database is loaded
+    loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix='database-loader')
+    databaseFuture = loader.submit(_open_database)
+    loader.shutdown(wait=False)
+    server = srv.Server(databaseFuture)
+    metricsExporter = MetricsExporter(METRICS, METRICS_FILE, METRICS_INTERVAL, METRICS_HTTP_PORT)
+
+    if SERVER_MODE == 'asyncio':
+        # MQTT, broadcast, ingestion and autosave as tasks of one event loop
+        from src.aioserver import AsyncServer
+        asyncServer = AsyncServer(server, lambda: __autosave_job(dataModified, databaseFuture.result(), server))
+        asyncServer.start()
+    else:
+        asyncServer = None
+        server.run()
+    startupProfile.mark('broker_connected')
+    metricsExporter.start()
+    if profileDuration > 0:
+        startProfiling(profileDuration)
+    if profileStartup:
+        threading.Thread(target=__log_startup_profile, args=(server,), name='startup-profile',
+                         daemon=True).start()
+
+    if not databaseFuture.done():
+        print('loading database...')
+    try:
+        database = databaseFuture.result()
+    except BaseException:
+        logging.exception('failed to load database')
+        if asyncServer is not None:
+            asyncServer.stop()
+        else:
+            server.stop()
+        metricsExporter.stop()
+        raise
+    if asyncServer is None:
+        autosaver = threading.Thread(target=__autosave_loop, name='autosave', args=(
+            dataModified, database, server), daemon=True)
+        autosaver.start()
+    startupProfile.mark('menu')
 
     while __PROGRAM_STATUS__:
         mainMenu()
-    server.stop()
+    if profilingSession is not None:
+        # reports of unfinished profiling are written now
+        profilingSession.stop()
+    if asyncServer is not None:
+        asyncServer.stop()
+    else:
+        server.stop()
+    metricsExporter.stop()
+    stopLogging()
     logging.shutdown()
-    database.save()
+    # fold journal into snapshot so next startup has nothing to replay
+    database.checkpoint()
+    database.close()
 
     clrScreen()
     if SHOW_LOG_ON_EXIT:
         for log in getSessionLogs():
             print(log)
 
+
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description='Console RFID server')
+    parser.add_argument('--startup-profile', action='store_true',
+                        help='log time of startup phases (up to the first ingested message)')
+    parser.add_argument('--profile', type=float, default=0, metavar='SECONDS',
+                        help=f'profile the server for SECONDS from startup (reports in {PROFILES_DIR})')
+    args = parser.parse_args()
+    main(profileStartup=args.startup_profile, profileDuration=args.profile)
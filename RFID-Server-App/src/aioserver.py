@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import paho.mqtt.client as mqtt
+
+# interval of autosave job (in seconds)
+__AUTOSAVE_INTERVAL__ = 30
+# paho housekeeping (keepalive pings, retries) interval (in seconds)
+__MQTT_MISC_INTERVAL__ = 1
+
+
+class AsyncioMqttLoop:
+    """
+    Drives paho client from asyncio event loop (instead of its network thread) -
+    socket readiness callbacks call loop_read/loop_write, housekeeping runs as a task.\n
+    Has to be attached before the client connects.
+    """
+
+    def __init__(self, loop, client):
+        self.__loop = loop
+        self.__client = client
+        self.__misc_task = None
+        client.on_socket_open = self.__on_socket_open
+        client.on_socket_close = self.__on_socket_close
+        client.on_socket_register_write = self.__on_socket_register_write
+        client.on_socket_unregister_write = self.__on_socket_unregister_write
+
+    def __on_socket_open(self, client, userdata, sock):
+        self.__loop.add_reader(sock, client.loop_read)
+        self.__misc_task = self.__loop.create_task(self.__misc_loop())
+
+    def __on_socket_close(self, client, userdata, sock):
+        self.__loop.remove_reader(sock)
+        if self.__misc_task is not None:
+            self.__misc_task.cancel()
+            self.__misc_task = None
+
+    def __on_socket_register_write(self, client, userdata, sock):
+        self.__loop.add_writer(sock, client.loop_write)
+
+    def __on_socket_unregister_write(self, client, userdata, sock):
+        self.__loop.remove_writer(sock)
+
+    async def __misc_loop(self):
+        while self.__client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(__MQTT_MISC_INTERVAL__)
+
+
+class AsyncServer:
+    """
+    asyncio mode of the server - MQTT I/O (server and network scanner), periodic broadcast,
+    ingestion and autosave run as tasks on one event loop in a single thread.
+    Blocking disk work (database writes, saves) goes through a single-thread executor.
+    """
+
+    def __init__(self, server, autosaveJob=None, autosaveInterval=__AUTOSAVE_INTERVAL__):
+        """
+        server: src.server.Server\n
+        autosaveJob: callable run in executor every autosaveInterval seconds
+        """
+        self.__server = server
+        self.__autosave_job = autosaveJob
+        self.__autosave_interval = autosaveInterval
+        self.__thread = threading.Thread(target=self.__run, name='asyncio-server', daemon=True)
+        self.__started = threading.Event()
+        self.__loop = None
+        self.__stop_event = None
+        self.__error = None
+
+    def __str__(self):
+        return self.__class__.__name__
+
+    def start(self):
+        """
+        returns once the server is connected and its tasks are running
+        """
+        self.__thread.start()
+        self.__started.wait()
+        if self.__error is not None:
+            raise self.__error
+
+    def stop(self):
+        """
+        stops the tasks (messages already received are applied), waits for the loop thread
+        """
+        if self.__loop is not None and self.__thread.is_alive():
+            self.__loop.call_soon_threadsafe(self.__stop_event.set)
+        self.__thread.join()
+
+    def __run(self):
+        try:
+            asyncio.run(self.__main())
+        except BaseException as error:
+            self.__error = error
+            logging.exception('[%s] event loop failed', self)
+        finally:
+            self.__started.set()
+
+    async def __main(self):
+        self.__loop = asyncio.get_running_loop()
+        self.__stop_event = asyncio.Event()
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='asyncio-server-disk')
+        self.__loop.set_default_executor(executor)
+
+        self.__server.run(loop=self.__loop, executor=executor)
+        autosave = None
+        if self.__autosave_job is not None:
+            autosave = asyncio.create_task(self.__autosave_loop(executor))
+        logging.info('[%s] running', self)
+        self.__started.set()
+
+        await self.__stop_event.wait()
+        if autosave is not None:
+            autosave.cancel()
+        await self.__server.stopAsync()
+        executor.shutdown(wait=True)
+        logging.info('[%s] stopped', self)
+
+    async def __autosave_loop(self, executor):
+        while True:
+            await asyncio.sleep(self.__autosave_interval)
+            try:
+                await self.__loop.run_in_executor(executor, self.__autosave_job)
+            except Exception:
+                logging.exception('[%s] autosave failed', self)
@@ -2,10 +2,14 @@
 
 # DATA directory
 DATA_DIR = './data'
+# file describing shard layout of database directory (see shards.ShardedDataBase)
+SHARD_LAYOUT_FILE = 'shards.json'
 
 # MQTT topics
 TERMINAL_DEBUG = 'terminal/debug'
 RFID_RECORD = 'rfid/record'
+# rfid records of one terminal: rfid/record/<terminal_id>
+RFID_RECORD_PREFIX = RFID_RECORD + '/'
 BROADCAST_REQUEST = 'broadcast/request'
 BROADCAST_REPLY = 'broadcast/reply'
 
@@ -14,4 +18,7 @@ JSON_TERMINAL_ID = 'terminal_id'
 JSON_SERVER_ID = 'server_id'
 JSON_RFID_UID = 'rfid_uid'
 JSON_RFID_DATE = 'rfid_date'
-JSON_TEXT = 'text'
\ No newline at end of file
+JSON_TEXT = 'text'
+# supported rfid/record formats and terminal indexes (broadcast handshake)
+JSON_FORMATS = 'formats'
+JSON_TERMINAL_INDEXES = 'terminal_indexes'
@@ -1,19 +1,31 @@
 #!/usr/bin/env python3
 import datetime
+import json
 import os
 import threading
-import pickle
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
 from random import randrange
-from src.constants import DATA_DIR
+from src.constants import DATA_DIR, SHARD_LAYOUT_FILE
+from src.metrics import METRICS
+from src.storage import RETENTION_POLICIES, STORAGE_BACKENDS, dateToMinutes, minutesToDate
 
 # create DATA directory if doesn't exist already
 if not os.path.exists(DATA_DIR):
     os.mkdir(DATA_DIR)
 
-__DATA_FILEPATH__ = f"{DATA_DIR}/database.pkl"
 __REPORT_EXTENSION__ = ".csv"
 __REPORT_DIR_PATH__ = "./reports/"
 __DEFAULT_KEY_LEN__ = 4
+__DEFAULT_BACKEND__ = 'pickle'
+# durations of database stages (see metrics.MetricsRegistry)
+__LOCK_WAIT_STAGE__ = METRICS.stage('lock_wait')
+__ADD_ENTRIES_STAGE__ = METRICS.stage('add_entries')
+__SAVE_LOCK_STAGE__ = METRICS.stage('save_lock_hold')
+__SAVE_STAGE__ = METRICS.stage('save')
+__LOAD_STAGE__ = METRICS.stage('load')
 
 
 def generateKey(length):
@@ -36,61 +48,94 @@ def generateKey(length):
 
 
 class EmployeesDataBase:
-    def __init__(self):
-        self.__emp_hist_dict = {}
-        self.__emp_name_dict = {}
-        self.__rfid_emp_dict = {}
-        self.__emp_rfid_dict = {}
-        self.__load_data()
+    def __init__(self, backend=__DEFAULT_BACKEND__, dataDir=DATA_DIR,
+                 retentionMonths=0, retentionPolicy=RETENTION_POLICIES[0]):
+        """
+        backend: name of storage engine (see storage.STORAGE_BACKENDS)\n
+        retentionMonths: number of past months history is kept for (0 - forever)\n
+        retentionPolicy: what happens to older history (see storage.RETENTION_POLICIES)
+        Throws exceptions:\n
+        \tdata.InvalidInputDataError
+        \tdata.ShardedDataBaseError
+        """
+        if backend not in STORAGE_BACKENDS.keys() or retentionPolicy not in RETENTION_POLICIES \
+                or retentionMonths < 0:
+            raise InvalidInputDataError
+        layoutPath = os.path.join(dataDir, SHARD_LAYOUT_FILE)
+        if os.path.exists(layoutPath):
+            # database was migrated to shards - files left in dataDir are out of date
+            with open(layoutPath, 'r') as layoutFile:
+                shards = json.load(layoutFile)['shards']
+            raise ShardedDataBaseError(
+                f'database in "{dataDir}" is split into {shards} shards - it has to be opened with {shards} shards')
+
+        self.__storage = STORAGE_BACKENDS[backend](
+            dataDir, retentionMonths=retentionMonths, retentionPolicy=retentionPolicy)
+        start = time.perf_counter()
+        self.__storage.load()
+        __LOAD_STAGE__.observe(time.perf_counter() - start)
+        # employee indexes are owned (and kept up to date) by the storage engine
+        self.__emp_name_dict = self.__storage.emp_name_dict
+        self.__rfid_emp_dict = self.__storage.rfid_emp_dict
+        self.__emp_rfid_dict = self.__storage.emp_rfid_dict
         self.__lock = threading.Lock()
-
-    def __clear_dictionaries(self):
-        self.__emp_hist_dict.clear()
-        self.__emp_rfid_dict.clear()
-        self.__emp_name_dict.clear()
-        self.__rfid_emp_dict.clear()
-
-    def __load_data(self):
-        if not os.path.exists(__DATA_FILEPATH__):
-            return
-
-        self.__clear_dictionaries()
-
-        with open(__DATA_FILEPATH__, 'rb') as dbFile:
-            dbDictionaries = pickle.load(dbFile)
-            self.__emp_name_dict = dbDictionaries[0]
-            self.__rfid_emp_dict = dbDictionaries[1]
-            self.__emp_hist_dict = dbDictionaries[2]
-
-        # create emp_rfid dictionary
-        for item in self.__rfid_emp_dict.items():
-            (rfid_uid, emp_uid) = item
-            self.__emp_rfid_dict[emp_uid] = rfid_uid
-
-    def __serialize_data(self):
-        with open(__DATA_FILEPATH__, 'wb') as dbFile:
-            dbDictionaries = []
-            dbDictionaries.append(self.__emp_name_dict)
-            dbDictionaries.append(self.__rfid_emp_dict)
-            dbDictionaries.append(self.__emp_hist_dict)
-            pickle.dump(dbDictionaries, dbFile)
+        # slow part of saving (fsync, serialization) runs here, one save at a time
+        self.__writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='database-writer')
+        self.__save_stats = {
+            'saves': 0,
+            'last_lock_hold': 0.0,
+            'max_lock_hold': 0.0,
+            'last_save_duration': 0.0,
+            'max_save_duration': 0.0
+        }
+
+    def __save(self, checkpoint):
+        requested = time.perf_counter()
+        with self.__lock:
+            acquired = time.perf_counter()
+            finishSave = self.__storage.beginSave(checkpoint)
+            lockHold = time.perf_counter() - acquired
+        __LOCK_WAIT_STAGE__.observe(acquired - requested)
+        __SAVE_LOCK_STAGE__.observe(lockHold)
+        return self.__writer.submit(self.__finish_save, finishSave, requested, lockHold)
+
+    def __finish_save(self, finishSave, requested, lockHold):
+        finishSave()
+        duration = time.perf_counter() - requested
+        __SAVE_STAGE__.observe(duration)
+        stats = self.__save_stats
+        stats['saves'] += 1
+        stats['last_lock_hold'] = lockHold
+        stats['max_lock_hold'] = max(stats['max_lock_hold'], lockHold)
+        stats['last_save_duration'] = duration
+        stats['max_save_duration'] = max(stats['max_save_duration'], duration)
 
     def save(self):
-        with self.__lock:
-            self.__serialize_data()
+        """
+        persists changes made since previous save\n
+        database is locked only while changes are captured, writing to disk is done in background
+        """
+        self.__save(checkpoint=False)
 
-    def __remove_employee_from_dict(self, emp_uid):
+    def checkpoint(self):
         """
-        Returns:\n 
-        \tNone 
+        persists changes and compacts storage (e.g. folds journal into snapshot), waits until done
         """
-        if emp_uid not in self.__emp_name_dict.keys():
-            return
+        # let background save finish first so checkpoint is never skipped
+        self.__writer.submit(lambda: None).result()
+        self.__save(checkpoint=True).result()
 
-        del self.__emp_hist_dict[emp_uid]
-        del self.__rfid_emp_dict[self.__emp_rfid_dict[emp_uid]]
-        del self.__emp_rfid_dict[emp_uid]
-        del self.__emp_name_dict[emp_uid]
+    def getSaveStats(self):
+        """
+        Returns:\n
+        \tdict (saves, last/max_lock_hold, last/max_save_duration - in seconds) of completed saves
+        """
+        return dict(self.__save_stats)
+
+    def close(self):
+        self.__writer.shutdown(wait=True)
+        with self.__lock:
+            self.__storage.close()
 
     def __validate_input(self, rfid_uid):
         return isinstance(rfid_uid, int)
@@ -105,12 +150,51 @@ class EmployeesDataBase:
         if rfid_uid not in self.__rfid_emp_dict.keys():
             raise NoSuchEmployeeError
 
+        requested = time.perf_counter()
         with self.__lock:
+            acquired = time.perf_counter()
             emp_uid = self.__rfid_emp_dict[rfid_uid]
 
             # update emp_history dictionary
-            self.__emp_hist_dict[emp_uid].append(
-                tuple([date.day, date.month, date.year, date.hour, date.minute, rfid_terminal]))
+            self.__storage.addEntries(
+                [(emp_uid, dateToMinutes(date), rfid_terminal)])
+        __LOCK_WAIT_STAGE__.observe(acquired - requested)
+        __ADD_ENTRIES_STAGE__.observe(time.perf_counter() - acquired)
+
+    def addEntries(self, batch, addUnknownEmployees=False):
+        """
+        Adds whole batch of entries with one acquisition of the lock.\n
+        batch: list of tuple(int rfid-uid, str terminal, datetime date)\n
+        addUnknownEmployees: anonymous employee is added for unknown rfid-uid
+        (otherwise exception is raised and nothing is added)\n
+        Returns:\n
+        \tlist of rfid-uids of added anonymous employees
+        Throws exceptions:\n
+        \tdata.InvalidInputDataError
+        \tdata.NoSuchEmployeeError
+        """
+        addedEmployees = []
+        requested = time.perf_counter()
+        with self.__lock:
+            acquired = time.perf_counter()
+            for (rfid_uid, rfid_terminal, date) in batch:
+                if rfid_uid not in self.__rfid_emp_dict.keys():
+                    if not addUnknownEmployees:
+                        raise NoSuchEmployeeError
+                    if not self.__validate_input(rfid_uid):
+                        raise InvalidInputDataError
+
+            entries = []
+            for (rfid_uid, rfid_terminal, date) in batch:
+                emp_uid = self.__rfid_emp_dict.get(rfid_uid)
+                if emp_uid is None:
+                    emp_uid = self.__add_employee(rfid_uid)
+                    addedEmployees.append(rfid_uid)
+                entries.append((emp_uid, dateToMinutes(date), rfid_terminal))
+            self.__storage.addEntries(entries)
+        __LOCK_WAIT_STAGE__.observe(acquired - requested)
+        __ADD_ENTRIES_STAGE__.observe(time.perf_counter() - acquired)
+        return addedEmployees
 
     def addEmployee(self, rfid_uid, emp_uid="", name=""):
         """
@@ -128,21 +212,27 @@ class EmployeesDataBase:
             raise RfidAlreadyUsedError
 
         with self.__lock:
-            if emp_uid == "":
+            self.__add_employee(rfid_uid, emp_uid, name)
+
+    def __add_employee(self, rfid_uid, emp_uid="", name=""):
+        """
+        database has to be locked\n
+        Returns:\n
+        \tstr emp-uid of added employee
+        """
+        if emp_uid == "":
+            emp_uid = generateKey(__DEFAULT_KEY_LEN__)
+            while emp_uid in self.__emp_name_dict.keys():
                 emp_uid = generateKey(__DEFAULT_KEY_LEN__)
-                while emp_uid in self.__emp_name_dict.keys():
-                    emp_uid = generateKey(__DEFAULT_KEY_LEN__)
-            elif emp_uid in self.__emp_name_dict.keys():
-                raise EmployeeRecordAlreadyExistsError
+        elif emp_uid in self.__emp_name_dict.keys():
+            raise EmployeeRecordAlreadyExistsError
 
-            if name == "":
-                name = emp_uid
+        if name == "":
+            name = emp_uid
 
-            # add new employee to dictionaries
-            self.__emp_name_dict[emp_uid] = name
-            self.__rfid_emp_dict[rfid_uid] = emp_uid
-            self.__emp_rfid_dict[emp_uid] = rfid_uid
-            self.__emp_hist_dict[emp_uid] = []
+        # add new employee to dictionaries
+        self.__storage.addEmployee(emp_uid, rfid_uid, name)
+        return emp_uid
 
     def deleteEmployee(self, rfid_uid, delHistory=True):
         """
@@ -161,7 +251,7 @@ class EmployeesDataBase:
 
         with self.__lock:
             emp_uid = self.__rfid_emp_dict[rfid_uid]
-            self.__remove_employee_from_dict(emp_uid)
+            self.__storage.deleteEmployee(emp_uid)
 
     def modifyEmpName(self, rfid_uid, newName):
         """
@@ -179,7 +269,7 @@ class EmployeesDataBase:
 
         with self.__lock:
             emp_uid = self.__rfid_emp_dict[rfid_uid]
-            self.__emp_name_dict[emp_uid] = newName
+            self.__storage.modifyEmpName(emp_uid, newName)
 
     def modifyEmpRFID(self, rfid_uid, new_rfid_uid):
         """
@@ -201,9 +291,7 @@ class EmployeesDataBase:
 
         with self.__lock:
             emp_uid = self.__rfid_emp_dict[rfid_uid]
-            del self.__rfid_emp_dict[rfid_uid]
-            self.__rfid_emp_dict[new_rfid_uid] = emp_uid
-            self.__emp_rfid_dict[emp_uid] = new_rfid_uid
+            self.__storage.modifyEmpRFID(emp_uid, new_rfid_uid)
 
     def getEmployeesDataSummary(self, includeHistory=True):
         """
@@ -215,14 +303,18 @@ class EmployeesDataBase:
         \tNone
         """
         dataSummary = []
-        for emp_uid in self.__emp_name_dict.keys():
-            name = str(self.__emp_name_dict[emp_uid])
-            rfid_uid = self.__emp_rfid_dict[emp_uid]
+        with self.__lock:
             if includeHistory:
-                history = self.__emp_hist_dict[emp_uid][:]
-            else:
-                history = []
-            dataSummary.append((str(emp_uid), name, rfid_uid, history))
+                histories = self.__storage.getHistories()
+
+            for emp_uid in self.__emp_name_dict.keys():
+                name = str(self.__emp_name_dict[emp_uid])
+                rfid_uid = self.__emp_rfid_dict[emp_uid]
+                if includeHistory:
+                    history = histories[emp_uid]
+                else:
+                    history = []
+                dataSummary.append((str(emp_uid), name, rfid_uid, history))
         return dataSummary
 
     def getEmpName(self, rfid_uid):
@@ -241,9 +333,29 @@ class EmployeesDataBase:
         else:
             raise NoSuchEmployeeError
 
-    def generateReport(self, rfid_uid):
+    def getEmployeeData(self, rfid_uid):
         """
         Returns:\n
+        \ttuple(str emp-uid, str emp-name, int rfid-uid, list history) of one employee
+        (item of getEmployeesDataSummary)
+        Throws exceptions:\n
+        \tdata.InvalidInputDataError
+        \tdata.NoSuchEmployeeError
+        """
+        if not self.__validate_input(rfid_uid):
+            raise InvalidInputDataError
+
+        with self.__lock:
+            emp_uid = self.__rfid_emp_dict.get(rfid_uid)
+            if emp_uid is None:
+                raise NoSuchEmployeeError
+            return (str(emp_uid), str(self.__emp_name_dict[emp_uid]), rfid_uid, self.__storage.getHistory(emp_uid))
+
+    def generateReport(self, rfid_uid, start=None, end=None):
+        """
+        Report of work periods (entrance, leave) which started in [start, end)\n
+        start, end: datetime or None (unbounded)\n
+        Returns:\n
         \tstr path-to-report
         Throws exceptions:\n
         \tdata.InvalidInputDataError
@@ -256,45 +368,136 @@ class EmployeesDataBase:
         if rfid_uid not in self.__rfid_emp_dict.keys():
             raise NoSuchEmployeeError
 
-        emp_uid = self.__rfid_emp_dict[rfid_uid]
-
-        # at least two entries needed
-        if len(self.__emp_hist_dict[emp_uid]) < 2:
-            raise NoDataError
-
         if not os.path.exists(__REPORT_DIR_PATH__):
             os.mkdir(__REPORT_DIR_PATH__)
 
         with self.__lock:
-            workDays = []  # date of entrance, date of leave, delta_time
-            isEntrance = True
-            (day, month, year, hour, minute,
-             terminal) = self.__emp_hist_dict[emp_uid][0]
-            prevDate = datetime.datetime(year, month, day, hour, minute)
-
-            for entry in self.__emp_hist_dict[emp_uid][1:]:
-                isEntrance = not isEntrance
-                (day, month, year, hour, minute, terminal) = entry
-                if isEntrance:
-                    prevDate = datetime.datetime(
-                        year, month, day, hour, minute)
-                else:
-                    currentDate = datetime.datetime(
-                        year, month, day, hour, minute)
-                    workDays.append(
-                        (prevDate, currentDate, (currentDate - prevDate)))
+            emp_uid = self.__rfid_emp_dict[rfid_uid]
+            workPeriods = self.__storage.getWorkPeriods(
+                emp_uid,
+                None if start is None else dateToMinutes(start),
+                None if end is None else dateToMinutes(end))
+
+            # at least one complete period (two entries) needed
+            if len(workPeriods) < 1:
+                raise NoDataError
 
             filePath = f"{__REPORT_DIR_PATH__}" \
                 f"{self.__emp_name_dict[emp_uid].replace(' ', '_')}_" \
                 f"{datetime.datetime.now().strftime('%b-%d-%Y-%H-%M-%S')}" \
                 f"{__REPORT_EXTENSION__}"
 
-            with open(filePath, "w") as file:
-                for workDay in workDays:
-                    file.write(
-                        f"{workDay[0].strftime('%d/%m/%Y %H:%M:%S')};{workDay[1].strftime('%d/%m/%Y %H:%M:%S')};{int(workDay[2].total_seconds())}\n")
+            writeReport(filePath, workPeriods)
         return filePath
 
+    def getWorkTime(self, rfid_uid, start=None, end=None):
+        """
+        Total time of work periods which started in [start, end)\n
+        start, end: datetime or None (unbounded)\n
+        Returns:\n
+        \tint seconds
+        Throws exceptions:\n
+        \tdata.InvalidInputDataError
+        \tdata.NoSuchEmployeeError
+        """
+        if not self.__validate_input(rfid_uid=rfid_uid):
+            raise InvalidInputDataError
+
+        if rfid_uid not in self.__rfid_emp_dict.keys():
+            raise NoSuchEmployeeError
+
+        with self.__lock:
+            emp_uid = self.__rfid_emp_dict[rfid_uid]
+            minutes = self.__storage.getWorkTime(
+                emp_uid,
+                None if start is None else dateToMinutes(start),
+                None if end is None else dateToMinutes(end))
+        return minutes * 60
+
+    def generateReports(self, rfid_uids=None, start=None, end=None, workers=None):
+        """
+        Generates reports (see generateReport) for many employees at once in a process pool.\n
+        Database is locked only while work periods are copied, reports are written off-lock.\n
+        rfid_uids: list of int rfid-uid or None (all employees)\n
+        workers: number of worker processes (None = number of CPUs)\n
+        Returns:\n
+        \tlist manifest:
+        \t(list of tuple(int rfid-uid, str path-to-report, float seconds) for each generated report,
+        \temployees without work periods in [start, end) are skipped)
+        Throws exceptions:\n
+        \tdata.InvalidInputDataError
+        \tdata.NoSuchEmployeeError
+        """
+        if rfid_uids is not None:
+            for rfid_uid in rfid_uids:
+                if not self.__validate_input(rfid_uid=rfid_uid):
+                    raise InvalidInputDataError
+
+        reportDir = f"{__REPORT_DIR_PATH__}" \
+            f"{datetime.datetime.now().strftime('%b-%d-%Y-%H-%M-%S')}/"
+        startMinutes = None if start is None else dateToMinutes(start)
+        endMinutes = None if end is None else dateToMinutes(end)
+
+        # compact snapshot: (rfid-uid, path, flat array of entrance/leave minutes)
+        jobs = []
+        with self.__lock:
+            if rfid_uids is None:
+                rfid_uids = list(self.__rfid_emp_dict.keys())
+
+            for rfid_uid in rfid_uids:
+                if rfid_uid not in self.__rfid_emp_dict.keys():
+                    raise NoSuchEmployeeError
+
+            for rfid_uid in rfid_uids:
+                emp_uid = self.__rfid_emp_dict[rfid_uid]
+                workPeriods = self.__storage.getWorkPeriods(
+                    emp_uid, startMinutes, endMinutes)
+                if len(workPeriods) > 0:
+                    filePath = f"{reportDir}" \
+                        f"{self.__emp_name_dict[emp_uid].replace(' ', '_')}_{emp_uid}" \
+                        f"{__REPORT_EXTENSION__}"
+                    jobs.append((rfid_uid, filePath, array('l', chain.from_iterable(workPeriods))))
+
+        if len(jobs) == 0:
+            return []
+
+        os.makedirs(reportDir, exist_ok=True)
+        paths = [job[1] for job in jobs]
+        periods = [job[2] for job in jobs]
+
+        if workers == 1 or len(jobs) == 1:
+            timings = list(map(_build_report, paths, periods))
+        else:
+            # multiprocessing is imported on first use, not at startup
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                timings = list(executor.map(_build_report, paths, periods,
+                                            chunksize=max(1, len(jobs) // (4 * (workers or os.cpu_count() or 1)))))
+
+        return [(job[0], job[1], seconds) for (job, seconds) in zip(jobs, timings)]
+
+
+def _build_report(filePath, periods):
+    """
+    report worker - periods is flat array of entrance/leave minutes\n
+    Returns:\n
+    \tfloat seconds spent on the report
+    """
+    start = time.perf_counter()
+    writeReport(filePath, zip(periods[0::2], periods[1::2]))
+    return time.perf_counter() - start
+
+
+def writeReport(filePath, workPeriods):
+    """
+    writes csv rows: date of entrance;date of leave;seconds of work\n
+    workPeriods: iterable of tuple(int entrance-minutes, int leave-minutes)
+    """
+    with open(filePath, "w") as file:
+        for (entrance, leave) in workPeriods:
+            file.write(
+                f"{minutesToDate(entrance).strftime('%d/%m/%Y %H:%M:%S')};{minutesToDate(leave).strftime('%d/%m/%Y %H:%M:%S')};{(leave - entrance) * 60}\n")
+
 
 #### exceptions ####
 
@@ -321,3 +524,24 @@ class RfidAlreadyUsedError(DataBaseError):
 class InvalidInputDataError(DataBaseError):
     pass
 
+
+class ShardedDataBaseError(DataBaseError):
+    pass
+
+
+class BatchPartiallyAppliedError(DataBaseError):
+    """
+    only part of batch was applied (sub-batches of sharded database are applied independently)
+    """
+
+    def __init__(self, entries, addedEmployees, error):
+        """
+        entries: list of entries not applied\n
+        addedEmployees: list of rfid-uids of anonymous employees added with the applied part\n
+        error: exception which stopped the rest
+        """
+        super().__init__(entries, addedEmployees, error)
+        self.entries = entries
+        self.addedEmployees = addedEmployees
+        self.error = error
+
@@ -0,0 +1,510 @@
+#!/usr/bin/env python3
+import json
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+from src.constants import *
+from src.metrics import METRICS
+from src.wire import decodeBatch, decodeRecord
+
+# max number of messages applied to database at once
+__DEFAULT_BATCH_SIZE__ = 256
+# max time (in seconds) the first message of a batch waits for more messages
+__DEFAULT_LINGER__ = 0.05
+# number of most recent messages latency percentiles are computed from
+__LATENCY_WINDOW__ = 10000
+# reported latency percentiles
+__LATENCY_PERCENTILES__ = (50, 90, 99)
+# largest rfid-uid the database can store (SQLite INTEGER is signed 64-bit)
+__MAX_RFID_UID__ = 2**63 - 1
+# records of the same card on the same terminal closer than this (in seconds) are duplicates, 0 - disabled
+__DEFAULT_DUPLICATE_WINDOW__ = 60
+# max number of remembered (terminal, card, time bucket) keys
+__DEFAULT_DUPLICATE_CAPACITY__ = 65536
+# max number of per-scan log lines per second, 0 - no limit
+__DEFAULT_SCAN_LOG_RATE__ = 20
+__EPOCH__ = datetime(1970, 1, 1)
+__SECOND__ = timedelta(seconds=1)
+# durations of ingestion stages (see metrics.MetricsRegistry)
+__QUEUE_WAIT_STAGE__ = METRICS.stage('queue_wait')
+__PARSE_STAGE__ = METRICS.stage('parse')
+__WHITELIST_STAGE__ = METRICS.stage('whitelist_check')
+__LOGGING_STAGE__ = METRICS.stage('logging')
+__APPLY_STAGE__ = METRICS.stage('apply_batch')
+
+
+class DuplicateFilter:
+    """
+    Suppresses repeated rfid records - re-taps, retransmissions after reconnect, QoS redelivery -
+    which would break entrance/leave pairing of the history.\n
+    Records are keyed on (terminal_id, rfid_uid, time bucket of window seconds), the neighbouring
+    buckets are checked as well so repeats across bucket boundary are caught too. A record is
+    a duplicate when it is less than window seconds (by its own timestamp) from the remembered one.\n
+    Memory is bounded - least recently used keys are forgotten above capacity.
+    Not thread-safe (used by the ingestion worker only).
+    """
+
+    def __init__(self, window=__DEFAULT_DUPLICATE_WINDOW__, capacity=__DEFAULT_DUPLICATE_CAPACITY__):
+        self.__window = window
+        self.__capacity = max(1, capacity)
+        # (terminal_id, rfid_uid, bucket) -> int seconds of accepted record
+        self.__seen = OrderedDict()
+        self.__suppressed = 0
+
+    def isDuplicate(self, terminal_id, rfid_uid, date):
+        """
+        records not suppressed are remembered\n
+        Returns:\n
+        \tTrue if record repeats one accepted less than window seconds away
+        """
+        seconds = (date - __EPOCH__) // __SECOND__
+        bucket = seconds // self.__window
+        for neighbour in (bucket, bucket - 1, bucket + 1):
+            key = (terminal_id, rfid_uid, neighbour)
+            accepted = self.__seen.get(key)
+            if accepted is not None and abs(seconds - accepted) < self.__window:
+                self.__seen.move_to_end(key)
+                self.__suppressed += 1
+                return True
+
+        key = (terminal_id, rfid_uid, bucket)
+        self.__seen[key] = seconds
+        self.__seen.move_to_end(key)
+        if len(self.__seen) > self.__capacity:
+            self.__seen.popitem(last=False)
+        return False
+
+    def getSuppressedCount(self):
+        return self.__suppressed
+
+
+class RateLimiter:
+    """
+    Token bucket - allows at most rate events per second (bursts of up to rate events),
+    refused events are counted. Not thread-safe (used by the ingestion worker only).
+    """
+
+    def __init__(self, rate):
+        self.__rate = rate
+        self.__tokens = float(rate)
+        self.__last = time.monotonic()
+        self.__refused = 0
+
+    def acquire(self, now=None):
+        """
+        Returns:\n
+        \tTrue if event is allowed
+        """
+        now = time.monotonic() if now is None else now
+        self.__tokens = min(float(self.__rate), self.__tokens + (now - self.__last) * self.__rate)
+        self.__last = now
+        if self.__tokens < 1.0:
+            self.__refused += 1
+            return False
+        self.__tokens -= 1.0
+        return True
+
+    def takeRefused(self):
+        """
+        Returns:\n
+        \tint number of events refused since previous call
+        """
+        (refused, self.__refused) = (self.__refused, 0)
+        return refused
+
+
+class IngestPipeline:
+    """
+    Staged processing of MQTT messages - network thread only enqueues raw payloads,
+    worker thread drains the queue in batches (parsing, whitelist check) and applies
+    them to the database with one acquisition of its lock (EmployeesDataBase.addEntries).\n
+    In asyncio mode (startAsync) the queue is drained by a task on the event loop
+    and batches are applied in an executor.\n
+    Duplicate records are dropped (DuplicateFilter) before they reach the database.
+    Every applied scan is logged, at most scanLogRate lines per second (RateLimiter) so bursts
+    don't flood the log.\n
+    Database can be given as a Future while it is being loaded - messages are queued
+    and applied once it is ready.
+    """
+
+    def __init__(self, dataBase, registry, onApplied=None,
+                 batchSize=__DEFAULT_BATCH_SIZE__, linger=__DEFAULT_LINGER__,
+                 duplicateWindow=__DEFAULT_DUPLICATE_WINDOW__, duplicateCapacity=__DEFAULT_DUPLICATE_CAPACITY__,
+                 scanLogRate=__DEFAULT_SCAN_LOG_RATE__):
+        """
+        dataBase: database or concurrent.futures.Future of it\n
+        registry: server.TerminalRegistry - whitelist, indexes of binary records,
+        receives last-seen times and scan/error/duplicate counters of terminals\n
+        onApplied: callable() called after batch with entries was applied\n
+        duplicateWindow: seconds (0 - duplicates aren't suppressed), see DuplicateFilter\n
+        scanLogRate: max number of per-scan log lines per second (0 - no limit)
+        """
+        self.__database = dataBase
+        self.__registry = registry
+        self.__duplicates = DuplicateFilter(duplicateWindow, duplicateCapacity) if duplicateWindow > 0 else None
+        self.__on_applied = onApplied
+        self.__scan_log_limiter = RateLimiter(scanLogRate) if scanLogRate > 0 else None
+        self.__batch_size = max(1, batchSize)
+        self.__linger = linger
+        # tuple(float time-received, str topic, bytes payload), None stops the worker
+        self.__queue = queue.SimpleQueue()
+        self.__worker = threading.Thread(target=self.__run, name='ingest-worker', daemon=True)
+        # asyncio mode: queue drained by task (put has to be called on the event loop)
+        self.__async_queue = None
+        self.__task = None
+        # end-to-end latencies (received -> applied) of the most recent entries
+        self.__latencies = deque(maxlen=__LATENCY_WINDOW__)
+        self.__stats_lock = threading.Lock()
+        self.__messages = 0
+        self.__batches = 0
+        # cProfile.Profile enabled while batches are applied (see setProfiler)
+        self.__profiler = None
+        # guards swaps of the profiler, notified when the profiled batch is done
+        self.__profiler_changed = threading.Condition()
+        self.__profiling_batch = False
+
+    def __str__(self):
+        return self.__class__.__name__
+
+    def put(self, topic, payload):
+        """
+        safe to call from any thread (e.g. paho network thread), in asyncio mode only from the event loop
+        """
+        if self.__async_queue is not None:
+            self.__async_queue.put_nowait((time.perf_counter(), topic, payload))
+        else:
+            self.__queue.put((time.perf_counter(), topic, payload))
+
+    def start(self):
+        self.__worker.start()
+
+    def stop(self):
+        """
+        messages already enqueued are applied before the worker stops
+        """
+        if self.__worker.is_alive():
+            self.__queue.put(None)
+            self.__worker.join()
+        logging.info('[%s] stopped, %s', self, self.formatLatencyStats())
+
+    def startAsync(self, loop, executor=None):
+        """
+        asyncio mode - has to be called on the event loop
+        """
+        import asyncio
+        self.__async_queue = asyncio.Queue()
+        self.__task = loop.create_task(self.__run_async(loop, executor))
+
+    async def stopAsync(self):
+        """
+        messages already enqueued are applied before the task stops
+        """
+        if self.__task is not None:
+            self.__async_queue.put_nowait(None)
+            await self.__task
+            self.__task = None
+        logging.info('[%s] stopped, %s', self, self.formatLatencyStats())
+
+    async def __next_batch_async(self):
+        import asyncio
+        item = await self.__async_queue.get()
+        if item is None:
+            return ([], True)
+
+        batch = [item]
+        deadline = item[0] + self.__linger
+        while len(batch) < self.__batch_size:
+            if self.__async_queue.empty():
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.__async_queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            else:
+                item = self.__async_queue.get_nowait()
+            if item is None:
+                return (batch, True)
+            batch.append(item)
+        return (batch, False)
+
+    def __database_pending(self):
+        if not isinstance(self.__database, Future):
+            return False
+        if not self.__database.done():
+            logging.info('[%s] database is loading, messages are queued until it is ready', self)
+        return True
+
+    def __database_failed(self, error):
+        logging.error('[%s] database could not be loaded (%r), messages are not applied', self, error)
+
+    async def __run_async(self, loop, executor):
+        import asyncio
+        if self.__database_pending():
+            try:
+                self.__database = await asyncio.wrap_future(self.__database)
+            except Exception as error:
+                self.__database_failed(error)
+                return
+        stop = False
+        while not stop:
+            (batch, stop) = await self.__next_batch_async()
+            if len(batch) > 0:
+                try:
+                    # database lock and journal writes would block the event loop
+                    await loop.run_in_executor(executor, self.__process, batch)
+                except Exception:
+                    logging.exception('[%s] unknown exception', self)
+
+    def __next_batch(self):
+        """
+        Returns:\n
+        \ttuple(list batch, bool stop)
+        """
+        item = self.__queue.get()
+        if item is None:
+            return ([], True)
+
+        batch = [item]
+        deadline = item[0] + self.__linger
+        while len(batch) < self.__batch_size:
+            timeout = deadline - time.perf_counter()
+            try:
+                item = self.__queue.get(timeout=timeout) if timeout > 0 else self.__queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                return (batch, True)
+            batch.append(item)
+        return (batch, False)
+
+    def __run(self):
+        if self.__database_pending():
+            try:
+                self.__database = self.__database.result()
+            except Exception as error:
+                self.__database_failed(error)
+                return
+        stop = False
+        while not stop:
+            (batch, stop) = self.__next_batch()
+            if len(batch) > 0:
+                try:
+                    self.__process(batch)
+                except Exception:
+                    logging.exception('[%s] unknown exception', self)
+
+    def __parse(self, topic, payload):
+        """
+        Returns:\n
+        \ttuple(int rfid-uid, str terminal, datetime date) of whitelisted rfid record, otherwise None
+        """
+        if topic == TERMINAL_DEBUG:
+            start = time.perf_counter()
+            msg_json = json.loads(payload)
+            __PARSE_STAGE__.observe(time.perf_counter() - start)
+            self.__registry.seen(msg_json[JSON_TERMINAL_ID])
+            logging.info('(Terminal-id: %s) %s', msg_json[JSON_TERMINAL_ID], msg_json[JSON_TEXT])
+
+        elif topic == RFID_RECORD or topic.startswith(RFID_RECORD_PREFIX):
+            # per-terminal topic names the terminal (legacy terminals publish to rfid/record)
+            start = time.perf_counter()
+            (rfid_uid, terminal_id, date) = decodeRecord(
+                payload, self.__registry.terminalForIndex,
+                topic[len(RFID_RECORD_PREFIX):] if topic != RFID_RECORD else None)
+            parsed = time.perf_counter()
+            __PARSE_STAGE__.observe(parsed - start)
+            if terminal_id is None:
+                logging.warning('[%s] binary record from unknown terminal index', self)
+                return None
+            if not self.__registry.isOwned(terminal_id):
+                # terminal is assigned to another server instance (legacy rfid/record reaches all of them)
+                return None
+            whitelisted = self.__registry.isWhitelisted(terminal_id)
+            __WHITELIST_STAGE__.observe(time.perf_counter() - parsed)
+            if not whitelisted:
+                self.__registry.seen(terminal_id)
+                return None
+
+            logging.debug('(Terminal-id: %s) RFID scanned: %s', terminal_id, rfid_uid)
+            if not isinstance(rfid_uid, int) or isinstance(rfid_uid, bool) or \
+                    not 0 <= rfid_uid <= __MAX_RFID_UID__:
+                logging.warning('(Terminal-id: %s) invalid rfid_uid=%r', terminal_id, rfid_uid)
+                self.__registry.recordError(terminal_id)
+                return None
+            return (rfid_uid, terminal_id, date)
+        return None
+
+    def setProfiler(self, profile):
+        """
+        profile: cProfile.Profile enabled while batches are applied (on the thread applying them),
+        None - profiling ends (once the batch being applied is done)\n
+        returns when the previous profile is no longer enabled
+        """
+        with self.__profiler_changed:
+            self.__profiler = profile
+            while self.__profiling_batch:
+                self.__profiler_changed.wait()
+
+    def __process(self, batch):
+        # attribute read is atomic - batches aren't serialized with setProfiler unless profiled
+        if self.__profiler is None:
+            self.__apply(batch)
+            return
+        with self.__profiler_changed:
+            profile = self.__profiler
+            self.__profiling_batch = profile is not None
+        if profile is None:
+            self.__apply(batch)
+            return
+        profile.enable()
+        try:
+            self.__apply(batch)
+        finally:
+            profile.disable()
+            with self.__profiler_changed:
+                self.__profiling_batch = False
+                self.__profiler_changed.notify_all()
+
+    def __apply(self, batch):
+        start = time.perf_counter()
+        for (timeReceived, _, _) in batch:
+            __QUEUE_WAIT_STAGE__.observe(start - timeReceived)
+        entries = []
+        received = []
+        duplicates = {}
+        for (timeReceived, topic, message) in batch:
+            try:
+                # terminals send bursts of scans as one batch message
+                payloads = decodeBatch(message) if topic != TERMINAL_DEBUG else [message]
+            except ValueError:
+                logging.warning('[%s] malformed batch on topic %s: %r', self, topic, message)
+                continue
+            for payload in payloads:
+                try:
+                    entry = self.__parse(topic, payload)
+                except (ValueError, KeyError, TypeError, AttributeError):
+                    logging.warning('[%s] malformed message on topic %s: %r', self, topic, payload)
+                    continue
+                if entry is None:
+                    continue
+                (rfid_uid, terminal_id, date) = entry
+                if self.__duplicates is not None and self.__duplicates.isDuplicate(terminal_id, rfid_uid, date):
+                    logging.debug('(Terminal-id: %s) duplicate record of rfid_uid=%s suppressed',
+                                  terminal_id, rfid_uid)
+                    duplicates[terminal_id] = duplicates.get(terminal_id, 0) + 1
+                    continue
+                entries.append(entry)
+                received.append(timeReceived)
+
+        # one registry update per terminal and batch
+        for (terminal_id, count) in duplicates.items():
+            self.__registry.recordDuplicates(terminal_id, count)
+
+        if len(entries) > 0:
+            scans = {}
+            for (_, terminal_id, _) in entries:
+                scans[terminal_id] = scans.get(terminal_id, 0) + 1
+            for (terminal_id, count) in scans.items():
+                self.__registry.recordScans(terminal_id, count)
+
+            (addedEmployees, entries) = self.__add_entries(entries)
+            logged = time.perf_counter()
+            for rfid_uid in addedEmployees:
+                logging.info('added anonymous employee with rfid-uid=%s to database', rfid_uid)
+            if logging.getLogger().isEnabledFor(logging.INFO):
+                self.__log_scans(entries)
+            __LOGGING_STAGE__.observe(time.perf_counter() - logged)
+            if self.__on_applied is not None:
+                self.__on_applied()
+
+        applied = time.perf_counter()
+        __APPLY_STAGE__.observe(applied - start)
+        with self.__stats_lock:
+            self.__latencies.extend(applied - timeReceived for timeReceived in received)
+            self.__messages += len(batch)
+            self.__batches += 1
+
+    def __add_entries(self, entries):
+        """
+        batch is applied at once - if that fails, entry by entry (so one bad entry doesn't lose the rest)\n
+        Returns:\n
+        \ttuple(list of rfid-uids of added anonymous employees, list of applied entries)
+        """
+        try:
+            return (self.__database.addEntries(entries, addUnknownEmployees=True), entries)
+        except Exception as error:
+            from src.data import BatchPartiallyAppliedError
+            if isinstance(error, BatchPartiallyAppliedError):
+                # sharded database - the other shards applied their part
+                (addedEmployees, failed) = (error.addedEmployees, error.entries)
+                error = error.error
+            else:
+                (addedEmployees, failed) = ([], entries)
+            logging.warning('[%s] %d of %d entries could not be applied at once (%r), applying them one by one',
+                            self, len(failed), len(entries), error)
+
+        failedIds = set(id(entry) for entry in failed)
+        applied = [entry for entry in entries if id(entry) not in failedIds]
+        for entry in failed:
+            (rfid_uid, terminal_id, _) = entry
+            try:
+                addedEmployees.extend(self.__database.addEntries([entry], addUnknownEmployees=True))
+            except Exception as error:
+                logging.error('(Terminal-id: %s) entry for rfid_uid=%s not added: %r', terminal_id, rfid_uid, error)
+                self.__registry.recordError(terminal_id)
+                continue
+            applied.append(entry)
+        return (addedEmployees, applied)
+
+    def __log_scans(self, entries):
+        limiter = self.__scan_log_limiter
+        for (rfid_uid, terminal_id, _) in entries:
+            # limiter is checked first - refused lines cost no log record
+            if limiter is None or limiter.acquire():
+                logging.info('(Terminal-id: %s) added entry for rfid_uid=%s', terminal_id, rfid_uid)
+        refused = limiter.takeRefused() if limiter is not None else 0
+        if refused > 0:
+            logging.info('[%s] added %d entries (%d not logged - rate limit)', self, len(entries), refused)
+        else:
+            logging.info('[%s] added %d entries', self, len(entries))
+
+    def getQueueDepth(self):
+        """
+        Returns:\n
+        \tint number of messages received and not taken by the worker yet
+        """
+        if self.__async_queue is not None:
+            return self.__async_queue.qsize()
+        return self.__queue.qsize()
+
+    def getLatencyStats(self):
+        """
+        Returns:\n
+        \tdict (messages, batches, duplicates - suppressed records,
+        \tp50/p90/p99/max - in seconds, over the most recent entries)
+        """
+        with self.__stats_lock:
+            latencies = sorted(self.__latencies)
+            stats = {'messages': self.__messages, 'batches': self.__batches,
+                     'duplicates': self.__duplicates.getSuppressedCount() if self.__duplicates is not None else 0}
+        for percentile in __LATENCY_PERCENTILES__:
+            stats[f'p{percentile}'] = latencies[(len(latencies) - 1) * percentile // 100] if latencies else 0.0
+        stats['max'] = latencies[-1] if latencies else 0.0
+        return stats
+
+    def formatLatencyStats(self):
+        """
+        Returns:\n
+        \tstr summary of getLatencyStats
+        """
+        stats = self.getLatencyStats()
+        return f"{stats['messages']} messages in {stats['batches']} batches, " \
+            f"{stats['duplicates']} duplicates suppressed, latency " + \
+            ', '.join(f"p{percentile} {stats[f'p{percentile}'] * 1000:.2f} ms"
+                      for percentile in __LATENCY_PERCENTILES__) + f", max {stats['max'] * 1000:.2f} ms"
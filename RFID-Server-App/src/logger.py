@@ -2,31 +2,127 @@
 from config import *
 from datetime import datetime as date
 from zipfile import ZipFile, ZIP_BZIP2
-from src.utils import cd
+from concurrent.futures import ThreadPoolExecutor
+from logging.handlers import QueueHandler, QueueListener, WatchedFileHandler
+import atexit
+import queue
 import time
 import logging
 import os
-import bz2
 
 # path to current session log
 __LOGS_DIR__ = "./logs"
 __LOG_FILE__ = "latest.log"
+__LOG_PATH__ = os.path.join(__LOGS_DIR__, __LOG_FILE__)
+# name of rotated log (time of its first record)
+__ROTATED_LOG_NAME__ = '%d-%m-%Y-%H-%M-%S'
 
 # create logs dir
 if not os.path.exists(__LOGS_DIR__):
     os.mkdir(__LOGS_DIR__)
 
-# move old log to zip archive
-with cd(__LOGS_DIR__):
-    if os.path.exists(__LOG_FILE__):
-        old_log_file = time.strftime(
-            '%d-%m-%Y-%H-%M-%S.log', time.localtime(os.path.getctime(__LOG_FILE__)))
-        os.rename(__LOG_FILE__, old_log_file)
+# rotated logs are zipped in background (one at a time), unfinished archives are redone on next start
+_compressor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='log-compressor')
 
-        with ZipFile(old_log_file.replace('.log', '.zip'), 'w', ZIP_BZIP2) as ziplog:
-            ziplog.write(old_log_file)
 
-        os.remove(old_log_file)
+def _compress_rotated_logs():
+    """
+    moves every rotated log (logs/*.log except latest.log) to its bz2 zip archive
+    """
+    for name in sorted(os.listdir(__LOGS_DIR__)):
+        if not name.endswith('.log') or name == __LOG_FILE__:
+            continue
+        path = os.path.join(__LOGS_DIR__, name)
+        archivePath = path[:-len('.log')] + '.zip'
+        try:
+            with ZipFile(archivePath + '.tmp', 'w', ZIP_BZIP2) as ziplog:
+                ziplog.write(path, arcname=name)
+            os.replace(archivePath + '.tmp', archivePath)
+            os.remove(path)
+        except OSError:
+            logging.exception('failed to compress log "%s"', path)
+
+
+def _rotate_log(path, created):
+    """
+    renames log to name of its creation time (compressed later)\n
+    Returns:\n
+    \tstr new path
+    """
+    name = time.strftime(__ROTATED_LOG_NAME__, time.localtime(created))
+    rotatedPath = os.path.join(__LOGS_DIR__, name + '.log')
+    suffix = 1
+    # more rotations within one second
+    while os.path.exists(rotatedPath) or os.path.exists(rotatedPath[:-len('.log')] + '.zip'):
+        rotatedPath = os.path.join(__LOGS_DIR__, f'{name}-{suffix}.log')
+        suffix += 1
+    os.rename(path, rotatedPath)
+    return rotatedPath
+
+
+# log of previous session is only renamed here, compression doesn't delay startup
+if os.path.exists(__LOG_PATH__):
+    _rotate_log(__LOG_PATH__, os.path.getctime(__LOG_PATH__))
+_compressor.submit(_compress_rotated_logs)
+
+
+class SessionFileHandler(logging.FileHandler):
+    """
+    Writes latest.log, rotated once it is maxBytes long or maxAge seconds old (0 - no limit) -
+    rotated file gets name of its creation time and is compressed in background.\n
+    File is opened for appending (previous log was rotated away), so lines of forked processes
+    aren't overwritten.
+    """
+
+    def __init__(self, path, maxBytes=0, maxAge=0):
+        super().__init__(path, mode='a')
+        self.__max_bytes = maxBytes
+        self.__max_age = maxAge
+        self.__created = time.time()
+        self.__size = 0
+
+    def emit(self, record):
+        try:
+            if self.__should_rotate():
+                self.__rotate()
+        except OSError:
+            self.handleError(record)
+        super().emit(record)
+
+    def format(self, record):
+        msg = super().format(record)
+        # characters, not bytes - close enough for the limit
+        self.__size += len(msg) + 1
+        return msg
+
+    def __should_rotate(self):
+        return (self.__max_bytes > 0 and self.__size >= self.__max_bytes) or \
+            (self.__max_age > 0 and time.time() - self.__created >= self.__max_age)
+
+    def __rotate(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+        _rotate_log(self.baseFilename, self.__created)
+        self.stream = self._open()
+        self.__created = time.time()
+        self.__size = 0
+        _compressor.submit(_compress_rotated_logs)
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    Enqueues records as they are - unlike QueueHandler, message isn't formatted by the logging
+    thread but by the listener (records never leave the process, so they needn't be pickled).\n
+    Arguments of log calls mustn't be changed after the call.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+# file is written by listener thread, logging calls only enqueue records
+__listener = None
 
 # logger configuration
 if LOGGING_ENABLED:
@@ -35,22 +131,66 @@ if LOGGING_ENABLED:
     else:
         logLevel = logging.INFO
 
-    logging.basicConfig(filename=f'{__LOGS_DIR__}/{__LOG_FILE__}', filemode='w',
-                        format='[%(asctime)s][%(levelname)s] %(message)s', level=logLevel, datefmt='%d-%m-%Y %H:%M:%S')
+    __file_handler = SessionFileHandler(__LOG_PATH__, LOG_MAX_BYTES, LOG_MAX_AGE)
+    __file_handler.setFormatter(logging.Formatter('[%(asctime)s][%(levelname)s] %(message)s',
+                                                  datefmt='%d-%m-%Y %H:%M:%S'))
+    __log_queue = queue.SimpleQueue()
+    __queue_handler = DeferredQueueHandler(__log_queue)
+    __listener = QueueListener(__log_queue, __file_handler)
+    __listener.start()
+    logging.basicConfig(handlers=[__queue_handler], level=logLevel)
 else:
     logging.disable(logging.CRITICAL)
 
 
+def stopLogging():
+    """
+    writes records still queued and stops the listener thread - the file is written directly from then on
+    """
+    global __listener
+    if __listener is not None:
+        __listener.stop()
+        __listener = None
+        logging.getLogger().removeHandler(__queue_handler)
+        logging.getLogger().addHandler(__file_handler)
+
+
+atexit.register(stopLogging)
+
+
+def _log_directly_in_child():
+    """
+    forked process (database shard) has no listener thread - records it queued would never be written,
+    so it appends to latest.log itself (reopened when the server rotates it)
+    """
+    if __listener is None:
+        return
+    root = logging.getLogger()
+    root.removeHandler(__queue_handler)
+    handler = WatchedFileHandler(__LOG_PATH__, mode='a', delay=True)
+    handler.setFormatter(__file_handler.formatter)
+    root.addHandler(handler)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_log_directly_in_child)
+
+
+def getSessionLogPath():
+    """
+    Returns:\n
+    \tstr path of current session log (records since its last rotation)
+    """
+    return __LOG_PATH__
+
+
 def getSessionLogs():
     """
     Returns:\n
-    \tlist(str) logs
-    """
-    logs = []
-    with cd(__LOGS_DIR__):
-        if os.path.exists(__LOG_FILE__):
-            with open(__LOG_FILE__, 'r') as logfile:
-                lines = logfile.readlines()
-                for line in lines:
-                    logs.append(line.strip('\n'))
-    return logs
\ No newline at end of file
+    \titerator of str lines of current session log (read as they are consumed)
+    """
+    if not os.path.exists(__LOG_PATH__):
+        return
+    with open(__LOG_PATH__, 'r', errors='replace') as logfile:
+        for line in logfile:
+            yield line.rstrip('\n')
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+import logging
+import os
+import re
+from array import array
+
+# every this many matching lines the offset of a line is remembered
+__INDEX_STRIDE__ = 64
+# bytes read at once while indexing
+__CHUNK_SIZE__ = 1 << 20
+# level of record line - '[<date time>][<LEVEL>] <message>' (see logger)
+__LEVEL_PATTERN__ = re.compile(rb'^\[[^\]]*\]\[([A-Z]+)\]')
+
+
+class LogReader:
+    """
+    Pages of a log file which keeps growing (latest.log) without loading it - lines are
+    indexed incrementally (offset of every __INDEX_STRIDE__-th matching line), a page is read
+    by seeking to the nearest remembered offset.\n
+    Lines can be filtered by minimal level and terminal id (records mentioning
+    "(Terminal-id: <id>)" or "id=<id>"); continuation lines (tracebacks) go with their record.
+    When the file is replaced (rotated - another inode) or gets shorter (truncated)
+    it is indexed again from the start.
+    """
+
+    def __init__(self, path, level=logging.NOTSET, terminal_id=None):
+        """
+        level: lines of records with lower level are skipped\n
+        terminal_id: only records of this terminal (None - all)
+        """
+        self.__path = path
+        self.__level = level
+        escaped = re.escape(str(terminal_id).encode())
+        self.__terminal_pattern = None if terminal_id is None else \
+            re.compile(rb'\(Terminal-id: ' + escaped + rb'\)|id=' + escaped + rb'(?![\w-])')
+        self.__reset()
+
+    def __reset(self):
+        # offsets of matching lines number 0, stride, 2 * stride...
+        self.__index = array('Q')
+        self.__lines = 0
+        # end of the last complete line indexed
+        self.__indexed = 0
+        # inode of the indexed file (None - nothing indexed)
+        self.__inode = None
+        # whether the last record (for continuation lines) matches
+        self.__record_matches = True
+
+    def __matches(self, line):
+        match = __LEVEL_PATTERN__.match(line)
+        if match is None:
+            # continuation of multi-line record
+            return self.__record_matches
+        levelno = logging.getLevelName(match.group(1).decode())
+        matches = not isinstance(levelno, int) or levelno >= self.__level
+        if matches and self.__terminal_pattern is not None:
+            matches = self.__terminal_pattern.search(line) is not None
+        self.__record_matches = matches
+        return matches
+
+    def __index_line(self, line, offset):
+        if self.__matches(line):
+            if self.__lines % __INDEX_STRIDE__ == 0:
+                self.__index.append(offset)
+            self.__lines += 1
+
+    def refresh(self):
+        """
+        indexes lines appended since previous call\n
+        Returns:\n
+        \tint number of matching lines
+        """
+        try:
+            logFile = open(self.__path, 'rb')
+        except OSError:
+            self.__reset()
+            return 0
+
+        with logFile:
+            status = os.fstat(logFile.fileno())
+            if status.st_ino != self.__inode or status.st_size < self.__indexed:
+                self.__reset()
+                self.__inode = status.st_ino
+            logFile.seek(self.__indexed)
+            offset = self.__indexed
+            # unterminated line read so far - it's indexed once its '\n' is read
+            tail = []
+            while True:
+                chunk = logFile.read(__CHUNK_SIZE__)
+                if len(chunk) == 0:
+                    # incomplete last line is indexed next time
+                    break
+                end = chunk.rfind(b'\n') + 1
+                if end == 0:
+                    # line longer than chunk
+                    tail.append(chunk)
+                    continue
+                tail.append(chunk[:end])
+                # only '\n' ends a line (as when the file is iterated)
+                lines = b''.join(tail).split(b'\n')
+                lines.pop()
+                tail = [chunk[end:]]
+                for line in lines:
+                    self.__index_line(line, offset)
+                    offset += len(line) + 1
+                self.__indexed = offset
+        return self.__lines
+
+    def getLineCount(self):
+        return self.__lines
+
+    def getPageCount(self, pageSize):
+        return max(1, (self.__lines + pageSize - 1) // pageSize)
+
+    def getLines(self, start, count):
+        """
+        start: number of the first matching line (negative - from the end)\n
+        Returns:\n
+        \tlist of str matching lines (without line ends), only indexed lines are returned
+        """
+        if start < 0:
+            start = max(0, self.__lines + start)
+        count = min(count, self.__lines - start)
+        if count <= 0:
+            return []
+
+        lines = []
+        checkpoint = start // __INDEX_STRIDE__
+        number = checkpoint * __INDEX_STRIDE__
+        # filter state at the checkpoint - its line is a matching record line or continuation of one
+        recordMatches = self.__record_matches
+        self.__record_matches = True
+        with open(self.__path, 'rb') as logFile:
+            if os.fstat(logFile.fileno()).st_ino != self.__inode:
+                # rotated since refresh - offsets belong to the old file
+                self.__record_matches = recordMatches
+                return []
+            logFile.seek(self.__index[checkpoint])
+            offset = self.__index[checkpoint]
+            for line in logFile:
+                if offset >= self.__indexed:
+                    break
+                offset += len(line)
+                if not self.__matches(line):
+                    continue
+                if number >= start:
+                    lines.append(line.rstrip(b'\r\n').decode('utf-8', errors='replace'))
+                    if len(lines) == count:
+                        break
+                number += 1
+        self.__record_matches = recordMatches
+        return lines
+
+    def getPage(self, page, pageSize):
+        """
+        page: number of page from 0 (negative - from the end, -1 is the tail)\n
+        Returns:\n
+        \tlist of str lines of the page
+        """
+        if page < 0:
+            page = max(0, self.getPageCount(pageSize) + page)
+        return self.getLines(page * pageSize, pageSize)
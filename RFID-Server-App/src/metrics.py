@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+import bisect
+import logging
+import os
+import threading
+import time
+
+# upper bounds (in seconds) of histogram buckets - 5 us to ~42 s, every bucket twice the previous
+__BUCKETS__ = tuple(5e-6 * 2 ** exponent for exponent in range(24))
+# stage durations are exported as one histogram labelled by stage
+__STAGE_METRIC__ = 'rfid_server_stage_seconds'
+# percentiles shown in summary
+__SUMMARY_PERCENTILES__ = (50, 99)
+__CONTENT_TYPE__ = 'text/plain; version=0.0.4; charset=utf-8'
+__STARTUP_METRIC__ = 'rfid_server_startup_seconds'
+
+
+class Histogram:
+    """
+    Distribution of durations in fixed buckets (Prometheus histogram) - observing is a bisect
+    and a few additions under a lock, cheap enough for every message. Percentiles are
+    estimated by upper bound of the bucket they fall into.
+    """
+
+    def __init__(self, bounds=__BUCKETS__):
+        self.__bounds = bounds
+        self.__lock = threading.Lock()
+        # last bucket is +Inf
+        self.__counts = [0] * (len(bounds) + 1)
+        self.__sum = 0.0
+        self.__max = 0.0
+
+    def observe(self, seconds):
+        index = bisect.bisect_left(self.__bounds, seconds)
+        with self.__lock:
+            self.__counts[index] += 1
+            self.__sum += seconds
+            if seconds > self.__max:
+                self.__max = seconds
+
+    def getBounds(self):
+        return self.__bounds
+
+    def _after_fork(self):
+        # lock held by another thread of the parent when it forked would never be released
+        self.__lock = threading.Lock()
+
+    def snapshot(self):
+        """
+        Returns:\n
+        \ttuple(list counts of buckets (last is +Inf), float sum, float max)
+        """
+        with self.__lock:
+            return (list(self.__counts), self.__sum, self.__max)
+
+    def percentile(self, percentile, snapshot=None):
+        """
+        Returns:\n
+        \tfloat upper bound of bucket of the percentile (max for +Inf bucket), 0.0 if nothing was observed
+        """
+        (counts, _, maximum) = self.snapshot() if snapshot is None else snapshot
+        rank = sum(counts) * percentile / 100
+        cumulative = 0
+        for (index, count) in enumerate(counts):
+            cumulative += count
+            if count > 0 and cumulative >= rank:
+                return min(self.__bounds[index], maximum) if index < len(self.__bounds) else maximum
+        return 0.0
+
+
+def _format_labels(labels):
+    if len(labels) == 0:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                          for (name, value) in labels.items()) + '}'
+
+
+class MetricsRegistry:
+    """
+    Metrics of the server - duration histograms of processing stages (parse, whitelist check,
+    lock wait, addEntry, logging, save/load...) and counters/gauges read on demand from their
+    owners through collectors (queue depths, messages per terminal).\n
+    Rendered in Prometheus text format (MetricsExporter) or as summary for the console menu.
+    Metrics of processes other than the server's (database shard workers) are not included.
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        # stage -> Histogram (dict keeps the order stages were created in)
+        self.__stages = {}
+        # name -> tuple(str kind, str description, callable collector)
+        self.__collectors = {}
+
+    def stage(self, name):
+        """
+        Returns:\n
+        \tHistogram of durations of the stage (created on first use)
+        """
+        with self.__lock:
+            histogram = self.__stages.get(name)
+            if histogram is None:
+                histogram = self.__stages[name] = Histogram()
+            return histogram
+
+    def register(self, name, kind, description, collector):
+        """
+        kind: 'counter'/'gauge'\n
+        collector: callable() -> list of tuple(dict labels, number value), called whenever metrics are read;
+        collector registered under the same name before is replaced
+        """
+        with self.__lock:
+            self.__collectors[name] = (kind, description, collector)
+
+    def unregister(self, name):
+        with self.__lock:
+            self.__collectors.pop(name, None)
+
+    def _after_fork(self):
+        # forked child (database shard) keeps observing stages, locks held by other threads
+        # of the parent when it forked would never be released there
+        self.__lock = threading.Lock()
+        for histogram in self.__stages.values():
+            histogram._after_fork()
+
+    def __collect(self):
+        """
+        Returns:\n
+        \tlist of tuple(str name, str kind, str description, list samples), failing collectors are skipped
+        """
+        with self.__lock:
+            collectors = list(self.__collectors.items())
+        collected = []
+        for (name, (kind, description, collector)) in collectors:
+            try:
+                collected.append((name, kind, description, collector()))
+            except Exception:
+                logging.exception('[%s] collector of %s failed', self, name)
+        return collected
+
+    def __str__(self):
+        return self.__class__.__name__
+
+    def render(self):
+        """
+        Returns:\n
+        \tstr metrics in Prometheus text exposition format
+        """
+        with self.__lock:
+            stages = list(self.__stages.items())
+        lines = []
+        if len(stages) > 0:
+            lines.append(f'# HELP {__STAGE_METRIC__} Duration of server processing stages.')
+            lines.append(f'# TYPE {__STAGE_METRIC__} histogram')
+            for (stage, histogram) in stages:
+                (counts, total, _) = histogram.snapshot()
+                cumulative = 0
+                for (bound, count) in zip(histogram.getBounds() + ('+Inf',), counts):
+                    cumulative += count
+                    labels = _format_labels({'stage': stage, 'le': bound if bound == '+Inf' else f'{bound:g}'})
+                    lines.append(f'{__STAGE_METRIC__}_bucket{labels} {cumulative}')
+                labels = _format_labels({'stage': stage})
+                lines.append(f'{__STAGE_METRIC__}_sum{labels} {total!r}')
+                lines.append(f'{__STAGE_METRIC__}_count{labels} {cumulative}')
+
+        for (name, kind, description, samples) in self.__collect():
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {kind}')
+            for (labels, value) in samples:
+                lines.append(f'{name}{_format_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """
+        Returns:\n
+        \tlist of str lines - count, p50/p99 and max of every stage, then values of counters and gauges
+        """
+        with self.__lock:
+            stages = list(self.__stages.items())
+        lines = [f"{'stage':<16}{'count':>10}" +
+                 ''.join(f"{f'p{percentile}':>12}" for percentile in __SUMMARY_PERCENTILES__) + f"{'max':>12}"]
+        for (stage, histogram) in stages:
+            snapshot = histogram.snapshot()
+            lines.append(f'{stage:<16}{sum(snapshot[0]):>10}' +
+                         ''.join(f'{histogram.percentile(percentile, snapshot) * 1000:>9.3f} ms'
+                                 for percentile in __SUMMARY_PERCENTILES__) +
+                         f'{snapshot[2] * 1000:>9.3f} ms')
+
+        for (name, _, description, samples) in self.__collect():
+            lines.append('')
+            lines.append(f'{description}:')
+            if len(samples) == 0:
+                lines.append('\t-')
+            for (labels, value) in samples:
+                lines.append('\t' + (', '.join(str(label) for label in labels.values()) + ': '
+                                     if len(labels) > 0 else '') + str(value))
+        return lines
+
+
+# metrics of this process
+METRICS = MetricsRegistry()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=METRICS._after_fork)
+
+
+class StartupProfile:
+    """
+    Times of startup phases (imports done, broker connected, database loaded, first message
+    ingested...) in seconds since start - logged as a breakdown and exported as gauge
+    rfid_server_startup_seconds{phase=...} so time-to-first-ingest can be tracked.
+    """
+
+    def __init__(self, start=None):
+        """
+        start: time.perf_counter() value startup is measured from (None - now)
+        """
+        self.__start = time.perf_counter() if start is None else start
+        self.__lock = threading.Lock()
+        # phase -> float seconds since start (dict keeps the order phases were reached in)
+        self.__phases = {}
+
+    def __str__(self):
+        return self.__class__.__name__
+
+    def mark(self, phase):
+        """
+        records that phase was reached now (safe to call from any thread)\n
+        Returns:\n
+        \tfloat seconds since start
+        """
+        elapsed = time.perf_counter() - self.__start
+        with self.__lock:
+            self.__phases[phase] = elapsed
+        return elapsed
+
+    def getPhases(self):
+        """
+        Returns:\n
+        \tdict phase -> float seconds since start
+        """
+        with self.__lock:
+            return dict(self.__phases)
+
+    def register(self, registry=METRICS):
+        registry.register(__STARTUP_METRIC__, 'gauge', 'Seconds from start to startup phases',
+                          lambda: [({'phase': phase}, round(elapsed, 6))
+                                   for (phase, elapsed) in self.getPhases().items()])
+
+    def format(self):
+        """
+        Returns:\n
+        \tlist of str lines - phases in order reached, time since start and since previous phase
+        """
+        lines = []
+        previous = 0.0
+        for (phase, elapsed) in sorted(self.getPhases().items(), key=lambda item: item[1]):
+            lines.append(f'{phase:<20}{elapsed * 1000:>10.1f} ms (+{(elapsed - previous) * 1000:.1f} ms)')
+            previous = elapsed
+        return lines
+
+
+class MetricsExporter:
+    """
+    Makes metrics available to Prometheus - text file rewritten every interval seconds
+    (atomically, for node_exporter textfile collector) and/or HTTP endpoint (GET /metrics).
+    """
+
+    def __init__(self, registry=METRICS, path='', interval=15, port=0, host='127.0.0.1'):
+        """
+        path: metrics file ('' - not written)\n
+        port: port of HTTP endpoint (0 - no endpoint)
+        """
+        self.__registry = registry
+        self.__path = path
+        self.__interval = interval
+        self.__address = (host, port)
+        self.__stop = threading.Event()
+        self.__writer = threading.Thread(target=self.__write_loop, name='metrics-writer', daemon=True)
+        self.__http_server = None
+
+    def __str__(self):
+        return self.__class__.__name__
+
+    def start(self):
+        """
+        Throws exceptions:\n
+        \tOSError (HTTP endpoint couldn't be bound)
+        """
+        if self.__address[1] != 0:
+            # http.server is imported only when the endpoint is enabled (slow import)
+            from http.server import ThreadingHTTPServer
+            self.__http_server = ThreadingHTTPServer(self.__address, self.__handler())
+            self.__http_server.daemon_threads = True
+            threading.Thread(target=self.__http_server.serve_forever, name='metrics-http', daemon=True).start()
+            logging.info('[%s] serving metrics on http://%s:%d/metrics', self, *self.__address)
+        if self.__path != '':
+            self.__writer.start()
+
+    def stop(self):
+        if self.__http_server is not None:
+            self.__http_server.shutdown()
+            self.__http_server.server_close()
+            self.__http_server = None
+        if self.__writer.is_alive():
+            self.__stop.set()
+            self.__writer.join()
+            # final values
+            self.write()
+
+    def write(self):
+        temporaryPath = self.__path + '.tmp'
+        with open(temporaryPath, 'w') as metricsFile:
+            metricsFile.write(self.__registry.render())
+        os.replace(temporaryPath, self.__path)
+
+    def __write_loop(self):
+        while not self.__stop.wait(self.__interval):
+            try:
+                self.write()
+            except OSError:
+                logging.exception('[%s] writing metrics to "%s" failed', self, self.__path)
+
+    def __handler(self):
+        from http.server import BaseHTTPRequestHandler
+        registry = self.__registry
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', __CONTENT_TYPE__)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # scrapes would flood the server log
+                pass
+
+        return MetricsHandler
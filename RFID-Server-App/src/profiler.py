@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+import cProfile
+import logging
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+
+# seconds between stack samples of all threads
+__DEFAULT_SAMPLE_INTERVAL__ = 0.01
+# name of report directory (time the profiling started)
+__REPORT_DIR_NAME__ = '%d-%m-%Y-%H-%M-%S'
+# subsystem of threads running paho network loops (the threads are unnamed)
+__MQTT_SUBSYSTEM__ = 'mqtt'
+__PAHO_PATH__ = os.sep + 'paho' + os.sep
+# number of functions in text report of cProfile
+__PSTATS_LINES__ = 60
+# pool threads are numbered (database-writer_0, Thread-3) - the number isn't part of subsystem
+__THREAD_NUMBER__ = re.compile(r'[-_ ]?\d+( \(.*\))?$')
+__UNSAFE_CHARACTERS__ = re.compile(r'[^\w.-]')
+
+
+def _subsystem(threadName, frame):
+    """
+    Returns:\n
+    \tstr subsystem of thread - its name without number, 'mqtt' for paho network threads
+    """
+    while frame is not None:
+        if __PAHO_PATH__ in frame.f_code.co_filename:
+            return __MQTT_SUBSYSTEM__
+        frame = frame.f_back
+    # subsystem is the name of its report file
+    return __UNSAFE_CHARACTERS__.sub('_', __THREAD_NUMBER__.sub('', threadName) or threadName)
+
+
+def _collapse(frame):
+    """
+    Returns:\n
+    \tstr stack in collapsed format (outermost frame first, frames separated by ';')
+    """
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+    frames.reverse()
+    return ';'.join(frames)
+
+
+class SamplingProfiler:
+    """
+    Samples stacks of all threads (paho loops, broadcast, autosave, ingestion...) every interval
+    seconds from its own thread - cost doesn't depend on what the threads do, so it can run
+    in production. Stacks are counted per subsystem (thread name, see _subsystem) in collapsed
+    format of flamegraph tools.
+    """
+
+    def __init__(self, interval=__DEFAULT_SAMPLE_INTERVAL__):
+        self.__interval = interval
+        self.__stop = threading.Event()
+        self.__thread = threading.Thread(target=self.__run, name='sampling-profiler', daemon=True)
+        # subsystem -> dict str collapsed-stack -> int samples
+        self.__stacks = {}
+        self.__samples = 0
+
+    def __str__(self):
+        return self.__class__.__name__
+
+    def start(self):
+        self.__thread.start()
+
+    def stop(self):
+        self.__stop.set()
+        if self.__thread.is_alive():
+            self.__thread.join()
+
+    def __sample(self):
+        ownId = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for (threadId, frame) in sys._current_frames().items():
+            if threadId == ownId:
+                continue
+            threadName = names.get(threadId, str(threadId))
+            stacks = self.__stacks.setdefault(_subsystem(threadName, frame), {})
+            stack = threadName + ';' + _collapse(frame)
+            stacks[stack] = stacks.get(stack, 0) + 1
+        self.__samples += 1
+
+    def __run(self):
+        while not self.__stop.wait(self.__interval):
+            self.__sample()
+
+    def getSampleCount(self):
+        return self.__samples
+
+    def getStacks(self):
+        """
+        has to be called after stop\n
+        Returns:\n
+        \tdict subsystem -> dict str collapsed-stack (thread name first) -> int samples
+        """
+        return self.__stacks
+
+
+def writeCollapsed(filePath, stacks):
+    """
+    stacks: dict str collapsed-stack -> int samples (written most frequent first)
+    """
+    with open(filePath, 'w') as collapsedFile:
+        for (stack, count) in sorted(stacks.items(), key=lambda item: -item[1]):
+            collapsedFile.write(f'{stack} {count}\n')
+
+
+class ProfilingSession:
+    """
+    Profiles the running server for duration seconds - cProfile of the ingestion worker
+    (batches it applies, see IngestPipeline.setProfiler) and SamplingProfiler of all threads.\n
+    Reports are written to <profilesDir>/<start time>/ when it ends: ingest.pstats (and ingest.txt,
+    functions by cumulative time) and <subsystem>.collapsed stacks for flamegraphs
+    (all.collapsed with stacks of every thread).
+    """
+
+    def __init__(self, server, duration, profilesDir, interval=__DEFAULT_SAMPLE_INTERVAL__):
+        """
+        server: src.server.Server
+        """
+        self.__server = server
+        self.__duration = duration
+        self.__report_dir = os.path.join(profilesDir, time.strftime(__REPORT_DIR_NAME__))
+        self.__profile = cProfile.Profile()
+        self.__sampler = SamplingProfiler(interval)
+        self.__stop = threading.Event()
+        self.__thread = threading.Thread(target=self.__run, name='profiling-session', daemon=True)
+        self.__reports = []
+
+    def __str__(self):
+        return self.__class__.__name__
+
+    def start(self):
+        logging.info('[%s] profiling for %s s, reports go to "%s"', self, self.__duration, self.__report_dir)
+        self.__server.setIngestProfiler(self.__profile)
+        self.__sampler.start()
+        self.__thread.start()
+
+    def stop(self):
+        """
+        ends profiling early (reports are written), waits until reports are written
+        """
+        self.__stop.set()
+        if self.__thread.is_alive():
+            self.__thread.join()
+
+    def isRunning(self):
+        return self.__thread.is_alive()
+
+    def getReportDir(self):
+        return self.__report_dir
+
+    def getReports(self):
+        """
+        Returns:\n
+        \tlist of str paths of written reports (empty until session ends)
+        """
+        return list(self.__reports)
+
+    def __run(self):
+        self.__stop.wait(self.__duration)
+        # waits for batch being profiled
+        self.__server.setIngestProfiler(None)
+        self.__sampler.stop()
+        try:
+            self.__write_reports()
+        except OSError:
+            logging.exception('[%s] writing reports to "%s" failed', self, self.__report_dir)
+            return
+        logging.info('[%s] %d samples, reports written: %s', self, self.__sampler.getSampleCount(),
+                     ', '.join(self.__reports))
+
+    def __write_reports(self):
+        os.makedirs(self.__report_dir, exist_ok=True)
+        self.__profile.create_stats()
+        pstatsPath = os.path.join(self.__report_dir, 'ingest.pstats')
+        self.__profile.dump_stats(pstatsPath)
+        self.__reports.append(pstatsPath)
+        textPath = os.path.join(self.__report_dir, 'ingest.txt')
+        with open(textPath, 'w') as textFile:
+            if len(self.__profile.stats) == 0:
+                textFile.write('no batches were applied while profiling\n')
+            else:
+                stats = pstats.Stats(self.__profile, stream=textFile)
+                stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(__PSTATS_LINES__)
+        self.__reports.append(textPath)
+
+        allStacks = {}
+        for (subsystem, stacks) in sorted(self.__sampler.getStacks().items()):
+            path = os.path.join(self.__report_dir, f'{subsystem}.collapsed')
+            writeCollapsed(path, stacks)
+            self.__reports.append(path)
+            allStacks.update(stacks)
+        path = os.path.join(self.__report_dir, 'all.collapsed')
+        writeCollapsed(path, allStacks)
+        self.__reports.append(path)
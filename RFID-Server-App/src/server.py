@@ -2,13 +2,14 @@
 import paho.mqtt.client as mqtt
 import os
 import time
-import src.data as data
 import threading
 import json
 from src.logger import *
 from config import *
 from src.constants import *
-from datetime import datetime as date
+from src.ingest import IngestPipeline
+from src.metrics import METRICS
+from src.wire import SUPPORTED_FORMATS
 
 # create DATA directory if doesn't exist already
 if not os.path.exists(DATA_DIR):
@@ -16,25 +17,222 @@ if not os.path.exists(DATA_DIR):
 
 # path to whitelist file
 __WHITELIST_PATH__ = f'{DATA_DIR}/whitelist.json'
+# path to file with indexes of terminals (used by binary rfid/record)
+__TERMINAL_INDEXES_PATH__ = f'{DATA_DIR}/terminal_indexes.json'
+# client id of the records subscriber (persistent session) is SERVER_ID with this suffix
+__RECORDS_CLIENT_SUFFIX__ = '-records'
 
 
-class NetworkScanner:
+class TerminalStats:
+    __slots__ = ('lastSeen', 'scans', 'lastScan', 'errors', 'duplicates')
+
     def __init__(self):
+        # times are seconds since the epoch (time.time()), None - never
+        self.lastSeen = None
+        self.scans = 0
+        self.lastScan = None
+        self.errors = 0
+        # suppressed duplicate records
+        self.duplicates = 0
+
+    def asDict(self):
+        return {'last_seen': self.lastSeen, 'scans': self.scans,
+                'last_scan': self.lastScan, 'errors': self.errors, 'duplicates': self.duplicates}
+
+
+class TerminalRegistry:
+    """
+    Terminals known to the server - whitelist, binary record indexes, presence and counters.\n
+    Membership and index lookups are hashed (done for every rfid/record). A terminal is available
+    while its last message (broadcast reply, record, debug) is younger than presenceTtl seconds,
+    so presence doesn't drop out between broadcasts.\n
+    Safe to use from network threads, ingestion worker and menu at once.
+    """
+
+    def __init__(self, presenceTtl=TERMINAL_PRESENCE_TTL, owned=None):
+        """
+        owned: IDs of terminals whose records this server instance processes (None - all terminals)
+        """
+        self.__presence_ttl = presenceTtl
+        self.__owned = None if owned is None else frozenset(owned)
+        self.__lock = threading.Lock()
+        # whitelisted terminal IDs (dict keeps the order terminals were added in)
+        self.__whitelist = {}
+        # The indexes of terminals (never reused) and terminals by index
+        self.__indexes = {}
+        self.__index_terminals = {}
+        # terminal_id -> TerminalStats of every terminal which sent anything
+        self.__stats = {}
+
+    def load(self, whitelist, indexes):
+        """
+        whitelist: list of terminal IDs\n
+        indexes: dict terminal_id -> index (indexes of removed terminals included)
+        """
+        with self.__lock:
+            self.__whitelist = dict.fromkeys(whitelist)
+            self.__indexes = dict(indexes)
+            self.__index_terminals = {index: terminal_id for (terminal_id, index) in indexes.items()}
+            for terminal_id in self.__whitelist:
+                self.__assign_index(terminal_id)
+
+    def __assign_index(self, terminal_id):
+        # index of removed terminal isn't reused (terminal may still send it)
+        if terminal_id not in self.__indexes:
+            index = len(self.__indexes)
+            self.__indexes[terminal_id] = index
+            self.__index_terminals[index] = terminal_id
+
+    def add(self, terminal_id):
+        """
+        Returns:\n
+        \tFalse if terminal is already on whitelist
+        """
+        with self.__lock:
+            if terminal_id in self.__whitelist:
+                return False
+            self.__whitelist[terminal_id] = None
+            self.__assign_index(terminal_id)
+        return True
+
+    def remove(self, terminal_id):
+        """
+        Returns:\n
+        \tFalse if terminal isn't on whitelist
+        """
+        with self.__lock:
+            if terminal_id not in self.__whitelist:
+                return False
+            del self.__whitelist[terminal_id]
+        return True
+
+    def isWhitelisted(self, terminal_id):
+        return terminal_id in self.__whitelist
+
+    def isOwned(self, terminal_id):
+        return self.__owned is None or terminal_id in self.__owned
+
+    def getWhitelist(self):
+        with self.__lock:
+            return list(self.__whitelist)
+
+    def getIndexes(self):
+        """
+        Returns:\n
+        \tdict terminal_id -> index of all terminals ever whitelisted
+        """
+        with self.__lock:
+            return dict(self.__indexes)
+
+    def getWhitelistedIndexes(self):
+        """
+        Returns:\n
+        \tdict terminal_id -> index of whitelisted terminals (advertised in broadcast)
+        """
+        with self.__lock:
+            return {terminal_id: self.__indexes[terminal_id] for terminal_id in self.__whitelist}
+
+    def terminalForIndex(self, index):
+        return self.__index_terminals.get(index)
+
+    def __stats_of(self, terminal_id):
+        stats = self.__stats.get(terminal_id)
+        if stats is None:
+            stats = self.__stats[terminal_id] = TerminalStats()
+        return stats
+
+    def seen(self, terminal_id, now=None):
+        """
+        records message from terminal\n
+        Returns:\n
+        \tTrue if terminal wasn't available before (appeared in network)
+        """
+        now = time.time() if now is None else now
+        with self.__lock:
+            stats = self.__stats_of(terminal_id)
+            appeared = stats.lastSeen is None or now - stats.lastSeen > self.__presence_ttl
+            stats.lastSeen = now
+        return appeared
+
+    def recordScans(self, terminal_id, count, now=None):
+        now = time.time() if now is None else now
+        with self.__lock:
+            stats = self.__stats_of(terminal_id)
+            stats.lastSeen = now
+            stats.scans += count
+            stats.lastScan = now
+
+    def recordError(self, terminal_id, now=None):
+        now = time.time() if now is None else now
+        with self.__lock:
+            stats = self.__stats_of(terminal_id)
+            stats.lastSeen = now
+            stats.errors += 1
+
+    def recordDuplicates(self, terminal_id, count, now=None):
+        now = time.time() if now is None else now
+        with self.__lock:
+            stats = self.__stats_of(terminal_id)
+            stats.lastSeen = now
+            stats.duplicates += count
+
+    def isAvailable(self, terminal_id, now=None):
+        now = time.time() if now is None else now
+        stats = self.__stats.get(terminal_id)
+        return stats is not None and stats.lastSeen is not None and now - stats.lastSeen <= self.__presence_ttl
+
+    def getAvailable(self, now=None):
+        """
+        Returns:\n
+        \tlist of terminal IDs seen in last presenceTtl seconds
+        """
+        now = time.time() if now is None else now
+        with self.__lock:
+            return [terminal_id for (terminal_id, stats) in self.__stats.items()
+                    if stats.lastSeen is not None and now - stats.lastSeen <= self.__presence_ttl]
+
+    def getStats(self, terminal_id):
+        """
+        Returns:\n
+        \tdict (last_seen, scans, last_scan, errors, duplicates) - see TerminalStats
+        """
+        with self.__lock:
+            stats = self.__stats.get(terminal_id)
+            return stats.asDict() if stats is not None else TerminalStats().asDict()
+
+    def getAllStats(self):
+        """
+        Returns:\n
+        \tdict terminal_id -> dict stats (see getStats) of every terminal which sent anything
+        """
+        with self.__lock:
+            return {terminal_id: stats.asDict() for (terminal_id, stats) in self.__stats.items()}
+
+
+class NetworkScanner:
+    def __init__(self, registry=None, clientFactory=mqtt.Client):
+        """
+        registry: TerminalRegistry - broadcast replies update presence of terminals,
+        indexes of whitelisted terminals are advertised in broadcast\n
+        clientFactory: callable() -> paho client (e.g. client of in-process fake broker)
+        """
+        self.__registry = TerminalRegistry() if registry is None else registry
         # The MQTT client.
-        self.__client = mqtt.Client()
-        self.__available_terminals = []
+        self.__client = clientFactory()
         self.__stop_broadcast = False
         self.__time_of_last_broadcast = []
-        self.__broadcast_sender = threading.Thread(target=self.__broadcast_loop, args=(
+        self.__broadcast_sender = threading.Thread(target=self.__broadcast_loop, name='broadcast', args=(
             lambda: self.__stop_broadcast, self.__time_of_last_broadcast), daemon=True)
+        # asyncio mode: broadcast task instead of the thread
+        self.__broadcast_task = None
 
     def __str__(self):
         return self.__class__.__name__
 
-    def __connect_to_broker(self):
+    def __connect_to_broker(self, loop=None):
         if TLS_ENABLED:
             if TLS_CERT_FILE == "":
-                logging.error(f"[{self}] No path to cert file in config file")
+                logging.error('[%s] No path to cert file in config file', self)
                 
             self.__client.tls_set(TLS_CERT_FILE)
  
@@ -42,26 +240,54 @@ class NetworkScanner:
                 self.__client.username_pw_set(
                     username=TLS_USERNAME, password=TLS_PASSWORD)
 
+        if loop is not None:
+            from src.aioserver import AsyncioMqttLoop
+            AsyncioMqttLoop(loop, self.__client)
+
         if PORT == 0:
             self.__client.connect(BROKER)
         else:
             self.__client.connect(BROKER, port=PORT)
 
         self.__client.on_message = self.__process_broadcast
-        self.__client.loop_start()
+        if loop is None:
+            self.__client.loop_start()
         self.__client.subscribe(BROADCAST_REPLY)
-        logging.info(
-            f'[{self}] connected to broker: {BROKER}')
+        logging.info('[%s] connected to broker: %s', self, BROKER)
 
     def __process_broadcast(self, client, userdata, msg):
         msg_json = json.loads(msg.payload)
         terminal_id = msg_json[JSON_TERMINAL_ID]
 
         if SERVER_ID == msg_json[JSON_SERVER_ID]:
-            if not terminal_id in self.__available_terminals:
-                self.__available_terminals.append(terminal_id)
-                logging.info(
-                    f'[{self}] terminal with id={terminal_id} found in network')
+            if self.__registry.seen(terminal_id):
+                logging.info('[%s] terminal with id=%s found in network', self, terminal_id)
+                # terminals older than format negotiation send JSON only
+                logging.debug('[%s] terminal with id=%s supports formats %s',
+                              self, terminal_id, msg_json.get(JSON_FORMATS, []))
+
+    def __broadcast(self, lastBroadcastTracker):
+        now = time.time()
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug('[%s] available terminals: %s', self, self.getAvailableTerminals())
+
+        msg = {JSON_SERVER_ID: SERVER_ID,
+               JSON_FORMATS: list(SUPPORTED_FORMATS),
+               JSON_TERMINAL_INDEXES: self.__registry.getWhitelistedIndexes()}
+        msg_json = json.dumps(msg)
+
+        self.__client.publish(
+            BROADCAST_REQUEST, msg_json)
+        lastBroadcastTracker.clear()
+        lastBroadcastTracker.append(now)
+        logging.info('[%s] sent network broadcast', self)
+        return now
+
+    async def __broadcast_async(self):
+        import asyncio
+        while True:
+            self.__broadcast(self.__time_of_last_broadcast)
+            await asyncio.sleep(BROADCAST_INTERVAL)
 
     def __broadcast_loop(self, stop, lastBroadcastTracker=[]):
         interval = BROADCAST_INTERVAL
@@ -70,116 +296,135 @@ class NetworkScanner:
         while True:
             now = time.time()
             if now - prev_broadcast > interval:
-                logging.debug(self.getAvailableTerminals())
-                self.__available_terminals.clear()
-
-                msg = {JSON_SERVER_ID: SERVER_ID}
-                msg_json = json.dumps(msg)
-
-                self.__client.publish(
-                    BROADCAST_REQUEST, msg_json)
-                prev_broadcast = now
-                lastBroadcastTracker.clear()
-                lastBroadcastTracker.append(now)
-                logging.debug(lastBroadcastTracker)
-                logging.info(f'[{self}] sent network broadcast')
+                prev_broadcast = self.__broadcast(lastBroadcastTracker)
             if stop():
-                logging.info(f'[{self}] killing broadcast thread')
+                logging.info('[%s] killing broadcast thread', self)
                 break
             # update once every second to have mercy on the CPU
             time.sleep(1)
 
     def __disconnect_from_broker(self):
-        self.__client.loop_stop()
+        if self.__broadcast_task is None:
+            self.__client.loop_stop()
         self.__client.disconnect()
-        logging.info(
-            f'[{self}] disconnected from broker: {BROKER}')
+        logging.info('[%s] disconnected from broker: %s', self, BROKER)
 
     def getAvailableTerminals(self):
-        return self.__available_terminals[:]
+        return self.__registry.getAvailable()
 
     def getLastBroadcastTime(self):
         return self.__time_of_last_broadcast[0]
 
-    def run(self):
-        self.__connect_to_broker()
-        self.__broadcast_sender.start()
+    def run(self, loop=None):
+        """
+        loop: asyncio event loop to run on (asyncio mode), None - network and broadcast threads
+        """
+        self.__connect_to_broker(loop)
+        if loop is None:
+            self.__broadcast_sender.start()
+        else:
+            self.__broadcast_task = loop.create_task(self.__broadcast_async())
 
     def stop(self):
         self.__disconnect_from_broker()
-        self.__stop_broadcast = True
-        self.__broadcast_sender.join()
+        if self.__broadcast_task is not None:
+            self.__broadcast_task.cancel()
+            logging.info('[%s] killing broadcast task', self)
+        else:
+            self.__stop_broadcast = True
+            self.__broadcast_sender.join()
 
 
 class Server:
-    def __init__(self, dataBase=data.EmployeesDataBase()):
-        # The white-list of terminals (terminal IDs)
-        self.__terminals_whitelist = []
+    def __init__(self, dataBase=None, clientFactory=mqtt.Client):
+        """
+        dataBase: database, concurrent.futures.Future of database being loaded in background
+        (messages are queued until it is ready) or None (EmployeesDataBase in DATA_DIR is created)\n
+        clientFactory: callable(**paho client options) -> paho client (e.g. client of in-process fake broker)
+        """
+        if STATIC_TERMINAL_ASSIGNMENT and len(SERVER_TERMINALS) == 0:
+            raise ValueError('STATIC_TERMINAL_ASSIGNMENT requires terminals of this instance in SERVER_TERMINALS')
+        if dataBase is None:
+            import src.data as data
+            dataBase = data.EmployeesDataBase()
+        # The white-list, indexes, presence and counters of terminals
+        self.__registry = TerminalRegistry(owned=SERVER_TERMINALS if STATIC_TERMINAL_ASSIGNMENT else None)
         # The employees database
         self.__database = dataBase
-        # The MQTT client.
-        self.__server_client = mqtt.Client()
+        # The MQTT client - persistent session, so records published while the server is disconnected
+        # are queued by the broker (QoS 1) instead of being lost
+        self.__server_client = clientFactory(client_id=SERVER_ID + __RECORDS_CLIENT_SUFFIX__, clean_session=False)
         # The network scanner
-        self.__networkScanner = NetworkScanner()
+        self.__networkScanner = NetworkScanner(self.__registry, clientFactory)
+        # Messages are applied to the database in batches by the pipeline worker
+        self.__pipeline = IngestPipeline(self.__database, self.__registry, self.__on_entries_applied,
+                                         batchSize=INGEST_BATCH_SIZE, linger=INGEST_LINGER,
+                                         duplicateWindow=DUPLICATE_WINDOW, duplicateCapacity=DUPLICATE_CAPACITY,
+                                         scanLogRate=LOG_SCAN_RATE_LIMIT)
+        self.__register_metrics()
+        # set once the first batch of entries was applied (time-to-first-ingest)
+        self.__first_ingest = threading.Event()
 
         self.dataModified = False
 
+    def __register_metrics(self):
+        METRICS.register('rfid_server_ingest_queue_depth', 'gauge',
+                         'Messages waiting for the ingestion worker',
+                         lambda: [({}, self.__pipeline.getQueueDepth())])
+        METRICS.register('rfid_server_ingest_messages_total', 'counter',
+                         'Messages processed by the ingestion worker',
+                         lambda: [({}, self.__pipeline.getLatencyStats()['messages'])])
+        for (counter, description) in (('scans', 'Scans applied'), ('errors', 'Invalid records'),
+                                       ('duplicates', 'Duplicate records suppressed')):
+            METRICS.register(f'rfid_server_terminal_{counter}_total', 'counter', f'{description} per terminal',
+                             lambda counter=counter: [({'terminal': terminal_id}, stats[counter]) for
+                                                      (terminal_id, stats) in self.__registry.getAllStats().items()])
+
     def __load_whitelist(self):
         if not os.path.exists(__WHITELIST_PATH__):
-            self.__terminals_whitelist = []
+            self.__registry.load([], {})
             return
 
         with open(__WHITELIST_PATH__, 'r') as wlFile:
             logging.info(
                 f'--- loading terminal-IDs from "{__WHITELIST_PATH__}" ---')
-            self.__terminals_whitelist = json.load(wlFile)
-            for terminal_id in self.__terminals_whitelist:
+            whitelist = json.load(wlFile)
+            for terminal_id in whitelist:
                 logging.info(
                     f'added terminal with id={terminal_id} to terminal-whitelist')
             logging.info(
                 '--- finished loading terminal-IDs from whitelist file ---')
 
+        indexes = {}
+        if os.path.exists(__TERMINAL_INDEXES_PATH__):
+            with open(__TERMINAL_INDEXES_PATH__, 'r') as indexesFile:
+                indexes = json.load(indexesFile)
+        self.__registry.load(whitelist, indexes)
+
     def save_whitelist(self):
         with open(__WHITELIST_PATH__, 'w') as wlFile:
-            json.dump(self.__terminals_whitelist, wlFile, indent=4)
+            json.dump(self.__registry.getWhitelist(), wlFile, indent=4)
             logging.info('saved terminals whitelist')
+        with open(__TERMINAL_INDEXES_PATH__, 'w') as indexesFile:
+            json.dump(self.__registry.getIndexes(), indexesFile, indent=4)
 
     def __process_message(self, client, userdata, msg):
-        msg_json = json.loads(msg.payload)
-
-        if msg.topic == TERMINAL_DEBUG:
-            logging.info(
-                f'(Terminal-id: {msg_json[JSON_TERMINAL_ID]}) {msg_json[JSON_TEXT]}')
-
-        elif msg.topic == RFID_RECORD and msg_json[JSON_TERMINAL_ID] in self.__terminals_whitelist:
-            (day, month, year, hour,
-             minute) = [int(item) for item in msg_json[JSON_RFID_DATE].split('.')]
-            terminal_id = msg_json[JSON_TERMINAL_ID]
-            rfid_uid = msg_json[JSON_RFID_UID]
-
-            logging.info(
-                f'(Terminal-id: {terminal_id}) RFID scanned: {rfid_uid}')
-
-            try:
-                self.__database.addEntry(rfid_uid, rfid_terminal=terminal_id,
-                                         date=date(year, month, day, hour, minute))
-                logging.info(
-                    f'added entry for employee named {self.__database.getEmpName(rfid_uid)} (rfid_uid={rfid_uid})')
-            except data.NoSuchEmployeeError:
-                logging.warning(
-                    f'No such employee with rfid_uid={rfid_uid} in database')
-                self.__database.addEmployee(rfid_uid)
-                logging.info(
-                    f'added anonymous employee with rfid-uid={rfid_uid} to database')
-                self.__database.addEntry(rfid_uid, rfid_terminal=terminal_id,
-                                         date=date(year, month, day, hour, minute))
-                logging.info(
-                    f'added entry for employee named {self.__database.getEmpName(rfid_uid)} (rfid_uid={rfid_uid})')
-            except:
-                logging.exception('unknown exception')
-            self.dataModified = True
-
-    def __connect_to_broker(self):
+        # runs on the network thread - everything else is done by the pipeline worker
+        self.__pipeline.put(msg.topic, msg.payload)
+
+    def __on_entries_applied(self):
+        self.dataModified = True
+        if not self.__first_ingest.is_set():
+            self.__first_ingest.set()
+
+    def waitForFirstIngest(self, timeout=None):
+        """
+        Returns:\n
+        \tTrue once the first entries were applied to the database, False on timeout
+        """
+        return self.__first_ingest.wait(timeout)
+
+    def __connect_to_broker(self, loop=None):
         if TLS_ENABLED:
             if TLS_CERT_FILE == "":
                 logging.error("No path to cert file in config file")
@@ -190,28 +435,47 @@ class Server:
                 self.__server_client.username_pw_set(
                     username=TLS_USERNAME, password=TLS_PASSWORD)
 
+        if loop is not None:
+            from src.aioserver import AsyncioMqttLoop
+            AsyncioMqttLoop(loop, self.__server_client)
+
         if PORT == 0:
             self.__server_client.connect(BROKER)
         else:
             self.__server_client.connect(BROKER, port=PORT)
 
         self.__server_client.on_message = self.__process_message
-        self.__server_client.loop_start()
-        self.__server_client.subscribe([(RFID_RECORD, 0), (TERMINAL_DEBUG, 0)])
-        logging.info(f'connected to broker: {BROKER}')
+        if loop is None:
+            self.__server_client.loop_start()
+        self.__server_client.subscribe(self.__topics())
+        logging.info('connected to broker: %s', BROKER)
+
+    def __topics(self):
+        """
+        Returns:\n
+        \tlist of tuple(topic filter, qos) the server consumes (records at QoS 1 - acknowledged once queued
+        \tby the pipeline) - if STATIC_TERMINAL_ASSIGNMENT only topics of terminals
+        \tassigned to this instance (SERVER_TERMINALS), so records of a terminal always reach the same
+        \tinstance and its database (legacy rfid/record is filtered by IngestPipeline)
+        """
+        if STATIC_TERMINAL_ASSIGNMENT:
+            records = [RFID_RECORD_PREFIX + terminal_id for terminal_id in SERVER_TERMINALS] + [RFID_RECORD]
+        else:
+            records = [RFID_RECORD_PREFIX + '+', RFID_RECORD]
+        return [(topic, 1) for topic in records] + [(TERMINAL_DEBUG, 0)]
 
     def __disconnect_from_broker(self):
+        # fails harmlessly in asyncio mode (no network thread)
         self.__server_client.loop_stop()
         self.__server_client.disconnect()
-        logging.info(f'disconnected from broker: {BROKER}')
+        logging.info('disconnected from broker: %s', BROKER)
 
     def addTerminal(self, terminal_id):
-        if terminal_id in self.__terminals_whitelist:
+        if not self.__registry.add(terminal_id):
             logging.error(
                 f'addTerminal - terminal with id={terminal_id} is already listed in whitelist')
             return False
         else:
-            self.__terminals_whitelist.append(terminal_id)
             logging.info(
                 f'addTerminal - terminal with id={terminal_id} added to whitelist')
 
@@ -219,12 +483,11 @@ class Server:
         return True
 
     def removeTerminal(self, terminal_id):
-        if not terminal_id in self.__terminals_whitelist:
+        if not self.__registry.remove(terminal_id):
             logging.error(
                 f'removeTerminal - no terminal with id={terminal_id} in whitelist')
             return False
         else:
-            self.__terminals_whitelist.remove(terminal_id)
             logging.info(
                 f'removeTerminal - terminal with id={terminal_id} removed from whitelist')
         return True
@@ -236,15 +499,64 @@ class Server:
         return self.__networkScanner.getLastBroadcastTime()
 
     def getWhitelist(self):
-        return self.__terminals_whitelist[:]
-
-    def run(self):
-        self.__connect_to_broker()
+        return self.__registry.getWhitelist()
+
+    def isTerminalAvailable(self, terminal_id):
+        return self.__registry.isAvailable(terminal_id)
+
+    def getTerminalStats(self, terminal_id):
+        """
+        Returns:\n
+        \tdict (last_seen, scans, last_scan, errors, duplicates) - see TerminalRegistry.getStats
+        """
+        return self.__registry.getStats(terminal_id)
+
+    def getIngestStats(self):
+        """
+        Returns:\n
+        \tdict (messages, batches, latency percentiles) - see IngestPipeline.getLatencyStats
+        """
+        return self.__pipeline.getLatencyStats()
+
+    def formatIngestStats(self):
+        return self.__pipeline.formatLatencyStats()
+
+    def setIngestProfiler(self, profile):
+        """
+        profile: cProfile.Profile of batches applied by the ingestion worker, None - stop profiling
+        (see IngestPipeline.setProfiler)
+        """
+        self.__pipeline.setProfiler(profile)
+
+    def run(self, loop=None, executor=None):
+        """
+        loop: asyncio event loop to run on (asyncio mode, see aioserver.AsyncServer),
+        None - threaded mode (MQTT network threads, broadcast thread, ingestion worker)\n
+        executor: executor for blocking database work in asyncio mode (default of the loop if None)
+        """
         self.__load_whitelist()
-        self.__networkScanner.run()
+        if loop is None:
+            self.__pipeline.start()
+        else:
+            self.__pipeline.startAsync(loop, executor)
+        self.__connect_to_broker(loop)
+        self.__networkScanner.run(loop)
 
     def stop(self):
         self.__disconnect_from_broker()
+        # apply messages received before disconnecting
+        self.__pipeline.stop()
+        self.__networkScanner.stop()
+        if self.dataModified:
+            self.save_whitelist()
+
+    async def stopAsync(self):
+        """
+        asyncio mode - has to be awaited on the event loop the server runs on
+        """
+        self.__disconnect_from_broker()
+        # apply messages received before disconnecting
+        await self.__pipeline.stopAsync()
         self.__networkScanner.stop()
         if self.dataModified:
             self.save_whitelist()
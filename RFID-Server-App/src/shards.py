@@ -0,0 +1,447 @@
+#!/usr/bin/env python3
+import atexit
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import signal
+import threading
+import time
+import src.data as data
+from src.constants import DATA_DIR, SHARD_LAYOUT_FILE
+from src.metrics import METRICS
+from src.storage import RETENTION_POLICIES
+
+# shards are migrated into directory with this suffix, renamed when complete
+__MIGRATION_SUFFIX__ = '.migrating'
+# methods of EmployeesDataBase a shard worker executes
+__SHARD_METHODS__ = frozenset((
+    'save', 'checkpoint', 'getSaveStats', 'close', 'addEntry', 'addEntries', 'addEmployee',
+    'deleteEmployee', 'modifyEmpName', 'modifyEmpRFID', 'getEmployeesDataSummary', 'getEmpName',
+    'getEmployeeData', 'generateReport', 'getWorkTime', 'generateReports'))
+# stages inside shard processes aren't visible to the server, batches are timed including the round trip
+__ADD_ENTRIES_STAGE__ = METRICS.stage('add_entries')
+# workers are forked - spawning would re-import the main module and src modules (and rotate the log);
+# forked from a process with running threads - logging and metrics locks are reset in the child
+# (see logger._log_directly_in_child and MetricsRegistry._after_fork)
+__MP_CONTEXT__ = multiprocessing.get_context(
+    'fork' if 'fork' in multiprocessing.get_all_start_methods() else None)
+
+
+def shardsDir(dataDir, shards):
+    return os.path.join(dataDir, f'shards-{shards}')
+
+
+def shardDir(dataDir, shards, shard):
+    return os.path.join(shardsDir(dataDir, shards), str(shard))
+
+
+def _shard_worker(connection, inherited, backend, dataDir, retentionMonths, retentionPolicy):
+    """
+    process of one shard - executes requests (method, args, kwargs) received from ShardedDataBase
+    on its own EmployeesDataBase, replies tuple(bool ok, result or exception)\n
+    inherited: main process ends of pipes of other shards (closed, so those shards see EOF)
+    """
+    # Ctrl+C is handled by the main process, which closes the shards
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for other in inherited:
+        other.close()
+    try:
+        database = data.EmployeesDataBase(backend, dataDir, retentionMonths, retentionPolicy)
+    except Exception as error:
+        connection.send((False, error))
+        return
+    connection.send((True, None))
+
+    while True:
+        try:
+            (method, args, kwargs) = connection.recv()
+        except EOFError:
+            # main process is gone
+            database.close()
+            break
+        try:
+            if method not in __SHARD_METHODS__:
+                raise AttributeError(method)
+            connection.send((True, getattr(database, method)(*args, **kwargs)))
+        except Exception as error:
+            connection.send((False, error))
+        if method == 'close':
+            break
+
+
+class ShardedDataBase:
+    """
+    EmployeesDataBase split by hash of rfid-uid across worker processes - every shard
+    process owns its employees, their history and persistence files (DATA_DIR/shards-N/<shard>),
+    so batches of entries are applied on several cores at once.\n
+    Same interface as EmployeesDataBase: calls for one employee are routed to its shard,
+    the rest (summary, reports of all employees, saves) fan out and results are merged.\n
+    Database of a different layout (unsharded, other number of shards) is migrated on first start,
+    the old files are then no longer used (unsharded database refuses to open them, see
+    data.ShardedDataBaseError). Migration is written to a separate directory and takes effect only
+    when complete (layout file is written last), interrupted migration is redone on next start.\n
+    Unlike EmployeesDataBase, batch of entries spanning several shards isn't applied atomically
+    and emp-uids are unique only within a shard.
+    """
+
+    def __init__(self, shards, backend='pickle', dataDir=DATA_DIR,
+                 retentionMonths=0, retentionPolicy=RETENTION_POLICIES[0]):
+        """
+        shards: number of worker processes\n
+        backend, retentionMonths, retentionPolicy: see EmployeesDataBase
+        Throws exceptions:\n
+        \tdata.InvalidInputDataError
+        """
+        if shards < 1:
+            raise data.InvalidInputDataError
+
+        self.__shards = shards
+        self.__data_dir = dataDir
+        self.__backend = backend
+        self.__retention = (retentionMonths, retentionPolicy)
+        self.__connections = []
+        self.__processes = []
+        # one request at a time per shard (pipe is shared by menu, pipeline and autosave threads)
+        self.__locks = [threading.Lock() for _ in range(shards)]
+        # calls for rfid-uids being moved between shards wait (see modifyEmpRFID)
+        self.__routing = threading.Condition()
+        self.__moving = set()
+        # frozensets of rfid-uids of calls in flight
+        self.__in_flight = []
+        self.__closed = True
+
+        root = shardsDir(dataDir, shards)
+        if self.__read_layout() != shards:
+            self.__migrate(root)
+        self.__start_workers(root)
+
+    def __str__(self):
+        return self.__class__.__name__
+
+    def shardOf(self, rfid_uid):
+        """
+        Returns:\n
+        \tint shard of employee (invalid rfid-uid goes to shard 0, which rejects it)
+        """
+        return hash(rfid_uid) % self.__shards if isinstance(rfid_uid, int) else 0
+
+    def __route(self, rfid_uids):
+        """
+        waits while any of rfid_uids is being moved to another shard, registers the call as in flight\n
+        Returns:\n
+        \tfrozenset of rfid-uids of the call (for __routed)
+        """
+        uids = frozenset(rfid_uid for rfid_uid in rfid_uids if isinstance(rfid_uid, int))
+        with self.__routing:
+            while not self.__moving.isdisjoint(uids):
+                self.__routing.wait()
+            self.__in_flight.append(uids)
+        return uids
+
+    def __routed(self, uids):
+        with self.__routing:
+            self.__in_flight.remove(uids)
+            if len(self.__moving) > 0:
+                self.__routing.notify_all()
+
+    def __call_employee(self, method, rfid_uid, *args):
+        """
+        calls method of the shard of the employee, args follow rfid_uid
+        """
+        uids = self.__route((rfid_uid,))
+        try:
+            return self.__call(self.shardOf(rfid_uid), method, rfid_uid, *args)
+        finally:
+            self.__routed(uids)
+
+    def __exchange(self, calls):
+        """
+        see __call_shards\n
+        Returns:\n
+        \tlist of tuple(bool ok, result or exception) (in order of calls)
+        """
+        locks = [self.__locks[shard] for shard in sorted(call[0] for call in calls)]
+        for lock in locks:
+            lock.acquire()
+        try:
+            for (shard, method, args, kwargs) in calls:
+                self.__connections[shard].send((method, args, kwargs))
+            return [self.__connections[call[0]].recv() for call in calls]
+        finally:
+            for lock in locks:
+                lock.release()
+
+    def __call_shards(self, calls):
+        """
+        calls: list of tuple(int shard, str method, tuple args, dict kwargs), at most one per shard -
+        all requests are sent before any reply is awaited, so shards work in parallel\n
+        Returns:\n
+        \tlist of results (in order of calls)
+        Throws exceptions:\n
+        \tthe first exception raised by a shard (after all replies were received)
+        """
+        replies = self.__exchange(calls)
+        for (ok, result) in replies:
+            if not ok:
+                raise result
+        return [result for (_, result) in replies]
+
+    def __call(self, shard, method, *args, **kwargs):
+        return self.__call_shards([(shard, method, args, kwargs)])[0]
+
+    def __call_all(self, method, *args, **kwargs):
+        return self.__call_shards([(shard, method, args, kwargs) for shard in range(self.__shards)])
+
+    def __start_workers(self, root):
+        (retentionMonths, retentionPolicy) = self.__retention
+        self.__connections = []
+        self.__processes = []
+        for shard in range(self.__shards):
+            (connection, childConnection) = __MP_CONTEXT__.Pipe()
+            process = __MP_CONTEXT__.Process(
+                target=_shard_worker, name=f'database-shard-{shard}',
+                args=(childConnection, list(self.__connections), self.__backend,
+                      os.path.join(root, str(shard)), retentionMonths, retentionPolicy))
+            process.start()
+            childConnection.close()
+            self.__connections.append(connection)
+            self.__processes.append(process)
+        self.__closed = False
+        # non-daemonic workers would keep the interpreter from exiting
+        atexit.register(self.close)
+
+        for connection in self.__connections:
+            (ok, error) = connection.recv()
+            if not ok:
+                self.close()
+                raise error
+
+    def __read_layout(self):
+        """
+        Returns:\n
+        \tint number of shards the database directory is split into, None - unsharded
+        """
+        layoutPath = os.path.join(self.__data_dir, SHARD_LAYOUT_FILE)
+        if not os.path.exists(layoutPath):
+            return None
+        with open(layoutPath, 'r') as layoutFile:
+            return json.load(layoutFile)['shards']
+
+    def __migrate(self, root):
+        """
+        imports the database of the current layout into shards in root\n
+        sources stay untouched until the layout file is replaced, so an interrupted migration
+        starts over (from empty shards) on next start
+        """
+        previous = self.__read_layout()
+        if previous is None:
+            sources = [self.__data_dir]
+        else:
+            sources = [shardDir(self.__data_dir, previous, shard) for shard in range(previous)]
+
+        migrationRoot = root + __MIGRATION_SUFFIX__
+        # left by interrupted migration
+        shutil.rmtree(migrationRoot, ignore_errors=True)
+        self.__start_workers(migrationRoot)
+        try:
+            (retentionMonths, retentionPolicy) = self.__retention
+            for source in sources:
+                if not os.path.isdir(source):
+                    continue
+                database = data.EmployeesDataBase(self.__backend, source, retentionMonths, retentionPolicy)
+                summary = database.getEmployeesDataSummary(includeHistory=True)
+                database.close()
+                if len(summary) == 0:
+                    continue
+
+                logging.info('[%s] migrating %d employees from "%s" to %d shards',
+                             self, len(summary), source, self.__shards)
+                for (emp_uid, name, rfid_uid, history) in summary:
+                    self.__import_employee(rfid_uid, emp_uid, name, history)
+            self.checkpoint()
+        finally:
+            self.close()
+
+        # shards of this size left from an earlier period are out of date
+        shutil.rmtree(root, ignore_errors=True)
+        os.rename(migrationRoot, root)
+        layoutPath = os.path.join(self.__data_dir, SHARD_LAYOUT_FILE)
+        with open(layoutPath + __MIGRATION_SUFFIX__, 'w') as layoutFile:
+            json.dump({'shards': self.__shards}, layoutFile, indent=4)
+        os.replace(layoutPath + __MIGRATION_SUFFIX__, layoutPath)
+        for source in sources:
+            logging.warning('[%s] database in "%s" was migrated and is no longer used', self, source)
+
+    def __import_employee(self, rfid_uid, emp_uid, name, history):
+        """
+        history: list of history entries (day, month, year, hour, minute, terminal)
+        """
+        shard = self.shardOf(rfid_uid)
+        try:
+            self.__call(shard, 'addEmployee', rfid_uid, emp_uid, name)
+        except data.EmployeeRecordAlreadyExistsError:
+            # emp-uid taken by employee of another source shard
+            self.__call(shard, 'addEmployee', rfid_uid, "", name)
+        if len(history) > 0:
+            self.__call(shard, 'addEntries',
+                        [(rfid_uid, terminal, datetime.datetime(year, month, day, hour, minute))
+                         for (day, month, year, hour, minute, terminal) in history])
+
+    def save(self):
+        self.__call_all('save')
+
+    def checkpoint(self):
+        self.__call_all('checkpoint')
+
+    def getSaveStats(self):
+        """
+        Returns:\n
+        \tdict (saves - total, last/max_lock_hold, last/max_save_duration - worst shard)
+        """
+        merged = {}
+        for stats in self.__call_all('getSaveStats'):
+            for (key, value) in stats.items():
+                merged[key] = value + merged.get(key, 0) if key == 'saves' else max(value, merged.get(key, 0.0))
+        return merged
+
+    def close(self):
+        if self.__closed:
+            return
+        self.__closed = True
+        atexit.unregister(self.close)
+        for (connection, process) in zip(self.__connections, self.__processes):
+            try:
+                connection.send(('close', (), {}))
+                connection.recv()
+            except (EOFError, OSError):
+                pass
+            connection.close()
+            process.join()
+
+    def addEntry(self, rfid_uid, rfid_terminal='terminal', date=datetime.datetime.now()):
+        self.__call_employee('addEntry', rfid_uid, rfid_terminal, date)
+
+    def addEntries(self, batch, addUnknownEmployees=False):
+        """
+        batch is split by shard, sub-batches are applied in parallel - see EmployeesDataBase.addEntries\n
+        Throws exceptions:\n
+        \tdata.BatchPartiallyAppliedError - some of the sub-batches were applied
+        """
+        start = time.perf_counter()
+        subBatches = {}
+        for entry in batch:
+            subBatches.setdefault(self.shardOf(entry[0]), []).append(entry)
+        uids = self.__route(entry[0] for entry in batch)
+        try:
+            replies = self.__exchange([(shard, 'addEntries', (subBatch, addUnknownEmployees), {})
+                                       for (shard, subBatch) in subBatches.items()])
+        finally:
+            self.__routed(uids)
+        __ADD_ENTRIES_STAGE__.observe(time.perf_counter() - start)
+
+        addedEmployees = [rfid_uid for (ok, result) in replies if ok for rfid_uid in result]
+        failed = [(subBatch, result) for (subBatch, (ok, result)) in zip(subBatches.values(), replies) if not ok]
+        if len(failed) == len(replies):
+            raise failed[0][1]
+        if len(failed) > 0:
+            raise data.BatchPartiallyAppliedError([entry for (subBatch, _) in failed for entry in subBatch],
+                                                  addedEmployees, failed[0][1])
+        return addedEmployees
+
+    def addEmployee(self, rfid_uid, emp_uid="", name=""):
+        self.__call_employee('addEmployee', rfid_uid, emp_uid, name)
+
+    def deleteEmployee(self, rfid_uid, delHistory=True):
+        self.__call_employee('deleteEmployee', rfid_uid, delHistory)
+
+    def modifyEmpName(self, rfid_uid, newName):
+        self.__call_employee('modifyEmpName', rfid_uid, newName)
+
+    def modifyEmpRFID(self, rfid_uid, new_rfid_uid):
+        """
+        employee (with history) is moved to shard of the new rfid-uid if it differs -
+        calls for both rfid-uids wait until the move is complete, failed import is rolled back
+        """
+        (shard, newShard) = (self.shardOf(rfid_uid), self.shardOf(new_rfid_uid))
+        if shard == newShard or not isinstance(rfid_uid, int) or not isinstance(new_rfid_uid, int):
+            self.__call_employee('modifyEmpRFID', rfid_uid, new_rfid_uid)
+            return
+
+        moved = frozenset((rfid_uid, new_rfid_uid))
+        with self.__routing:
+            while not self.__moving.isdisjoint(moved):
+                self.__routing.wait()
+            self.__moving.update(moved)
+            # calls routed before the move started are let finish
+            while any(not moved.isdisjoint(uids) for uids in self.__in_flight):
+                self.__routing.wait()
+        try:
+            self.__move_employee(rfid_uid, new_rfid_uid)
+        finally:
+            with self.__routing:
+                self.__moving.difference_update(moved)
+                self.__routing.notify_all()
+
+    def __move_employee(self, rfid_uid, new_rfid_uid):
+        (shard, newShard) = (self.shardOf(rfid_uid), self.shardOf(new_rfid_uid))
+        try:
+            self.__call(newShard, 'getEmpName', new_rfid_uid)
+            raise data.RfidAlreadyUsedError
+        except data.NoSuchEmployeeError:
+            pass
+        # raises NoSuchEmployeeError before anything is changed
+        (emp_uid, name, _, history) = self.__call(shard, 'getEmployeeData', rfid_uid)
+
+        try:
+            self.__import_employee(new_rfid_uid, emp_uid, name, history)
+        except Exception:
+            try:
+                self.__call(newShard, 'deleteEmployee', new_rfid_uid)
+            except data.NoSuchEmployeeError:
+                pass
+            raise
+        self.__call(shard, 'deleteEmployee', rfid_uid)
+
+    def getEmployeesDataSummary(self, includeHistory=True):
+        """
+        see EmployeesDataBase.getEmployeesDataSummary (employees are ordered by shard)
+        """
+        return [employee for summary in self.__call_all('getEmployeesDataSummary', includeHistory)
+                for employee in summary]
+
+    def getEmpName(self, rfid_uid):
+        return self.__call_employee('getEmpName', rfid_uid)
+
+    def getEmployeeData(self, rfid_uid):
+        return self.__call_employee('getEmployeeData', rfid_uid)
+
+    def generateReport(self, rfid_uid, start=None, end=None):
+        return self.__call_employee('generateReport', rfid_uid, start, end)
+
+    def getWorkTime(self, rfid_uid, start=None, end=None):
+        return self.__call_employee('getWorkTime', rfid_uid, start, end)
+
+    def generateReports(self, rfid_uids=None, start=None, end=None, workers=None):
+        """
+        every shard generates reports of its employees (CPUs are split between shards),
+        see EmployeesDataBase.generateReports
+        """
+        if workers is None:
+            workers = max(1, (os.cpu_count() or 1) // self.__shards)
+        if rfid_uids is None:
+            calls = [(shard, 'generateReports', (None, start, end, workers), {})
+                     for shard in range(self.__shards)]
+        else:
+            groups = {}
+            for rfid_uid in rfid_uids:
+                groups.setdefault(self.shardOf(rfid_uid), []).append(rfid_uid)
+            calls = [(shard, 'generateReports', (group, start, end, workers), {})
+                     for (shard, group) in groups.items()]
+        uids = self.__route(() if rfid_uids is None else rfid_uids)
+        try:
+            return [report for manifest in self.__call_shards(calls) for report in manifest]
+        finally:
+            self.__routed(uids)
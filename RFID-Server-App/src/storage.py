@@ -0,0 +1,1424 @@
+#!/usr/bin/env python3
+import datetime
+import mmap
+import os
+import pickle
+import shutil
+import sqlite3
+import time
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from itertools import groupby
+from src.constants import DATA_DIR
+
+# pickle backend files
+__SNAPSHOT_FILE__ = "database.pkl"
+__JOURNAL_FILE__ = "database.journal"
+# journal of previous generation - kept until snapshot of current generation is on disk
+__OLD_JOURNAL_FILE__ = "database.journal.old"
+# history segments of snapshot (suffixed with generation), memory-mapped on load
+__SEGMENTS_FILE__ = "history.seg"
+# directory of monthly history partitions (file per month and generation)
+__PARTITIONS_DIR__ = "partitions"
+# directory partitions are moved to when they are past retention period
+__ARCHIVE_DIR__ = "archive"
+__PARTITION_EXTENSION__ = ".part"
+# suffix of snapshot being written (atomically renamed when complete)
+__TEMP_SUFFIX__ = ".tmp"
+# sqlite backend file
+__SQLITE_FILE__ = "database.sqlite"
+# sqlite database history past retention period is moved to
+__SQLITE_ARCHIVE_FILE__ = "history.sqlite"
+# suffix given to pickle files after they were migrated to sqlite
+__MIGRATED_SUFFIX__ = ".migrated"
+
+# checkpoint (fold journal into snapshot) once journal grows past this size
+__CHECKPOINT_JOURNAL_SIZE__ = 16 * 1024 * 1024  # in bytes
+# ... or once this much time has passed since the last checkpoint
+__CHECKPOINT_INTERVAL__ = 60 * 60  # in seconds
+
+# number of decoded partitions kept in memory (least recently used are dropped)
+__PARTITION_CACHE_SIZE__ = 12
+# zlib compression level of partitions
+__PARTITION_COMPRESSION_LEVEL__ = 6
+
+# what happens to partitions past retention period (config: HISTORY_RETENTION_POLICY)
+RETENTION_POLICIES = ('archive', 'drop')
+
+# number of entries buffered before they are inserted into sqlite in one batch
+__SQLITE_BATCH_SIZE__ = 512
+
+# journal record types
+__JOURNAL_HEADER__ = 0
+__JOURNAL_ADD_ENTRY__ = 1
+__JOURNAL_ADD_EMPLOYEE__ = 2
+__JOURNAL_MODIFY_NAME__ = 3
+__JOURNAL_MODIFY_RFID__ = 4
+__JOURNAL_DELETE_EMPLOYEE__ = 5
+
+__EPOCH__ = datetime.datetime(1970, 1, 1)
+__MINUTE__ = datetime.timedelta(minutes=1)
+
+
+def entryToMinutes(entry):
+    """
+    Returns:\n
+    \tint minutes since epoch of history entry (day, month, year, hour, minute, terminal)
+    """
+    (day, month, year, hour, minute, terminal) = entry
+    return (datetime.datetime(year, month, day, hour, minute) - __EPOCH__) // __MINUTE__
+
+
+def dateToMinutes(date):
+    """
+    Returns:\n
+    \tint minutes since epoch of datetime (seconds are truncated)
+    """
+    return (date - __EPOCH__) // __MINUTE__
+
+
+def minutesToDate(minutes):
+    """
+    Returns:\n
+    \tdatetime of minutes since epoch
+    """
+    return __EPOCH__ + datetime.timedelta(minutes=minutes)
+
+
+def minutesToMonth(minutes):
+    """
+    Returns:\n
+    \tint months since epoch of minutes since epoch
+    """
+    date = minutesToDate(minutes)
+    return (date.year - __EPOCH__.year) * 12 + date.month - 1
+
+
+def monthToMinutes(month):
+    """
+    Returns:\n
+    \tint minutes since epoch of the beginning of month (months since epoch)
+    """
+    return dateToMinutes(datetime.datetime(__EPOCH__.year + month // 12, month % 12 + 1, 1))
+
+
+def monthName(month):
+    """
+    Returns:\n
+    \tstr YYYY-MM of month (months since epoch)
+    """
+    return f"{__EPOCH__.year + month // 12:04d}-{month % 12 + 1:02d}"
+
+
+def minutesToEntry(minutes, terminal):
+    """
+    Returns:\n
+    \ttuple history entry (day, month, year, hour, minute, terminal)
+    """
+    date = minutesToDate(minutes)
+    return (date.day, date.month, date.year, date.hour, date.minute, terminal)
+
+
+class History:
+    """
+    History of one employee kept as typed columns: minutes since epoch (array('q'))
+    and index of the terminal in storage's interned terminal table (array('I')).\n
+    12 bytes per entry and 16 per work session (~20 bytes per entry with two scans a session,
+    more with over-allocation of growing arrays) instead of ~140 bytes of a 6-tuple of python objects.\n
+    Entries are kept in chronological order (late entries are inserted in place).\n
+    Work sessions (entries paired as entrance, leave from the first one) are
+    maintained incrementally: completed ones in starts/ends, unpaired entrance in openSession.\n
+    Columns are either arrays or read-only memoryviews of a memory-mapped segment
+    (see fromSegment) - read-only history has to be copied before it's modified.
+    """
+    __slots__ = ('minutes', 'terminals', 'starts', 'ends', 'openSession')
+
+    def __init__(self, minutes=None, terminals=None, sessions=None):
+        """
+        sessions: tuple(starts, ends, openSession) - rebuilt from entries if None
+        """
+        self.minutes = array('q') if minutes is None else minutes
+        self.terminals = array('I') if terminals is None else terminals
+        if sessions is None:
+            self.rebuildSessions()
+        else:
+            (self.starts, self.ends, self.openSession) = sessions
+
+    @staticmethod
+    def segmentSize(count, sessionCount):
+        """
+        Returns:\n
+        \tint bytes taken by segment of history (minutes, starts, ends, terminals, padding to 8 bytes)
+        """
+        size = 8 * count + 16 * sessionCount + 4 * count
+        return size + (-size) % 8
+
+    @staticmethod
+    def fromSegment(buffer, offset, count, sessionCount, openSession):
+        """
+        Returns:\n
+        \tread-only History viewing segment of buffer (nothing is decoded or copied)
+        """
+        view = memoryview(buffer)
+        minutesEnd = offset + 8 * count
+        startsEnd = minutesEnd + 8 * sessionCount
+        endsEnd = startsEnd + 8 * sessionCount
+        return History(view[offset:minutesEnd].cast('q'),
+                       view[endsEnd:endsEnd + 4 * count].cast('I'),
+                       (view[minutesEnd:startsEnd].cast('q'), view[startsEnd:endsEnd].cast('q'), openSession))
+
+    def writeSegment(self, file):
+        """
+        writes columns in segment layout (see fromSegment)\n
+        Returns:\n
+        \tint bytes written
+        """
+        for column in (self.minutes, self.starts, self.ends, self.terminals):
+            file.write(column)
+        size = History.segmentSize(len(self.minutes), len(self.starts))
+        file.write(bytes(size - 12 * len(self.minutes) - 16 * len(self.starts)))
+        return size
+
+    def __len__(self):
+        return len(self.minutes)
+
+    def isReadOnly(self):
+        return not isinstance(self.minutes, array)
+
+    def add(self, minutes, terminalIndex):
+        if len(self.minutes) == 0 or minutes >= self.minutes[-1]:
+            self.minutes.append(minutes)
+            self.terminals.append(terminalIndex)
+
+            if self.openSession is None:
+                self.openSession = minutes
+            else:
+                self.starts.append(self.openSession)
+                self.ends.append(minutes)
+                self.openSession = None
+        else:
+            position = bisect_right(self.minutes, minutes)
+            self.minutes.insert(position, minutes)
+            self.terminals.insert(position, terminalIndex)
+            # late entry flips entrance/leave of every entry after it
+            self.rebuildSessions()
+
+    def rebuildSessions(self):
+        minutes = self.minutes
+        paired = len(minutes) - len(minutes) % 2
+        self.starts = minutes[0:paired:2]
+        self.ends = minutes[1:paired:2]
+        self.openSession = minutes[-1] if paired < len(minutes) else None
+
+    def sessions(self):
+        return (self.starts, self.ends, self.openSession)
+
+    def copy(self):
+        """
+        Returns:\n
+        \twritable History (array columns) with the same content
+        """
+        return History(_toArray('q', self.minutes), _toArray('I', self.terminals),
+                       (_toArray('q', self.starts), _toArray('q', self.ends), self.openSession))
+
+    def isSorted(self):
+        minutes = self.minutes
+        return all(minutes[index] <= minutes[index + 1] for index in range(len(minutes) - 1))
+
+    def __session_range(self, start, end):
+        first = 0 if start is None else bisect_left(self.starts, start)
+        last = len(self.starts) if end is None else bisect_left(self.starts, end)
+        return (first, max(first, last))
+
+    def workPeriods(self, start=None, end=None):
+        """
+        Completed sessions with entrance in [start, end), found with binary search - O(log n + k).\n
+        Returns:\n
+        \tlist of tuple(int entrance-minutes, int leave-minutes)
+        """
+        (first, last) = self.__session_range(start, end)
+        return list(zip(self.starts[first:last], self.ends[first:last]))
+
+    def workTime(self, start=None, end=None):
+        """
+        Returns:\n
+        \tint minutes of work in completed sessions with entrance in [start, end)
+        """
+        (first, last) = self.__session_range(start, end)
+        return sum(self.ends[first:last]) - sum(self.starts[first:last])
+
+
+def _toArray(typecode, column):
+    """
+    Returns:\n
+    \tarray copy of column (array, memoryview or other sequence of ints)
+    """
+    if isinstance(column, array) and column.typecode == typecode:
+        return column[:]
+    if isinstance(column, memoryview) and column.format == typecode:
+        copy = array(typecode)
+        copy.frombytes(column.cast('B'))
+        return copy
+    return array(typecode, column)
+
+
+def _samePrefix(history, other, count):
+    """
+    Returns:\n
+    \tbool whether the first count entries of both histories are the same
+    """
+    if len(history) < count or len(other) < count:
+        return False
+    with memoryview(history.minutes) as minutes, memoryview(other.minutes) as otherMinutes, \
+            memoryview(history.terminals) as terminals, memoryview(other.terminals) as otherTerminals:
+        return minutes[:count] == otherMinutes[:count] and terminals[:count] == otherTerminals[:count]
+
+
+class Partition:
+    """
+    Archived history of one month - for every employee whole sessions with entrance
+    in that month (history is cut only between sessions, so they never have to be re-paired).\n
+    Stored zlib-compressed in its own file, decoded only when a query overlaps the month.
+    """
+    __slots__ = ('month', 'fileName', 'counts', 'histories')
+
+    def __init__(self, month, fileName=None, counts=None, histories=None):
+        """
+        fileName: None until partition is written\n
+        counts: dict emp-uid -> int number of entries\n
+        histories: dict emp-uid -> History, None if partition is only on disk
+        """
+        self.month = month
+        self.fileName = fileName
+        self.counts = {} if counts is None else counts
+        self.histories = {} if histories is None and fileName is None else histories
+
+    @staticmethod
+    def read(path):
+        """
+        Returns:\n
+        \tdict emp-uid -> History decoded from partition file
+        """
+        with open(path, 'rb') as partitionFile:
+            columns = pickle.loads(zlib.decompress(partitionFile.read()))
+        histories = {}
+        for (emp_uid, (minutesBytes, terminalsBytes)) in columns.items():
+            (minutes, terminals) = (array('q'), array('I'))
+            minutes.frombytes(minutesBytes)
+            terminals.frombytes(terminalsBytes)
+            histories[emp_uid] = History(minutes, terminals)
+        return histories
+
+    @staticmethod
+    def write(path, histories):
+        columns = {emp_uid: (history.minutes.tobytes(), history.terminals.tobytes())
+                   for (emp_uid, history) in histories.items()}
+        with open(path, 'wb') as partitionFile:
+            partitionFile.write(zlib.compress(
+                pickle.dumps(columns, pickle.HIGHEST_PROTOCOL), __PARTITION_COMPRESSION_LEVEL__))
+            partitionFile.flush()
+            os.fsync(partitionFile.fileno())
+
+
+class Storage:
+    """
+    Base class of EmployeesDataBase storage engines.\n
+    Every engine keeps employee indexes (emp_name_dict, rfid_emp_dict, emp_rfid_dict)
+    in memory, the way history is kept and persisted is engine specific.\n
+    Engines are not thread-safe - EmployeesDataBase serializes access to them.
+    """
+
+    def __init__(self, dataDir=DATA_DIR):
+        self.dataDir = dataDir
+        self.emp_name_dict = {}
+        self.rfid_emp_dict = {}
+        self.emp_rfid_dict = {}
+
+        if not os.path.exists(dataDir):
+            os.makedirs(dataDir)
+
+    def __str__(self):
+        return self.__class__.__name__
+
+    def _addEmployee(self, emp_uid, rfid_uid, name):
+        self.emp_name_dict[emp_uid] = name
+        self.rfid_emp_dict[rfid_uid] = emp_uid
+        self.emp_rfid_dict[emp_uid] = rfid_uid
+
+    def _modifyEmpName(self, emp_uid, newName):
+        self.emp_name_dict[emp_uid] = newName
+
+    def _modifyEmpRFID(self, emp_uid, new_rfid_uid):
+        del self.rfid_emp_dict[self.emp_rfid_dict[emp_uid]]
+        self.rfid_emp_dict[new_rfid_uid] = emp_uid
+        self.emp_rfid_dict[emp_uid] = new_rfid_uid
+
+    def _deleteEmployee(self, emp_uid):
+        del self.rfid_emp_dict[self.emp_rfid_dict[emp_uid]]
+        del self.emp_rfid_dict[emp_uid]
+        del self.emp_name_dict[emp_uid]
+
+    def load(self):
+        raise NotImplementedError
+
+    def addEntries(self, entries):
+        """
+        entries: list of tuple(str emp-uid, int minutes-since-epoch, str terminal)
+        """
+        raise NotImplementedError
+
+    def addEmployee(self, emp_uid, rfid_uid, name):
+        raise NotImplementedError
+
+    def modifyEmpName(self, emp_uid, newName):
+        raise NotImplementedError
+
+    def modifyEmpRFID(self, emp_uid, new_rfid_uid):
+        raise NotImplementedError
+
+    def deleteEmployee(self, emp_uid):
+        raise NotImplementedError
+
+    def getHistory(self, emp_uid):
+        """
+        Returns:\n
+        \tlist of history entries (day, month, year, hour, minute, terminal)
+        """
+        raise NotImplementedError
+
+    def getHistories(self):
+        """
+        Returns:\n
+        \tdict emp-uid -> list of history entries
+        """
+        raise NotImplementedError
+
+    def getHistoryColumns(self, emp_uid):
+        """
+        Returns:\n
+        \ttuple(sequence of int minutes-since-epoch, sequence of str terminal)
+        """
+        raise NotImplementedError
+
+    def getWorkPeriods(self, emp_uid, start=None, end=None):
+        """
+        start, end: int minutes-since-epoch or None (unbounded)\n
+        Returns:\n
+        \tlist of tuple(int entrance-minutes, int leave-minutes) with entrance in [start, end)
+        """
+        raise NotImplementedError
+
+    def getWorkTime(self, emp_uid, start=None, end=None):
+        """
+        Returns:\n
+        \tint minutes of work in periods with entrance in [start, end)
+        """
+        return sum(leave - entrance for (entrance, leave) in self.getWorkPeriods(emp_uid, start, end))
+
+    def historyLength(self, emp_uid):
+        raise NotImplementedError
+
+    def beginSave(self, checkpoint=False):
+        """
+        Called with database locked - does only the cheap part of saving
+        (e.g. flushing buffers, taking snapshot of the state).\n
+        checkpoint: compact storage (e.g. fold journal into snapshot) even if it's not due yet\n
+        Returns:\n
+        \tcallable doing the slow part of saving (fsync, serialization), safe to call without the lock
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class PickleStorage(Storage):
+    """
+    Whole database persisted as pickle snapshot + append-only journal.\n
+    Snapshot consists of an index (employees, terminals, directory of history segments),
+    loaded eagerly, and a file of history segments, which is memory-mapped - history
+    of an employee is mapped only when it is accessed and copied only when it's modified.\n
+    Only history of the current month is hot - on checkpoint, sessions of past months
+    are compacted into monthly partitions, which are kept for retentionMonths
+    (0 - forever) and then archived or dropped (retentionPolicy).
+    """
+
+    def __init__(self, dataDir=DATA_DIR, retentionMonths=0, retentionPolicy='archive'):
+        super().__init__(dataDir)
+        # emp-uid -> History (or None if its segment hasn't been mapped yet)
+        self.__emp_hist_dict = {}
+        # emp-uid -> tuple(offset, count, session-count, open-session) in segments file
+        self.__segments = {}
+        self.__segments_map = None
+        # interned terminal table (History.terminals are indexes into it)
+        self.__terminals = []
+        self.__terminal_index = {}
+        self.__snapshot_path = os.path.join(dataDir, __SNAPSHOT_FILE__)
+        self.__journal_path = os.path.join(dataDir, __JOURNAL_FILE__)
+        self.__old_journal_path = os.path.join(dataDir, __OLD_JOURNAL_FILE__)
+        # generation of the snapshot - journal is valid only for the same generation
+        self.__generation = 0
+        self.__journal = None
+        self.__last_checkpoint = time.time()
+        # emp-uids whose History is shared with snapshot being written (copied before next write)
+        self.__shared_histories = set()
+        # (segments, segments-file path, partitions, archived-last, compacted histories) of written
+        # snapshot, swapped in on next save
+        self.__written_snapshot = None
+        # emp-uids removed from partitions since the snapshot (removed from written partitions too)
+        self.__purged_since_snapshot = set()
+        # month -> Partition
+        self.__partitions = {}
+        # emp-uid -> int minutes of last archived entry (older entry makes archive hot again)
+        self.__archived_last = {}
+        # file-name -> dict emp-uid -> History of recently queried partitions
+        self.__partition_cache = OrderedDict()
+        self.__partitions_dir = os.path.join(dataDir, __PARTITIONS_DIR__)
+        self.__archive_dir = os.path.join(dataDir, __ARCHIVE_DIR__)
+        self.__retention_months = retentionMonths
+        self.__retention_policy = retentionPolicy
+
+    def load(self):
+        if os.path.exists(self.__snapshot_path):
+            with open(self.__snapshot_path, 'rb') as dbFile:
+                dbDictionaries = pickle.load(dbFile)
+                self.emp_name_dict.update(dbDictionaries[0])
+                self.rfid_emp_dict.update(dbDictionaries[1])
+                # snapshots written before journaling was introduced have no generation
+                if len(dbDictionaries) > 3:
+                    self.__generation = dbDictionaries[3]
+                if len(dbDictionaries) > 4:
+                    for terminal in dbDictionaries[4]:
+                        self.__intern_terminal(terminal)
+
+                if len(dbDictionaries) > 5:
+                    self.__map_segments(dbDictionaries[2], os.path.join(self.dataDir, dbDictionaries[5]))
+                    for emp_uid in dbDictionaries[2].keys():
+                        self.__emp_hist_dict[emp_uid] = None
+                elif len(dbDictionaries) > 4:
+                    # snapshot written before segments file was introduced
+                    for (emp_uid, columns) in dbDictionaries[2].items():
+                        # snapshots written before sessions were tracked have only entries
+                        (minutes, terminals) = columns[:2]
+                        sessions = columns[2] if len(columns) > 2 else None
+                        history = History(_toArray('q', minutes), terminals, sessions)
+                        if sessions is not None:
+                            history = history.copy()
+                        if not history.isSorted():
+                            # snapshot written before history was kept in order
+                            history = History()
+                            for (minute, terminal) in sorted(zip(minutes, terminals), key=lambda item: item[0]):
+                                history.add(minute, terminal)
+                        self.__emp_hist_dict[emp_uid] = history
+                else:
+                    # convert history of 6-tuples used by older snapshots
+                    for (emp_uid, entries) in dbDictionaries[2].items():
+                        history = History()
+                        for entry in entries:
+                            history.add(entryToMinutes(entry),
+                                        self.__intern_terminal(entry[5]))
+                        self.__emp_hist_dict[emp_uid] = history
+
+                if len(dbDictionaries) > 6:
+                    for (month, (fileName, counts)) in dbDictionaries[6].items():
+                        self.__partitions[month] = Partition(month, fileName, counts)
+                    self.__archived_last.update(dbDictionaries[7])
+
+            # create emp_rfid dictionary
+            for item in self.rfid_emp_dict.items():
+                (rfid_uid, emp_uid) = item
+                self.emp_rfid_dict[emp_uid] = rfid_uid
+
+        # files left by interrupted checkpoints (not referenced by the snapshot)
+        self.__remove_stale_segment_files()
+        self.__remove_stale_partition_files(self.__partitions.values())
+
+        self.__replay_journal(self.__old_journal_path)
+        self.__replay_journal(self.__journal_path)
+
+        # valid journal of previous generation is left only when last checkpoint didn't complete
+        if os.path.exists(self.__old_journal_path):
+            # fold both journals into snapshot of a new generation (both become obsolete)
+            self.__generation += 1
+            self.__write_snapshot(self.__state_snapshot(None))
+            if os.path.exists(self.__journal_path):
+                os.remove(self.__journal_path)
+            self.__remap_written_snapshot()
+
+        self.__open_journal()
+
+    def __map_segments(self, segments, path):
+        self.__segments = segments
+        self.__segments_path = path
+        if os.path.getsize(path) == 0:
+            # empty file can't be mapped (no history at all)
+            self.__segments_map = b''
+        else:
+            with open(path, 'rb') as segmentsFile:
+                self.__segments_map = mmap.mmap(segmentsFile.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __segments_file(self, generation):
+        return os.path.join(self.dataDir, f"{__SEGMENTS_FILE__}.{generation}")
+
+    def __remove_stale_segment_files(self):
+        current = os.path.basename(self.__segments_file(self.__generation))
+        for fileName in os.listdir(self.dataDir):
+            if fileName.startswith(__SEGMENTS_FILE__) and fileName != current:
+                try:
+                    os.remove(os.path.join(self.dataDir, fileName))
+                except OSError:
+                    # still mapped (Windows) - removed on next start
+                    pass
+
+    def __remove_stale_partition_files(self, partitions):
+        """
+        partitions: the ones referenced by snapshot on disk
+        """
+        if not os.path.exists(self.__partitions_dir):
+            return
+        referenced = set(partition.fileName for partition in partitions)
+        for fileName in os.listdir(self.__partitions_dir):
+            if fileName not in referenced:
+                os.remove(os.path.join(self.__partitions_dir, fileName))
+
+    def __partition_histories(self, partition):
+        """
+        Returns:\n
+        \tdict emp-uid -> History of partition (decoded on first access and cached)
+        """
+        if partition.histories is not None:
+            return partition.histories
+
+        histories = self.__partition_cache.pop(partition.fileName, None)
+        if histories is None:
+            histories = Partition.read(os.path.join(self.__partitions_dir, partition.fileName))
+            if len(self.__partition_cache) >= __PARTITION_CACHE_SIZE__:
+                self.__partition_cache.popitem(last=False)
+        self.__partition_cache[partition.fileName] = histories
+        return histories
+
+    def __archived_histories(self, emp_uid, start=None, end=None):
+        """
+        only partitions overlapping [start, end) are opened\n
+        Returns:\n
+        \tlist of archived History of employee in chronological order
+        """
+        first = None if start is None else minutesToMonth(start)
+        last = None if end is None else minutesToMonth(end - 1)
+        histories = []
+        for month in sorted(self.__partitions.keys()):
+            if (first is not None and month < first) or (last is not None and month > last):
+                continue
+            partition = self.__partitions[month]
+            if emp_uid in partition.counts:
+                histories.append(self.__partition_histories(partition)[emp_uid])
+        return histories
+
+    def __writable_partition(self, month):
+        """
+        copy-on-write: histories of partition may be shared with the cache or with snapshot
+        being written, so they are replaced and never modified in place
+        """
+        partition = self.__partitions.get(month)
+        if partition is None:
+            partition = Partition(month)
+            self.__partitions[month] = partition
+        else:
+            partition.histories = dict(self.__partition_histories(partition))
+            partition.counts = dict(partition.counts)
+            partition.fileName = None
+        return partition
+
+    def __purge_archived(self, emp_uid):
+        """
+        Returns:\n
+        \tlist of archived History of employee (removed from partitions) in chronological order
+        """
+        self.__archived_last.pop(emp_uid, None)
+        self.__purged_since_snapshot.add(emp_uid)
+        histories = []
+        for month in sorted(self.__partitions.keys()):
+            if emp_uid in self.__partitions[month].counts:
+                partition = self.__writable_partition(month)
+                histories.append(partition.histories.pop(emp_uid))
+                del partition.counts[emp_uid]
+                if len(partition.counts) == 0:
+                    del self.__partitions[month]
+        return histories
+
+    def __restore_archived(self, emp_uid):
+        """
+        entry older than the last archived one flips entrance/leave of archived entries
+        after it - archived history becomes hot again (it's compacted on next checkpoint)
+        """
+        (minutes, terminals) = (array('q'), array('I'))
+        for history in self.__purge_archived(emp_uid) + [self.__history(emp_uid)]:
+            minutes.extend(_toArray('q', history.minutes))
+            terminals.extend(_toArray('I', history.terminals))
+        self.__emp_hist_dict[emp_uid] = History(minutes, terminals)
+        self.__shared_histories.discard(emp_uid)
+
+    def __replay_journal(self, path):
+        if not os.path.exists(path):
+            return
+
+        validLength = 0
+        with open(path, 'rb') as journal:
+            try:
+                header = pickle.load(journal)
+            except (EOFError, pickle.UnpicklingError):
+                header = None
+
+            if not isinstance(header, tuple) or len(header) != 2 or header[0] != __JOURNAL_HEADER__ \
+                    or header[1] < self.__generation:
+                # journal of an older (already checkpointed) generation or garbage
+                os.remove(path)
+                return
+
+            # journal newer than snapshot - checkpoint was interrupted before snapshot got renamed
+            self.__generation = header[1]
+
+            validLength = journal.tell()
+            while True:
+                try:
+                    record = pickle.load(journal)
+                except EOFError:
+                    break
+                except (pickle.UnpicklingError, ValueError, IndexError):
+                    # torn record at the end of the journal (crash during write)
+                    break
+                self.__apply_record(record)
+                validLength = journal.tell()
+
+        # drop torn tail so new records are appended after the last valid one
+        if validLength != os.path.getsize(path):
+            with open(path, 'r+b') as journal:
+                journal.truncate(validLength)
+
+    def __open_journal(self):
+        if self.__journal is not None:
+            self.__journal.close()
+
+        isNew = not os.path.exists(self.__journal_path)
+        self.__journal = open(self.__journal_path, 'ab')
+        if isNew:
+            pickle.dump((__JOURNAL_HEADER__, self.__generation), self.__journal)
+
+    def __intern_terminal(self, terminal):
+        index = self.__terminal_index.get(terminal)
+        if index is None:
+            index = len(self.__terminals)
+            self.__terminals.append(terminal)
+            self.__terminal_index[terminal] = index
+        return index
+
+    def __history(self, emp_uid):
+        """
+        Returns:\n
+        \tHistory of employee, its segment is mapped on first access
+        """
+        history = self.__emp_hist_dict[emp_uid]
+        if history is None:
+            history = History.fromSegment(self.__segments_map, *self.__segments[emp_uid])
+            self.__emp_hist_dict[emp_uid] = history
+        return history
+
+    def __writable_history(self, emp_uid):
+        """
+        copy-on-write: mapped History or History shared with snapshot
+        being serialized is copied before modification
+        """
+        history = self.__history(emp_uid)
+        if emp_uid in self.__shared_histories or history.isReadOnly():
+            self.__shared_histories.discard(emp_uid)
+            history = history.copy()
+            self.__emp_hist_dict[emp_uid] = history
+        return history
+
+    def __apply_record(self, record):
+        operation = record[0]
+        if operation == __JOURNAL_ADD_ENTRY__:
+            if len(record) == 3:
+                # journal written before compact history (6-tuple entry)
+                (_, emp_uid, entry) = record
+                (minutes, terminal) = (entryToMinutes(entry), entry[5])
+            else:
+                (_, emp_uid, minutes, terminal) = record
+            archivedLast = self.__archived_last.get(emp_uid)
+            if archivedLast is not None and minutes < archivedLast:
+                self.__restore_archived(emp_uid)
+            self.__writable_history(emp_uid).add(
+                minutes, self.__intern_terminal(terminal))
+        elif operation == __JOURNAL_ADD_EMPLOYEE__:
+            (_, emp_uid, rfid_uid, name) = record
+            self._addEmployee(emp_uid, rfid_uid, name)
+            self.__emp_hist_dict[emp_uid] = History()
+        elif operation == __JOURNAL_MODIFY_NAME__:
+            (_, emp_uid, newName) = record
+            self._modifyEmpName(emp_uid, newName)
+        elif operation == __JOURNAL_MODIFY_RFID__:
+            (_, emp_uid, new_rfid_uid) = record
+            self._modifyEmpRFID(emp_uid, new_rfid_uid)
+        elif operation == __JOURNAL_DELETE_EMPLOYEE__:
+            (_, emp_uid) = record
+            if emp_uid in self.emp_name_dict:
+                self._deleteEmployee(emp_uid)
+                del self.__emp_hist_dict[emp_uid]
+                self.__purge_archived(emp_uid)
+                self.__shared_histories.discard(emp_uid)
+
+    def __apply(self, record):
+        self.__apply_record(record)
+        pickle.dump(record, self.__journal, pickle.HIGHEST_PROTOCOL)
+
+    def addEntries(self, entries):
+        for (emp_uid, minutes, terminal) in entries:
+            self.__apply((__JOURNAL_ADD_ENTRY__, emp_uid, minutes, terminal))
+
+    def addEmployee(self, emp_uid, rfid_uid, name):
+        self.__apply((__JOURNAL_ADD_EMPLOYEE__, emp_uid, rfid_uid, name))
+
+    def modifyEmpName(self, emp_uid, newName):
+        self.__apply((__JOURNAL_MODIFY_NAME__, emp_uid, newName))
+
+    def modifyEmpRFID(self, emp_uid, new_rfid_uid):
+        self.__apply((__JOURNAL_MODIFY_RFID__, emp_uid, new_rfid_uid))
+
+    def deleteEmployee(self, emp_uid):
+        self.__apply((__JOURNAL_DELETE_EMPLOYEE__, emp_uid))
+
+    def __to_entries(self, history):
+        terminals = self.__terminals
+        return [minutesToEntry(minutes, terminals[index])
+                for (minutes, index) in zip(history.minutes, history.terminals)]
+
+    def getHistory(self, emp_uid):
+        entries = []
+        for history in self.__archived_histories(emp_uid) + [self.__history(emp_uid)]:
+            entries.extend(self.__to_entries(history))
+        return entries
+
+    def getHistories(self):
+        # partition by partition - every partition is decoded only once
+        histories = {emp_uid: [] for emp_uid in self.__emp_hist_dict.keys()}
+        for month in sorted(self.__partitions.keys()):
+            partition = self.__partitions[month]
+            partitionHistories = self.__partition_histories(partition)
+            for emp_uid in partition.counts.keys():
+                histories[emp_uid].extend(self.__to_entries(partitionHistories[emp_uid]))
+        for (emp_uid, entries) in histories.items():
+            entries.extend(self.__to_entries(self.__history(emp_uid)))
+        return histories
+
+    def getHistoryColumns(self, emp_uid):
+        (minutes, terminals) = (array('q'), [])
+        for history in self.__archived_histories(emp_uid) + [self.__history(emp_uid)]:
+            minutes.extend(_toArray('q', history.minutes))
+            terminals.extend(self.__terminals[index] for index in history.terminals)
+        return (minutes, terminals)
+
+    def getWorkPeriods(self, emp_uid, start=None, end=None):
+        periods = []
+        for history in self.__archived_histories(emp_uid, start, end) + [self.__history(emp_uid)]:
+            periods.extend(history.workPeriods(start, end))
+        return periods
+
+    def getWorkTime(self, emp_uid, start=None, end=None):
+        return sum(history.workTime(start, end)
+                   for history in self.__archived_histories(emp_uid, start, end) + [self.__history(emp_uid)])
+
+    def historyLength(self, emp_uid):
+        history = self.__emp_hist_dict[emp_uid]
+        length = self.__segments[emp_uid][1] if history is None else len(history)
+        return length + sum(partition.counts.get(emp_uid, 0) for partition in self.__partitions.values())
+
+    def __take_snapshot(self):
+        """
+        O(employees) - dictionaries are copied shallowly, histories are shared
+        with the live state until they are modified (copy-on-write)\n
+        past months are compacted later, on the copies (see __compact_snapshot)
+        """
+        # records written from now on belong to the next generation
+        self.__journal.close()
+        os.replace(self.__journal_path, self.__old_journal_path)
+        self.__generation += 1
+        self.__journal = None
+        self.__open_journal()
+        self.__last_checkpoint = time.time()
+
+        self.__shared_histories = set(self.__emp_hist_dict.keys())
+        return self.__state_snapshot(minutesToMonth(dateToMinutes(datetime.datetime.now())))
+
+    def __state_snapshot(self, month):
+        """
+        month: sessions of months before it are compacted into partitions (None - no compaction)\n
+        Returns:\n
+        \ttuple of (shallow) copies of the state written by __write_snapshot
+        """
+        self.__purged_since_snapshot = set()
+        partitions = [Partition(partition.month, partition.fileName, partition.counts, partition.histories)
+                      for partition in self.__partitions.values()]
+        return (dict(self.emp_name_dict), dict(self.rfid_emp_dict), dict(self.__emp_hist_dict),
+                self.__generation, self.__terminals[:], self.__segments, self.__segments_map,
+                partitions, dict(self.__archived_last), month)
+
+    def __compact_snapshot(self, histories, oldSegments, oldSegmentsMap, partitions, archivedLast, month):
+        """
+        moves completed sessions with entrance before month from hot histories of the snapshot
+        to monthly partitions, retires partitions past retention period - runs on the copies
+        in the snapshot, without the database lock (partitions are decoded from their files,
+        the live partition cache isn't touched)\n
+        Returns:\n
+        \ttuple(list of Partition, list of retired Partition,
+        \tdict emp-uid -> tuple(int compacted entry count, History before compaction))
+        """
+        cut = monthToMinutes(month)
+        archived = {}
+        compacted = {}
+        for (emp_uid, history) in histories.items():
+            if history is None:
+                history = History.fromSegment(oldSegmentsMap, *oldSegments[emp_uid])
+            sessionCount = bisect_left(history.starts, cut)
+            if sessionCount == 0:
+                continue
+
+            (minutes, terminals, starts) = (history.minutes, history.terminals, history.starts)
+            sessionMonth = minutesToMonth(starts[0])
+            first = 0
+            while first < sessionCount:
+                last = bisect_left(starts, monthToMinutes(sessionMonth + 1), first, sessionCount)
+                if last > first:
+                    archived.setdefault(sessionMonth, {})[emp_uid] = History(
+                        _toArray('q', minutes[2 * first:2 * last]), _toArray('I', terminals[2 * first:2 * last]))
+                (first, sessionMonth) = (last, sessionMonth + 1)
+
+            entryCount = 2 * sessionCount
+            archivedLast[emp_uid] = minutes[entryCount - 1]
+            histories[emp_uid] = History(
+                _toArray('q', minutes[entryCount:]), _toArray('I', terminals[entryCount:]),
+                (_toArray('q', starts[sessionCount:]), _toArray('q', history.ends[sessionCount:]),
+                 history.openSession))
+            compacted[emp_uid] = (entryCount, history)
+
+        byMonth = {partition.month: partition for partition in partitions}
+        for (partitionMonth, monthHistories) in archived.items():
+            partition = byMonth.get(partitionMonth)
+            if partition is None:
+                partition = Partition(partitionMonth)
+                byMonth[partitionMonth] = partition
+            else:
+                # histories of the copy are shared with the live partition - replaced, not modified
+                partition.histories = dict(Partition.read(os.path.join(self.__partitions_dir, partition.fileName))
+                                           if partition.histories is None else partition.histories)
+                partition.counts = dict(partition.counts)
+                partition.fileName = None
+            for (emp_uid, history) in monthHistories.items():
+                archivedHistory = partition.histories.get(emp_uid)
+                if archivedHistory is not None:
+                    # late entries newer than the last archived one
+                    history = History(archivedHistory.minutes + history.minutes,
+                                      archivedHistory.terminals + history.terminals)
+                partition.histories[emp_uid] = history
+                partition.counts[emp_uid] = len(history)
+
+        retired = []
+        if self.__retention_months > 0:
+            retired = [byMonth.pop(oldMonth) for oldMonth in sorted(byMonth.keys())
+                       if oldMonth < month - self.__retention_months]
+        return (list(byMonth.values()), retired, compacted)
+
+    def __write_partitions(self, partitions, retired, generation):
+        """
+        writes modified partitions, archives retired ones (policy 'archive')\n
+        Returns:\n
+        \tdict month -> tuple(str file-name, dict counts) of written snapshot
+        """
+        os.makedirs(self.__partitions_dir, exist_ok=True)
+        index = {}
+        for partition in partitions:
+            if partition.fileName is None:
+                partition.fileName = f"{monthName(partition.month)}.{generation}{__PARTITION_EXTENSION__}"
+                Partition.write(os.path.join(self.__partitions_dir, partition.fileName), partition.histories)
+            index[partition.month] = (partition.fileName, partition.counts)
+
+        if self.__retention_policy == 'archive' and len(retired) > 0:
+            # copied before the snapshot is renamed - the originals are removed as stale files afterwards
+            os.makedirs(self.__archive_dir, exist_ok=True)
+            for partition in retired:
+                archivePath = os.path.join(self.__archive_dir,
+                                           f"{monthName(partition.month)}.{generation}{__PARTITION_EXTENSION__}")
+                if partition.fileName is None:
+                    Partition.write(archivePath, partition.histories)
+                else:
+                    shutil.copyfile(os.path.join(self.__partitions_dir, partition.fileName), archivePath)
+        return index
+
+    def __write_snapshot(self, snapshot):
+        (names, rfids, histories, generation, terminals, oldSegments, oldSegmentsMap,
+         partitions, archivedLast, month) = snapshot
+        (retired, compacted) = ([], {})
+        if month is not None:
+            (partitions, retired, compacted) = self.__compact_snapshot(
+                histories, oldSegments, oldSegmentsMap, partitions, archivedLast, month)
+        segmentsPath = self.__segments_file(generation)
+        tempPath = self.__snapshot_path + __TEMP_SUFFIX__
+        partitionIndex = self.__write_partitions(partitions, retired, generation)
+
+        segments = {}
+        offset = 0
+        with open(segmentsPath, 'wb') as segmentsFile:
+            for (emp_uid, history) in histories.items():
+                if history is None:
+                    # never accessed - raw copy of its segment from previous segments file
+                    (oldOffset, count, sessionCount, openSession) = oldSegments[emp_uid]
+                    size = History.segmentSize(count, sessionCount)
+                    segmentsFile.write(memoryview(oldSegmentsMap)[oldOffset:oldOffset + size])
+                else:
+                    (count, sessionCount, openSession) = (len(history), len(history.starts), history.openSession)
+                    size = history.writeSegment(segmentsFile)
+                segments[emp_uid] = (offset, count, sessionCount, openSession)
+                offset += size
+            segmentsFile.flush()
+            os.fsync(segmentsFile.fileno())
+
+        with open(tempPath, 'wb') as dbFile:
+            dbDictionaries = []
+            dbDictionaries.append(names)
+            dbDictionaries.append(rfids)
+            dbDictionaries.append(segments)
+            dbDictionaries.append(generation)
+            dbDictionaries.append(terminals)
+            dbDictionaries.append(os.path.basename(segmentsPath))
+            dbDictionaries.append(partitionIndex)
+            dbDictionaries.append(archivedLast)
+            pickle.dump(dbDictionaries, dbFile, pickle.HIGHEST_PROTOCOL)
+            dbFile.flush()
+            os.fsync(dbFile.fileno())
+
+        os.replace(tempPath, self.__snapshot_path)
+        self.__fsync_data_dir()
+        # snapshot of new generation is on disk -> old journal is obsolete
+        os.remove(self.__old_journal_path)
+        self.__written_snapshot = (segments, segmentsPath, partitionIndex, archivedLast, compacted)
+
+    def __fsync_data_dir(self):
+        # make the rename durable (not supported on Windows)
+        if hasattr(os, 'O_DIRECTORY'):
+            dirFd = os.open(self.dataDir, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(dirFd)
+            finally:
+                os.close(dirFd)
+
+    def __remap_written_snapshot(self):
+        """
+        swaps in the written snapshot: histories not modified since the snapshot are released
+        and mapped again from the new segments file (memory of the copies is given back),
+        compacted sessions are cut from modified ones, partitions are replaced by the written ones
+        """
+        (segments, segmentsPath, partitionIndex, archivedLast, compacted) = self.__written_snapshot
+        self.__written_snapshot = None
+        self.__map_segments(segments, segmentsPath)
+        for emp_uid in self.__shared_histories:
+            self.__emp_hist_dict[emp_uid] = None
+
+        purged = self.__purged_since_snapshot
+        restored = {}
+        for (emp_uid, (entryCount, compactedHistory)) in compacted.items():
+            if emp_uid in self.__shared_histories or emp_uid in purged or emp_uid not in self.__emp_hist_dict:
+                continue
+            history = self.__emp_hist_dict[emp_uid]
+            if _samePrefix(history, compactedHistory, entryCount):
+                sessionCount = entryCount // 2
+                self.__emp_hist_dict[emp_uid] = History(
+                    history.minutes[entryCount:], history.terminals[entryCount:],
+                    (history.starts[sessionCount:], history.ends[sessionCount:], history.openSession))
+            else:
+                # late entry among the compacted ones - they are hot again
+                restored[emp_uid] = entryCount
+        self.__shared_histories.clear()
+
+        self.__partitions = {month: Partition(month, fileName, counts)
+                             for (month, (fileName, counts)) in partitionIndex.items()}
+        self.__remove_stale_segment_files()
+        self.__remove_stale_partition_files(self.__partitions.values())
+        self.__archived_last = archivedLast
+        self.__purged_since_snapshot = set()
+        for emp_uid in purged:
+            self.__purge_archived(emp_uid)
+        for (emp_uid, entryCount) in restored.items():
+            (minutes, terminals) = (array('q'), array('I'))
+            for history in self.__purge_archived(emp_uid):
+                minutes.extend(history.minutes)
+                terminals.extend(history.terminals)
+            # compacted entries are the newest archived ones, the live history has them already
+            keep = len(minutes) - entryCount
+            history = self.__emp_hist_dict[emp_uid]
+            self.__emp_hist_dict[emp_uid] = History(minutes[:keep] + history.minutes,
+                                                    terminals[:keep] + history.terminals)
+        self.__purged_since_snapshot = set()
+
+    def beginSave(self, checkpoint=False):
+        """
+        flushes journal buffer, takes snapshot when journal has grown too big/old\n
+        slow part: fsync of journal, serialization of snapshot to temp file + atomic rename
+        """
+        if self.__written_snapshot is not None:
+            self.__remap_written_snapshot()
+
+        self.__journal.flush()
+        journalFd = os.dup(self.__journal.fileno())
+
+        snapshot = None
+        checkpointDue = checkpoint or self.__journal.tell() > __CHECKPOINT_JOURNAL_SIZE__ or \
+            time.time() - self.__last_checkpoint > __CHECKPOINT_INTERVAL__
+        # previous snapshot still being written -> checkpoint waits for next save
+        if checkpointDue and not os.path.exists(self.__old_journal_path):
+            snapshot = self.__take_snapshot()
+
+        def finishSave():
+            try:
+                os.fsync(journalFd)
+            finally:
+                os.close(journalFd)
+            if snapshot is not None:
+                self.__write_snapshot(snapshot)
+        return finishSave
+
+    def close(self):
+        if self.__written_snapshot is not None:
+            self.__remap_written_snapshot()
+        if self.__journal is not None:
+            self.__journal.close()
+            self.__journal = None
+
+
+class SqliteStorage(Storage):
+    """
+    Employees and history kept in sqlite database, history is never loaded as a whole.\n
+    Completed work sessions are maintained incrementally in 'sessions' table,
+    last entry and open session of every employee in 'session_state' (cached in memory).\n
+    Sessions of months past retention period are removed on checkpoint
+    (and moved to archive database with policy 'archive') - checkpoint is done only when
+    asked for (EmployeesDataBase.checkpoint, i.e. when the server exits), regular saves just commit.
+    """
+
+    def __init__(self, dataDir=DATA_DIR, batchSize=__SQLITE_BATCH_SIZE__,
+                 retentionMonths=0, retentionPolicy='archive'):
+        super().__init__(dataDir)
+        self.__path = os.path.join(dataDir, __SQLITE_FILE__)
+        self.__archive_path = os.path.join(dataDir, __ARCHIVE_DIR__, __SQLITE_ARCHIVE_FILE__)
+        self.__batch_size = batchSize
+        self.__retention_months = retentionMonths
+        self.__retention_policy = retentionPolicy
+        self.__pending_entries = []
+        self.__pending_sessions = []
+        # emp-uid -> [int last-entry, int open-session-entrance or None]
+        self.__session_state = {}
+        self.__dirty_session_state = set()
+        # employees whose sessions have to be rebuilt (entry older than the last one arrived)
+        self.__stale_sessions = set()
+        self.__connection = None
+
+    def load(self):
+        isNew = not os.path.exists(self.__path)
+
+        # access is serialized by EmployeesDataBase lock
+        self.__connection = sqlite3.connect(self.__path, check_same_thread=False)
+        self.__connection.execute('PRAGMA journal_mode=WAL')
+        self.__connection.execute('PRAGMA synchronous=NORMAL')
+        hasSessions = self.__connection.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'sessions'").fetchone()[0] > 0
+        self.__create_schema()
+
+        if isNew:
+            self.__migrate_from_pickle()
+
+        for (emp_uid, name, rfid_uid) in self.__connection.execute(
+                'SELECT emp_uid, name, rfid_uid FROM employees'):
+            self._addEmployee(emp_uid, rfid_uid, name)
+
+        if not hasSessions:
+            # database created before sessions were tracked
+            with self.__connection:
+                for emp_uid in self.emp_name_dict.keys():
+                    self.__rebuild_sessions(emp_uid)
+
+        for (emp_uid, lastEntry, openEntrance) in self.__connection.execute(
+                'SELECT emp_uid, last_entry, open_entrance FROM session_state'):
+            self.__session_state[emp_uid] = [lastEntry, openEntrance]
+
+    def __create_schema(self):
+        with self.__connection:
+            self.__connection.executescript('''
+                CREATE TABLE IF NOT EXISTS employees (
+                    emp_uid TEXT PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    rfid_uid INTEGER NOT NULL UNIQUE
+                );
+                CREATE TABLE IF NOT EXISTS entries (
+                    id INTEGER PRIMARY KEY,
+                    emp_uid TEXT NOT NULL,
+                    timestamp INTEGER NOT NULL,
+                    terminal TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS entries_emp_timestamp ON entries (emp_uid, timestamp);
+                CREATE INDEX IF NOT EXISTS entries_terminal ON entries (terminal);
+                CREATE TABLE IF NOT EXISTS sessions (
+                    emp_uid TEXT NOT NULL,
+                    entrance INTEGER NOT NULL,
+                    leave INTEGER NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS sessions_emp_entrance ON sessions (emp_uid, entrance);
+                CREATE TABLE IF NOT EXISTS session_state (
+                    emp_uid TEXT PRIMARY KEY,
+                    last_entry INTEGER NOT NULL,
+                    open_entrance INTEGER
+                );
+            ''')
+
+    def __migrate_from_pickle(self):
+        """
+        one-shot import of pickle database (snapshot + journal) into fresh sqlite database
+        """
+        snapshotPath = os.path.join(self.dataDir, __SNAPSHOT_FILE__)
+        journalPath = os.path.join(self.dataDir, __JOURNAL_FILE__)
+        if not os.path.exists(snapshotPath) and not os.path.exists(journalPath):
+            return
+
+        old = PickleStorage(self.dataDir)
+        old.load()
+
+        with self.__connection:
+            self.__connection.executemany(
+                'INSERT INTO employees (emp_uid, name, rfid_uid) VALUES (?, ?, ?)',
+                [(emp_uid, name, old.emp_rfid_dict[emp_uid])
+                 for (emp_uid, name) in old.emp_name_dict.items()])
+            for emp_uid in old.emp_name_dict.keys():
+                (minutes, terminals) = old.getHistoryColumns(emp_uid)
+                self.__connection.executemany(
+                    'INSERT INTO entries (emp_uid, timestamp, terminal) VALUES (?, ?, ?)',
+                    zip([emp_uid] * len(minutes), minutes, terminals))
+        old.close()
+
+        for path in (snapshotPath, journalPath):
+            if os.path.exists(path):
+                os.rename(path, path + __MIGRATED_SUFFIX__)
+
+    def __rebuild_sessions(self, emp_uid):
+        self.__connection.execute(
+            'DELETE FROM sessions WHERE emp_uid = ?', (emp_uid,))
+        self.__connection.execute(
+            'DELETE FROM session_state WHERE emp_uid = ?', (emp_uid,))
+        self.__session_state.pop(emp_uid, None)
+
+        minutes = [row[0] for row in self.__connection.execute(
+            'SELECT timestamp FROM entries WHERE emp_uid = ? ORDER BY timestamp, id', (emp_uid,))]
+        if len(minutes) == 0:
+            return
+
+        paired = len(minutes) - len(minutes) % 2
+        self.__connection.executemany(
+            'INSERT INTO sessions (emp_uid, entrance, leave) VALUES (?, ?, ?)',
+            [(emp_uid, minutes[index], minutes[index + 1]) for index in range(0, paired, 2)])
+        state = [minutes[-1], minutes[-1] if paired < len(minutes) else None]
+        self.__connection.execute(
+            'INSERT INTO session_state (emp_uid, last_entry, open_entrance) VALUES (?, ?, ?)',
+            (emp_uid, state[0], state[1]))
+        self.__session_state[emp_uid] = state
+
+    def __track_session(self, emp_uid, minutes):
+        if emp_uid in self.__stale_sessions:
+            return
+
+        state = self.__session_state.get(emp_uid)
+        if state is None:
+            self.__session_state[emp_uid] = [minutes, minutes]
+        elif minutes < state[0]:
+            # late entry flips entrance/leave of every entry after it
+            self.__stale_sessions.add(emp_uid)
+            return
+        else:
+            state[0] = minutes
+            if state[1] is None:
+                state[1] = minutes
+            else:
+                self.__pending_sessions.append((emp_uid, state[1], minutes))
+                state[1] = None
+        self.__dirty_session_state.add(emp_uid)
+
+    def __flush_entries(self):
+        if len(self.__pending_entries) > 0:
+            self.__connection.executemany(
+                'INSERT INTO entries (emp_uid, timestamp, terminal) VALUES (?, ?, ?)',
+                self.__pending_entries)
+            self.__pending_entries.clear()
+
+        if len(self.__pending_sessions) > 0:
+            self.__connection.executemany(
+                'INSERT INTO sessions (emp_uid, entrance, leave) VALUES (?, ?, ?)',
+                self.__pending_sessions)
+            self.__pending_sessions.clear()
+
+        for emp_uid in self.__stale_sessions:
+            self.__rebuild_sessions(emp_uid)
+            self.__dirty_session_state.discard(emp_uid)
+        self.__stale_sessions.clear()
+
+        if len(self.__dirty_session_state) > 0:
+            self.__connection.executemany(
+                'INSERT OR REPLACE INTO session_state (emp_uid, last_entry, open_entrance) VALUES (?, ?, ?)',
+                [(emp_uid, *self.__session_state[emp_uid]) for emp_uid in self.__dirty_session_state])
+            self.__dirty_session_state.clear()
+
+    def addEntries(self, entries):
+        self.__pending_entries.extend(entries)
+        for (emp_uid, minutes, terminal) in entries:
+            self.__track_session(emp_uid, minutes)
+
+        if len(self.__pending_entries) >= self.__batch_size:
+            self.__flush_entries()
+
+    def addEmployee(self, emp_uid, rfid_uid, name):
+        self.__connection.execute(
+            'INSERT INTO employees (emp_uid, name, rfid_uid) VALUES (?, ?, ?)',
+            (emp_uid, name, rfid_uid))
+        self._addEmployee(emp_uid, rfid_uid, name)
+
+    def modifyEmpName(self, emp_uid, newName):
+        self.__connection.execute(
+            'UPDATE employees SET name = ? WHERE emp_uid = ?', (newName, emp_uid))
+        self._modifyEmpName(emp_uid, newName)
+
+    def modifyEmpRFID(self, emp_uid, new_rfid_uid):
+        self.__connection.execute(
+            'UPDATE employees SET rfid_uid = ? WHERE emp_uid = ?', (new_rfid_uid, emp_uid))
+        self._modifyEmpRFID(emp_uid, new_rfid_uid)
+
+    def deleteEmployee(self, emp_uid):
+        self.__flush_entries()
+        self.__connection.execute(
+            'DELETE FROM entries WHERE emp_uid = ?', (emp_uid,))
+        self.__connection.execute(
+            'DELETE FROM sessions WHERE emp_uid = ?', (emp_uid,))
+        self.__connection.execute(
+            'DELETE FROM session_state WHERE emp_uid = ?', (emp_uid,))
+        self.__connection.execute(
+            'DELETE FROM employees WHERE emp_uid = ?', (emp_uid,))
+        self.__session_state.pop(emp_uid, None)
+        self._deleteEmployee(emp_uid)
+
+    def getHistory(self, emp_uid):
+        self.__flush_entries()
+        return [minutesToEntry(minutes, terminal) for (minutes, terminal) in self.__connection.execute(
+            'SELECT timestamp, terminal FROM entries WHERE emp_uid = ? ORDER BY timestamp, id', (emp_uid,))]
+
+    def getHistories(self):
+        self.__flush_entries()
+        histories = {emp_uid: [] for emp_uid in self.emp_name_dict.keys()}
+        rows = self.__connection.execute(
+            'SELECT emp_uid, timestamp, terminal FROM entries ORDER BY emp_uid, timestamp, id')
+        for (emp_uid, group) in groupby(rows, key=lambda row: row[0]):
+            histories[emp_uid] = [minutesToEntry(minutes, terminal)
+                                  for (_, minutes, terminal) in group]
+        return histories
+
+    def getHistoryColumns(self, emp_uid):
+        self.__flush_entries()
+        rows = self.__connection.execute(
+            'SELECT timestamp, terminal FROM entries WHERE emp_uid = ? ORDER BY timestamp, id', (emp_uid,)).fetchall()
+        return (array('q', [row[0] for row in rows]), [row[1] for row in rows])
+
+    def __sessions_query(self, columns, emp_uid, start, end):
+        query = f'SELECT {columns} FROM sessions WHERE emp_uid = ?'
+        parameters = [emp_uid]
+        if start is not None:
+            query += ' AND entrance >= ?'
+            parameters.append(start)
+        if end is not None:
+            query += ' AND entrance < ?'
+            parameters.append(end)
+        return (query, parameters)
+
+    def getWorkPeriods(self, emp_uid, start=None, end=None):
+        self.__flush_entries()
+        (query, parameters) = self.__sessions_query(
+            'entrance, leave', emp_uid, start, end)
+        return self.__connection.execute(query + ' ORDER BY entrance', parameters).fetchall()
+
+    def getWorkTime(self, emp_uid, start=None, end=None):
+        self.__flush_entries()
+        (query, parameters) = self.__sessions_query(
+            'COALESCE(SUM(leave - entrance), 0)', emp_uid, start, end)
+        return self.__connection.execute(query, parameters).fetchone()[0]
+
+    def historyLength(self, emp_uid):
+        self.__flush_entries()
+        return self.__connection.execute(
+            'SELECT COUNT(*) FROM entries WHERE emp_uid = ?', (emp_uid,)).fetchone()[0]
+
+    def __apply_retention(self):
+        """
+        removes sessions with entrance before retention period together with their entries
+        (history is cut only between sessions, so remaining ones don't have to be re-paired)\n
+        runs on checkpoint only
+        """
+        currentMonth = minutesToMonth(dateToMinutes(datetime.datetime.now()))
+        cut = monthToMinutes(currentMonth - self.__retention_months)
+        expired = self.__connection.execute(
+            'SELECT emp_uid, COUNT(*) FROM sessions WHERE entrance < ? GROUP BY emp_uid', (cut,)).fetchall()
+        if len(expired) == 0:
+            return
+
+        archive = self.__retention_policy == 'archive'
+        if archive:
+            os.makedirs(os.path.dirname(self.__archive_path), exist_ok=True)
+            self.__connection.execute('ATTACH DATABASE ? AS archive', (self.__archive_path,))
+            self.__connection.execute('''
+                CREATE TABLE IF NOT EXISTS archive.entries (
+                    emp_uid TEXT NOT NULL,
+                    timestamp INTEGER NOT NULL,
+                    terminal TEXT NOT NULL
+                )''')
+
+        with self.__connection:
+            for (emp_uid, sessionCount) in expired:
+                expiredEntries = 'SELECT id FROM entries WHERE emp_uid = ? ORDER BY timestamp, id LIMIT ?'
+                if archive:
+                    self.__connection.execute(
+                        'INSERT INTO archive.entries (emp_uid, timestamp, terminal) '
+                        f'SELECT emp_uid, timestamp, terminal FROM entries WHERE id IN ({expiredEntries})',
+                        (emp_uid, 2 * sessionCount))
+                self.__connection.execute(
+                    f'DELETE FROM entries WHERE id IN ({expiredEntries})', (emp_uid, 2 * sessionCount))
+            self.__connection.execute('DELETE FROM sessions WHERE entrance < ?', (cut,))
+
+        if archive:
+            self.__connection.execute('DETACH DATABASE archive')
+
+    def beginSave(self, checkpoint=False):
+        """
+        commit is cheap in WAL mode, so all of the work is done with the database locked
+        """
+        self.__flush_entries()
+        self.__connection.commit()
+        if checkpoint:
+            if self.__retention_months > 0:
+                self.__apply_retention()
+            self.__connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        return lambda: None
+
+    def close(self):
+        if self.__connection is not None:
+            self.beginSave()
+            self.__connection.close()
+            self.__connection = None
+
+
+# available storage engines (config: DATABASE_BACKEND)
+STORAGE_BACKENDS = {
+    'pickle': PickleStorage,
+    'sqlite': SqliteStorage
+}
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+import json
+import struct
+from datetime import datetime, timedelta
+from src.constants import *
+
+# rfid/record payload formats (versions are negotiated in broadcast handshake)
+FORMAT_JSON = 1
+FORMAT_BINARY = 2
+FORMAT_BATCH = 3
+SUPPORTED_FORMATS = (FORMAT_JSON, FORMAT_BINARY, FORMAT_BATCH)
+
+# binary rfid/record (little-endian, 19 bytes):
+# format version, rfid-uid, terminal index (assigned by server), seconds since 1970-01-01 (terminal's local time)
+__BINARY_RECORD__ = struct.Struct('<BQHq')
+__EPOCH__ = datetime(1970, 1, 1)
+# batch of rfid/record payloads (JSON or binary, mixed):
+# format version, number of records, then every record prefixed by its length
+__BATCH_HEADER__ = struct.Struct('<BH')
+__BATCH_ITEM__ = struct.Struct('<H')
+
+
+def encodeRecord(rfid_uid, terminalIndex, date):
+    """
+    Returns:\n
+    \tbytes binary rfid/record payload
+    """
+    return __BINARY_RECORD__.pack(FORMAT_BINARY, rfid_uid, terminalIndex,
+                                  (date - __EPOCH__) // timedelta(seconds=1))
+
+
+def encodeBatch(payloads):
+    """
+    payloads: list of rfid/record payloads (str JSON or bytes binary)\n
+    Returns:\n
+    \tbytes batch rfid/record payload
+    """
+    parts = [__BATCH_HEADER__.pack(FORMAT_BATCH, len(payloads))]
+    for payload in payloads:
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        parts.append(__BATCH_ITEM__.pack(len(payload)))
+        parts.append(payload)
+    return b''.join(parts)
+
+
+def encodeRecordJson(rfid_uid, terminal_id, date):
+    """
+    Returns:\n
+    \tstr JSON rfid/record payload
+    """
+    return json.dumps({JSON_RFID_UID: rfid_uid, JSON_TERMINAL_ID: terminal_id,
+                       JSON_RFID_DATE: date.strftime("%d.%m.%Y.%H.%M")})
+
+
+def decodeBatch(payload):
+    """
+    Returns:\n
+    \tlist of rfid/record payloads of batch (list with the payload itself if it isn't a batch)
+    Throws exceptions:\n
+    \tValueError (malformed batch)
+    """
+    if not isinstance(payload, (bytes, bytearray)) or len(payload) == 0 or payload[0] != FORMAT_BATCH:
+        return [payload]
+
+    try:
+        (_, count) = __BATCH_HEADER__.unpack_from(payload)
+        payloads = []
+        offset = __BATCH_HEADER__.size
+        for _ in range(count):
+            (length,) = __BATCH_ITEM__.unpack_from(payload, offset)
+            offset += __BATCH_ITEM__.size
+            if offset + length > len(payload):
+                raise ValueError('truncated batch')
+            payloads.append(payload[offset:offset + length])
+            offset += length
+    except struct.error as error:
+        raise ValueError('malformed batch') from error
+    return payloads
+
+
+def decodeRecord(payload, terminalForIndex, terminal_id=None):
+    """
+    payload: binary or JSON rfid/record\n
+    terminalForIndex: callable(int index) -> str terminal-id or None\n
+    terminal_id: terminal the record was published by (rfid/record/<terminal_id>),
+    takes precedence over terminal index or id in payload\n
+    Returns:\n
+    \ttuple(rfid-uid, str terminal-id or None if index is unknown, datetime date)
+    Throws exceptions:\n
+    \tValueError (malformed payload)
+    """
+    if isinstance(payload, (bytes, bytearray)) and len(payload) > 0 and payload[0] == FORMAT_BINARY:
+        try:
+            (_, rfid_uid, terminalIndex, seconds) = __BINARY_RECORD__.unpack(payload)
+            return (rfid_uid, terminalForIndex(terminalIndex) if terminal_id is None else terminal_id,
+                    __EPOCH__ + timedelta(seconds=seconds))
+        except (struct.error, OverflowError) as error:
+            raise ValueError('malformed binary record') from error
+
+    msg_json = json.loads(payload)
+    try:
+        (day, month, year, hour,
+         minute) = [int(item) for item in msg_json[JSON_RFID_DATE].split('.')]
+        return (msg_json[JSON_RFID_UID], msg_json[JSON_TERMINAL_ID] if terminal_id is None else terminal_id,
+                datetime(year, month, day, hour, minute))
+    except (KeyError, TypeError, AttributeError) as error:
+        raise ValueError('malformed JSON record') from error
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+# server modules are imported as src.* from the RFID-Server-App directory (as serverApp does)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# src.data creates DATA_DIR relative to the working directory when it's imported -
+# tests run in a temporary one so the server's data is never touched
+__WORK_DIR__ = tempfile.mkdtemp(prefix='rfid-server-tests-')
+__CWD__ = os.getcwd()
+
+
+def pytest_configure(config):
+    os.chdir(__WORK_DIR__)
+
+
+def pytest_unconfigure(config):
+    os.chdir(__CWD__)
+    shutil.rmtree(__WORK_DIR__, ignore_errors=True)
+
+
+@pytest.fixture
+def dataDir(tmp_path):
+    """
+    Returns:\n
+    \tstr empty data directory of a database
+    """
+    path = tmp_path / 'data'
+    path.mkdir()
+    return str(path)
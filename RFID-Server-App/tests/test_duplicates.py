@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+from datetime import datetime, timedelta
+
+from src.ingest import DuplicateFilter
+
+__WINDOW__ = 60
+# beginning of a window bucket (seconds since the epoch divisible by window)
+__DATE__ = datetime(2024, 3, 4, 8, 0)
+
+
+def __at(seconds):
+    return __DATE__ + timedelta(seconds=seconds)
+
+
+def test_window_edges():
+    duplicates = DuplicateFilter(window=__WINDOW__)
+    assert not duplicates.isDuplicate('terminal-1', 1001, __at(0))
+    assert duplicates.isDuplicate('terminal-1', 1001, __at(__WINDOW__ - 1))
+    # redelivery of an older record
+    assert duplicates.isDuplicate('terminal-1', 1001, __at(1 - __WINDOW__))
+    assert not duplicates.isDuplicate('terminal-1', 1001, __at(__WINDOW__))
+    assert duplicates.getSuppressedCount() == 2
+
+
+def test_repeat_across_bucket_boundary():
+    duplicates = DuplicateFilter(window=__WINDOW__)
+    assert not duplicates.isDuplicate('terminal-1', 1001, __at(__WINDOW__ - 1))
+    assert duplicates.isDuplicate('terminal-1', 1001, __at(__WINDOW__ + 1))
+    assert not duplicates.isDuplicate('terminal-1', 1001, __at(2 * __WINDOW__ - 1))
+
+
+def test_key_is_terminal_and_card():
+    duplicates = DuplicateFilter(window=__WINDOW__)
+    assert not duplicates.isDuplicate('terminal-1', 1001, __at(0))
+    assert not duplicates.isDuplicate('terminal-2', 1001, __at(0))
+    assert not duplicates.isDuplicate('terminal-1', 1002, __at(0))
+    assert duplicates.getSuppressedCount() == 0
+
+
+def test_least_recently_used_keys_are_forgotten():
+    duplicates = DuplicateFilter(window=__WINDOW__, capacity=2)
+    assert not duplicates.isDuplicate('terminal-1', 1001, __at(0))
+    assert not duplicates.isDuplicate('terminal-1', 1002, __at(0))
+    # suppressed repeat makes 1001 the most recently used
+    assert duplicates.isDuplicate('terminal-1', 1001, __at(1))
+    assert not duplicates.isDuplicate('terminal-1', 1003, __at(0))
+    assert duplicates.isDuplicate('terminal-1', 1001, __at(2))
+    # 1002 was forgotten above capacity
+    assert not duplicates.isDuplicate('terminal-1', 1002, __at(1))
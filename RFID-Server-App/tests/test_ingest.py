@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from src.constants import RFID_RECORD
+from src.data import EmployeesDataBase, InvalidInputDataError, NoSuchEmployeeError
+from src.ingest import IngestPipeline
+from src.server import TerminalRegistry
+from src.wire import encodeRecord, encodeRecordJson
+
+__DATE__ = datetime(2024, 3, 4, 8, 0)
+
+
+@pytest.fixture
+def database(dataDir):
+    database = EmployeesDataBase('pickle', dataDir=dataDir)
+    yield database
+    database.close()
+
+
+@pytest.fixture
+def registry():
+    registry = TerminalRegistry()
+    registry.load(['terminal-1'], {})
+    return registry
+
+
+def __record(rfid_uid, minutes=0):
+    return encodeRecord(rfid_uid, 0, __DATE__ + timedelta(minutes=minutes))
+
+
+def __history_length(database, rfid_uid):
+    return sum(len(history) for (_, _, uid, history) in database.getEmployeesDataSummary() if uid == rfid_uid)
+
+
+def test_add_entries_checks_whole_batch_first(database):
+    database.addEmployee(1001, 'emp-1', 'Alice')
+    with pytest.raises(NoSuchEmployeeError):
+        database.addEntries([(1001, 'terminal-1', __DATE__), (1002, 'terminal-1', __DATE__)])
+    with pytest.raises(InvalidInputDataError):
+        database.addEntries([(1001, 'terminal-1', __DATE__), ('1002', 'terminal-1', __DATE__)],
+                            addUnknownEmployees=True)
+    assert __history_length(database, 1001) == 0
+
+
+def test_add_entries_adds_anonymous_employees(database):
+    database.addEmployee(1001, 'emp-1', 'Alice')
+    added = database.addEntries([(1001, 'terminal-1', __DATE__), (1002, 'terminal-1', __DATE__),
+                                 (1002, 'terminal-1', __DATE__ + timedelta(hours=8))], addUnknownEmployees=True)
+    assert added == [1002]
+    # anonymous employee is named by its generated emp-uid
+    (emp_uid, name, _, history) = [employee for employee in database.getEmployeesDataSummary()
+                                   if employee[2] == 1002][0]
+    assert name == emp_uid
+    assert len(history) == 2
+    assert database.getWorkTime(1002) == 8 * 60 * 60
+
+
+def test_batches_are_cut_by_size(database, registry):
+    pipeline = IngestPipeline(database, registry, batchSize=3, linger=10)
+    # queued before the worker starts - batches are full right away
+    for minutes in range(7):
+        pipeline.put(RFID_RECORD, __record(1001, minutes))
+    pipeline.start()
+    pipeline.stop()
+    stats = pipeline.getLatencyStats()
+    assert (stats['messages'], stats['batches']) == (7, 3)
+    assert __history_length(database, 1001) == 7
+
+
+def test_batch_is_flushed_after_linger(database, registry):
+    pipeline = IngestPipeline(database, registry, batchSize=100, linger=0.05)
+    pipeline.start()
+    pipeline.put(RFID_RECORD, __record(1001))
+    pipeline.put(RFID_RECORD, __record(1001, 1))
+    deadline = time.monotonic() + 5
+    while pipeline.getLatencyStats()['batches'] == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    # applied without stopping the worker or filling the batch
+    assert pipeline.getLatencyStats()['batches'] == 1
+    assert __history_length(database, 1001) == 2
+    pipeline.stop()
+
+
+def test_unknown_card_adds_anonymous_employee(database, registry):
+    pipeline = IngestPipeline(database, registry)
+    pipeline.put(RFID_RECORD, encodeRecordJson(1001, 'terminal-1', __DATE__))
+    pipeline.start()
+    pipeline.stop()
+    assert database.getEmpName(1001) != ''
+    assert registry.getStats('terminal-1')['scans'] == 1
+
+
+def test_duplicates_are_suppressed(database, registry):
+    pipeline = IngestPipeline(database, registry, duplicateWindow=60)
+    pipeline.put(RFID_RECORD, __record(1001))
+    # retransmission and re-tap within the window
+    pipeline.put(RFID_RECORD, __record(1001))
+    pipeline.put(RFID_RECORD, encodeRecordJson(1001, 'terminal-1', __DATE__))
+    # exactly window seconds later - not a duplicate any more
+    pipeline.put(RFID_RECORD, __record(1001, 1))
+    pipeline.put(RFID_RECORD, __record(1001, 480))
+    pipeline.start()
+    pipeline.stop()
+    assert pipeline.getLatencyStats()['duplicates'] == 2
+    assert registry.getStats('terminal-1')['duplicates'] == 2
+    assert __history_length(database, 1001) == 3
+
+
+@pytest.mark.parametrize('rfid_uid', [-1, 2**63, True])
+def test_invalid_rfid_is_rejected(database, registry, rfid_uid):
+    pipeline = IngestPipeline(database, registry)
+    pipeline.put(RFID_RECORD, encodeRecordJson(rfid_uid, 'terminal-1', __DATE__))
+    pipeline.put(RFID_RECORD, __record(1001))
+    pipeline.start()
+    pipeline.stop()
+    assert registry.getStats('terminal-1')['errors'] == 1
+    assert [rfid for (_, _, rfid, _) in database.getEmployeesDataSummary(False)] == [1001]
+
+
+class __FailingBatchDataBase:
+    """
+    database which refuses batches of more than one entry
+    """
+
+    def __init__(self, database):
+        self.database = database
+
+    def addEntries(self, batch, addUnknownEmployees=False):
+        if len(batch) > 1:
+            raise OSError('batch refused')
+        if batch[0][0] == 1003:
+            raise InvalidInputDataError
+        return self.database.addEntries(batch, addUnknownEmployees)
+
+
+def test_failed_batch_is_applied_entry_by_entry(database, registry):
+    pipeline = IngestPipeline(__FailingBatchDataBase(database), registry)
+    for rfid_uid in (1001, 1002, 1003):
+        pipeline.put(RFID_RECORD, __record(rfid_uid))
+    pipeline.start()
+    pipeline.stop()
+    assert sorted(rfid for (_, _, rfid, _) in database.getEmployeesDataSummary(False)) == [1001, 1002]
+    assert registry.getStats('terminal-1')['errors'] == 1
+
+
+def test_latency_stats(database, registry):
+    pipeline = IngestPipeline(database, registry, batchSize=10)
+    for minutes in range(25):
+        pipeline.put(RFID_RECORD, __record(1001, minutes))
+    pipeline.start()
+    pipeline.stop()
+    stats = pipeline.getLatencyStats()
+    assert (stats['messages'], stats['batches'], stats['duplicates']) == (25, 3, 0)
+    assert 0 < stats['p50'] <= stats['p90'] <= stats['p99'] <= stats['max']
+    assert 'p99' in pipeline.formatLatencyStats()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+import datetime
+import os
+import pickle
+
+from src.data import EmployeesDataBase
+from src.storage import PickleStorage, dateToMinutes
+
+__DATES__ = [datetime.datetime(2024, 3, day, hour, 0) for day in (4, 5) for hour in (8, 16)]
+
+
+def __entry(date, terminal):
+    return (date.day, date.month, date.year, date.hour, date.minute, terminal)
+
+
+def test_saved_changes_are_replayed_from_journal(dataDir):
+    database = EmployeesDataBase('pickle', dataDir=dataDir)
+    database.addEmployee(1001, 'emp-1', 'Alice')
+    database.addEmployee(1002, 'emp-2', 'Bob')
+    for date in __DATES__:
+        database.addEntry(1001, 'terminal-1', date)
+    database.modifyEmpName(1001, 'Alice Smith')
+    database.deleteEmployee(1002)
+    database.save()
+    database.close()
+    # nothing was checkpointed - the state is only in the journal
+    assert not os.path.exists(os.path.join(dataDir, 'database.pkl'))
+
+    database = EmployeesDataBase('pickle', dataDir=dataDir)
+    assert database.getEmployeesDataSummary() == [
+        ('emp-1', 'Alice Smith', 1001, [__entry(date, 'terminal-1') for date in __DATES__])]
+    database.close()
+
+
+def test_torn_journal_record_is_dropped(dataDir):
+    database = EmployeesDataBase('pickle', dataDir=dataDir)
+    database.addEmployee(1001, 'emp-1', 'Alice')
+    database.addEntry(1001, 'terminal-1', __DATES__[0])
+    database.close()
+    journalPath = os.path.join(dataDir, 'database.journal')
+    validSize = os.path.getsize(journalPath)
+    # crash in the middle of writing the next record
+    record = pickle.dumps((1, 'emp-1', dateToMinutes(__DATES__[1]), 'terminal-2'), pickle.HIGHEST_PROTOCOL)
+    with open(journalPath, 'ab') as journal:
+        journal.write(record[:-3])
+
+    database = EmployeesDataBase('pickle', dataDir=dataDir)
+    assert os.path.getsize(journalPath) == validSize
+    # appended after the last valid record, not after the torn one
+    database.addEntry(1001, 'terminal-1', __DATES__[2])
+    database.close()
+
+    database = EmployeesDataBase('pickle', dataDir=dataDir)
+    (_, _, _, history) = database.getEmployeesDataSummary()[0]
+    assert history == [__entry(__DATES__[0], 'terminal-1'), __entry(__DATES__[2], 'terminal-1')]
+    database.close()
+
+
+def test_interrupted_checkpoint_is_completed_on_load(dataDir):
+    storage = PickleStorage(dataDir)
+    storage.load()
+    storage.addEmployee('emp-1', 1001, 'Alice')
+    storage.addEntries([('emp-1', dateToMinutes(__DATES__[0]), 'terminal-1')])
+    # journal is rotated, the process dies before the snapshot is written
+    storage.beginSave(checkpoint=True)
+    storage.addEntries([('emp-1', dateToMinutes(__DATES__[1]), 'terminal-2')])
+    storage.close()
+    oldJournalPath = os.path.join(dataDir, 'database.journal.old')
+    assert os.path.exists(oldJournalPath)
+
+    storage = PickleStorage(dataDir)
+    storage.load()
+    assert storage.getHistory('emp-1') == [__entry(__DATES__[0], 'terminal-1'), __entry(__DATES__[1], 'terminal-2')]
+    # both journals were folded into a new snapshot
+    assert not os.path.exists(oldJournalPath)
+    assert os.path.exists(os.path.join(dataDir, 'database.pkl'))
+    storage.close()
+
+    storage = PickleStorage(dataDir)
+    storage.load()
+    assert storage.getHistory('emp-1') == [__entry(__DATES__[0], 'terminal-1'), __entry(__DATES__[1], 'terminal-2')]
+    storage.close()
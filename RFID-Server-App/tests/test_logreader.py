@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+import logging
+import os
+
+import pytest
+
+import src.logreader as logreader
+from src.logreader import LogReader
+
+
+def __line(number, level='INFO', text=None):
+    return f'[2024-03-04 08:00:{number % 60:02d}][{level}] {text or f"line {number}"}\n'
+
+
+def __write(path, lines, mode='a'):
+    with open(path, mode) as logFile:
+        logFile.write(''.join(lines))
+
+
+@pytest.fixture
+def logPath(tmp_path):
+    return str(tmp_path / 'latest.log')
+
+
+def test_pages_across_index_stride(logPath):
+    __write(logPath, [__line(number) for number in range(200)])
+    reader = LogReader(logPath)
+    assert reader.refresh() == 200
+    assert reader.getPageCount(64) == 4
+    assert reader.getLines(0, 2) == [__line(0).rstrip(), __line(1).rstrip()]
+    # starts between remembered offsets, crosses the next one
+    assert reader.getLines(126, 4) == [__line(number).rstrip() for number in range(126, 130)]
+    assert reader.getLines(-3, 10) == [__line(number).rstrip() for number in range(197, 200)]
+    assert reader.getPage(-1, 64) == [__line(number).rstrip() for number in range(192, 200)]
+    assert reader.getLines(200, 5) == []
+
+    __write(logPath, [__line(200)])
+    assert reader.refresh() == 201
+    assert reader.getPage(-1, 64) == [__line(number).rstrip() for number in range(192, 201)]
+
+
+def test_lines_are_carried_over_chunks(logPath, monkeypatch):
+    monkeypatch.setattr(logreader, '__CHUNK_SIZE__', 16)
+    lines = [__line(0, text='x' * 50), __line(1), __line(2, text='y' * 40)]
+    __write(logPath, lines)
+    # last line isn't finished yet
+    __write(logPath, [__line(3)[:10]])
+    reader = LogReader(logPath)
+    assert reader.refresh() == 3
+    assert reader.getLines(0, 3) == [line.rstrip() for line in lines]
+
+    __write(logPath, [__line(3)[10:]])
+    assert reader.refresh() == 4
+    assert reader.getLines(3, 1) == [__line(3).rstrip()]
+
+
+def test_level_and_terminal_filter(logPath):
+    __write(logPath, [
+        __line(0, 'INFO', '(Terminal-id: T1) added entry for rfid_uid=1001'),
+        __line(1, 'ERROR', 'unknown exception id=T1'),
+        'Traceback (most recent call last):\n',
+        '  ValueError\n',
+        __line(2, 'ERROR', 'unknown exception id=T10'),
+        '  continuation of T10\n',
+        __line(3, 'WARNING', '(Terminal-id: T2) invalid rfid_uid'),
+    ])
+    reader = LogReader(logPath, terminal_id='T1')
+    assert reader.refresh() == 4
+    assert reader.getLines(0, 10)[1:] == [__line(1, 'ERROR', 'unknown exception id=T1').rstrip(),
+                                          'Traceback (most recent call last):', '  ValueError']
+
+    reader = LogReader(logPath, level=logging.WARNING)
+    assert reader.refresh() == 6
+    assert reader.getLines(-1, 1) == [__line(3, 'WARNING', '(Terminal-id: T2) invalid rfid_uid').rstrip()]
+
+
+def test_rotated_file_is_indexed_again(logPath):
+    __write(logPath, [__line(number) for number in range(10)])
+    reader = LogReader(logPath)
+    assert reader.refresh() == 10
+
+    # new file (another inode) already longer than the indexed one
+    rotatedPath = logPath + '.new'
+    __write(rotatedPath, [__line(number, text=f'rotated {number}') for number in range(30)], 'w')
+    os.replace(rotatedPath, logPath)
+    assert reader.getLines(0, 1) == []
+    assert reader.refresh() == 30
+    assert reader.getLines(0, 1) == [__line(0, text='rotated 0').rstrip()]
+
+    # truncated in place
+    __write(logPath, [__line(0, text='truncated')], 'w')
+    assert reader.refresh() == 1
+    assert reader.getLines(0, 5) == [__line(0, text='truncated').rstrip()]
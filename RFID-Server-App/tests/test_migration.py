@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+import datetime
+import os
+import pickle
+
+import pytest
+
+from src.data import EmployeesDataBase
+
+__NAMES__ = {'emp-1': 'Alice', 'emp-2': 'Bob', 'emp-3': 'Carol'}
+__RFIDS__ = {1001: 'emp-1', 1002: 'emp-2', 1003: 'emp-3'}
+__HISTORIES__ = {
+    'emp-1': [(4, 3, 2024, 8, 0, 'terminal-1'), (4, 3, 2024, 16, 30, 'terminal-2'),
+              (5, 3, 2024, 8, 15, 'terminal-1'), (5, 3, 2024, 15, 45, 'terminal-1')],
+    'emp-2': [(29, 2, 2024, 22, 0, 'terminal-3'), (1, 3, 2024, 6, 0, 'terminal-3')],
+    'emp-3': []
+}
+
+
+def __write_baseline_snapshot(dataDir):
+    # layout saved by the baseline server: [names, rfid -> emp-uid, emp-uid -> list of 6-tuples]
+    with open(os.path.join(dataDir, 'database.pkl'), 'wb') as dbFile:
+        pickle.dump([dict(__NAMES__), dict(__RFIDS__), {emp_uid: list(history) for (emp_uid, history)
+                                                        in __HISTORIES__.items()}], dbFile)
+
+
+def __expected_summary():
+    return sorted((emp_uid, __NAMES__[emp_uid], rfid_uid, __HISTORIES__[emp_uid])
+                  for (rfid_uid, emp_uid) in __RFIDS__.items())
+
+
+@pytest.mark.parametrize('backend', ['pickle', 'sqlite'])
+def test_baseline_snapshot_is_converted(dataDir, backend):
+    __write_baseline_snapshot(dataDir)
+
+    database = EmployeesDataBase(backend, dataDir=dataDir)
+    assert sorted(database.getEmployeesDataSummary()) == __expected_summary()
+    # entrance 4.03 8:00 - leave 16:30, entrance 5.03 8:15 - leave 15:45
+    assert database.getWorkTime(1001) == (8 * 60 + 30 + 7 * 60 + 30) * 60
+    # night shift paired across the end of the month
+    assert database.getWorkTime(1002) == 8 * 60 * 60
+    database.addEntry(1003, 'terminal-2', datetime.datetime(2024, 3, 6, 9, 0))
+    database.checkpoint()
+    database.close()
+
+    database = EmployeesDataBase(backend, dataDir=dataDir)
+    summary = {emp_uid: history for (emp_uid, _, _, history) in database.getEmployeesDataSummary()}
+    assert summary['emp-1'] == __HISTORIES__['emp-1']
+    assert summary['emp-3'] == [(6, 3, 2024, 9, 0, 'terminal-2')]
+    database.close()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+import datetime
+import os
+
+import pytest
+
+from src.data import EmployeesDataBase
+from src.storage import Partition, PickleStorage, dateToMinutes, minutesToDate, minutesToMonth, monthName, \
+    monthToMinutes
+
+__PARTITIONS_DIR__ = 'partitions'
+__ARCHIVE_DIR__ = 'archive'
+__SHIFT__ = datetime.timedelta(hours=8)
+
+
+def __entry(date, terminal):
+    return (date.day, date.month, date.year, date.hour, date.minute, terminal)
+
+
+def __add_sessions(storage, emp_uid, days, month=1):
+    dates = []
+    for day in days:
+        for hour in (8, 16):
+            dates.append(datetime.datetime(2024, month, day, hour, 0))
+    storage.addEntries([(emp_uid, dateToMinutes(date), 'terminal-1') for date in dates])
+    return dates
+
+
+def __partition_files(dataDir, directory=__PARTITIONS_DIR__):
+    path = os.path.join(dataDir, directory)
+    return sorted(os.listdir(path)) if os.path.exists(path) else []
+
+
+def __add_shifts(database, rfid_uid, entrances):
+    """
+    Returns:\n
+    \tlist of history entries of shifts (entrance, leave 8 hours later)
+    """
+    dates = [date for entrance in entrances for date in (entrance, entrance + __SHIFT__)]
+    database.addEntries([(rfid_uid, 'terminal-1', date) for date in dates])
+    return [__entry(date, 'terminal-1') for date in dates]
+
+
+def __history_of(database, rfid_uid):
+    return [history for (_, _, uid, history) in database.getEmployeesDataSummary() if uid == rfid_uid][0]
+
+
+def __month_date(offset, day):
+    """
+    Returns:\n
+    \tdatetime 8:00 of day of month offset months from the current one
+    """
+    month = minutesToMonth(dateToMinutes(datetime.datetime.now())) + offset
+    return minutesToDate(monthToMinutes(month)).replace(day=day, hour=8)
+
+
+def test_changes_during_checkpoint_are_kept(dataDir):
+    storage = PickleStorage(dataDir)
+    storage.load()
+    for (emp_uid, rfid_uid) in (('emp-1', 1001), ('emp-2', 1002), ('emp-3', 1003)):
+        storage.addEmployee(emp_uid, rfid_uid, emp_uid)
+    dates = {emp_uid: __add_sessions(storage, emp_uid, (2, 3)) for emp_uid in ('emp-1', 'emp-2', 'emp-3')}
+
+    # past months are compacted by the writer, while the database goes on
+    finishSave = storage.beginSave(checkpoint=True)
+    lateDate = datetime.datetime(2024, 1, 2, 12, 0)
+    storage.addEntries([('emp-1', dateToMinutes(lateDate), 'terminal-2')])
+    newDate = datetime.datetime(2024, 1, 4, 8, 0)
+    storage.addEntries([('emp-2', dateToMinutes(newDate), 'terminal-2')])
+    storage.deleteEmployee('emp-3')
+    finishSave()
+    assert __partition_files(dataDir) == ['2024-01.1.part']
+
+    expected = {
+        'emp-1': sorted([__entry(date, 'terminal-1') for date in dates['emp-1']] + [__entry(lateDate, 'terminal-2')]),
+        'emp-2': [__entry(date, 'terminal-1') for date in dates['emp-2']] + [__entry(newDate, 'terminal-2')]
+    }
+    # written snapshot is swapped in on next save
+    storage.beginSave()()
+    assert storage.getHistories() == expected
+    # late entry flipped entrance/leave - emp-1 is whole in hot history again
+    assert storage.getWorkPeriods('emp-1') == [(dateToMinutes(dates['emp-1'][0]), dateToMinutes(lateDate)),
+                                               (dateToMinutes(dates['emp-1'][1]), dateToMinutes(dates['emp-1'][2]))]
+    assert storage.getWorkTime('emp-2') == 2 * 8 * 60
+    storage.close()
+
+    storage = PickleStorage(dataDir)
+    storage.load()
+    assert storage.getHistories() == expected
+    assert storage.historyLength('emp-1') == 5
+    storage.beginSave(checkpoint=True)()
+    storage.beginSave()()
+    assert storage.getHistories() == expected
+    storage.close()
+
+
+def test_sessions_are_split_by_month_of_entrance(dataDir):
+    database = EmployeesDataBase('pickle', dataDir=dataDir)
+    database.addEmployee(1001, 'emp-1', 'Alice')
+    # night shift of the last day of January belongs to January
+    entrances = [datetime.datetime(2024, 1, 15, 8), datetime.datetime(2024, 1, 31, 22),
+                 datetime.datetime(2024, 2, 10, 8), datetime.datetime(2024, 3, 5, 8)]
+    history = __add_shifts(database, 1001, entrances)
+    database.checkpoint()
+    database.close()
+    assert __partition_files(dataDir) == ['2024-01.1.part', '2024-02.1.part', '2024-03.1.part']
+
+    database = EmployeesDataBase('pickle', dataDir=dataDir)
+    assert __history_of(database, 1001) == history
+    assert database.getWorkTime(1001) == 4 * 8 * 60 * 60
+    assert database.getWorkTime(1001, datetime.datetime(2024, 2, 1), datetime.datetime(2024, 3, 1)) == 8 * 60 * 60
+    database.close()
+
+
+def test_late_entries_are_merged_into_partition(dataDir):
+    database = EmployeesDataBase('pickle', dataDir=dataDir)
+    database.addEmployee(1001, 'emp-1', 'Alice')
+    history = __add_shifts(database, 1001, [datetime.datetime(2024, 1, 15, 8)])
+    database.checkpoint()
+    # newer than the archived ones - appended to the partition
+    history += __add_shifts(database, 1001, [datetime.datetime(2024, 1, 20, 8)])
+    database.checkpoint()
+    database.close()
+    assert __partition_files(dataDir) == ['2024-01.2.part']
+
+    database = EmployeesDataBase('pickle', dataDir=dataDir)
+    assert __history_of(database, 1001) == history
+    assert database.getWorkTime(1001) == 2 * 8 * 60 * 60
+    # older than the archived ones - flips entrance/leave of everything after it
+    lateDate = datetime.datetime(2024, 1, 10, 12)
+    database.addEntry(1001, 'terminal-2', lateDate)
+    history.insert(0, __entry(lateDate, 'terminal-2'))
+    assert database.getWorkTime(1001) == (116 * 60 + 112 * 60) * 60
+    database.checkpoint()
+    database.close()
+
+    database = EmployeesDataBase('pickle', dataDir=dataDir)
+    assert __history_of(database, 1001) == history
+    # entrance 10.01 12:00 - leave 15.01 8:00, entrance 15.01 16:00 - leave 20.01 8:00 (20.01 16:00 is open)
+    assert database.getWorkTime(1001) == (116 * 60 + 112 * 60) * 60
+    database.close()
+
+
+@pytest.mark.parametrize('policy', ['archive', 'drop'])
+def test_partitions_past_retention(dataDir, policy):
+    database = EmployeesDataBase('pickle', dataDir=dataDir, retentionMonths=2, retentionPolicy=policy)
+    database.addEmployee(1001, 'emp-1', 'Alice')
+    retired = __add_shifts(database, 1001, [__month_date(-4, 2)])
+    kept = __add_shifts(database, 1001, [__month_date(-2, 2), __month_date(-1, 2)])
+    database.checkpoint()
+    database.close()
+
+    currentMonth = minutesToMonth(dateToMinutes(datetime.datetime.now()))
+    assert __partition_files(dataDir) == [f'{monthName(currentMonth + offset)}.1.part' for offset in (-2, -1)]
+    archived = [f'{monthName(currentMonth - 4)}.1.part'] if policy == 'archive' else []
+    assert __partition_files(dataDir, __ARCHIVE_DIR__) == archived
+
+    database = EmployeesDataBase('pickle', dataDir=dataDir, retentionMonths=2, retentionPolicy=policy)
+    assert __history_of(database, 1001) == kept
+    assert database.getWorkTime(1001) == 2 * 8 * 60 * 60
+    database.close()
+    if policy == 'archive':
+        # archive is a regular partition file
+        archivedHistories = Partition.read(os.path.join(dataDir, __ARCHIVE_DIR__, archived[0]))
+        assert len(archivedHistories) == 1
+        assert len(list(archivedHistories.values())[0]) == len(retired)
+
+
+def test_archived_employee_is_modified_and_deleted(dataDir):
+    database = EmployeesDataBase('pickle', dataDir=dataDir)
+    database.addEmployee(1001, 'emp-1', 'Alice')
+    database.addEmployee(1002, 'emp-2', 'Bob')
+    history = __add_shifts(database, 1001, [datetime.datetime(2024, 1, 15, 8)])
+    __add_shifts(database, 1002, [datetime.datetime(2024, 1, 16, 8), datetime.datetime(2024, 2, 16, 8)])
+    database.checkpoint()
+
+    database.modifyEmpRFID(1001, 2001)
+    database.deleteEmployee(1002)
+    assert database.getWorkTime(2001) == 8 * 60 * 60
+    database.checkpoint()
+    database.close()
+    # February held only the deleted employee
+    assert __partition_files(dataDir) == ['2024-01.2.part']
+
+    database = EmployeesDataBase('pickle', dataDir=dataDir)
+    assert database.getEmployeesDataSummary() == [('emp-1', 'Alice', 2001, history)]
+    database.deleteEmployee(2001)
+    database.checkpoint()
+    database.close()
+    assert __partition_files(dataDir) == []
+
+    database = EmployeesDataBase('pickle', dataDir=dataDir)
+    assert database.getEmployeesDataSummary() == []
+    database.close()
+
+
+def test_range_report_opens_only_overlapping_partitions(dataDir, monkeypatch):
+    database = EmployeesDataBase('pickle', dataDir=dataDir)
+    database.addEmployee(1001, 'emp-1', 'Alice')
+    __add_shifts(database, 1001, [datetime.datetime(2024, month, 10, 8) for month in (1, 2, 3)])
+    database.checkpoint()
+    database.close()
+
+    opened = []
+    read = Partition.read
+    monkeypatch.setattr(Partition, 'read', staticmethod(lambda path: opened.append(os.path.basename(path)) or read(path)))
+    database = EmployeesDataBase('pickle', dataDir=dataDir)
+    reportPath = database.generateReport(1001, datetime.datetime(2024, 2, 1), datetime.datetime(2024, 3, 1))
+    assert opened == ['2024-02.1.part']
+    with open(reportPath, 'r') as report:
+        assert report.read() == '10/02/2024 08:00:00;10/02/2024 16:00:00;28800\n'
+    database.close()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+from src.server import TerminalRegistry
+
+__TTL__ = 30
+
+
+def test_whitelist_membership():
+    registry = TerminalRegistry()
+    assert registry.add('terminal-1')
+    assert registry.add('terminal-2')
+    assert not registry.add('terminal-1')
+    assert registry.isWhitelisted('terminal-1')
+    assert registry.remove('terminal-1')
+    assert not registry.remove('terminal-1')
+    assert not registry.isWhitelisted('terminal-1')
+    assert registry.add('terminal-3')
+    assert registry.getWhitelist() == ['terminal-2', 'terminal-3']
+
+
+def test_indexes_are_never_reused():
+    registry = TerminalRegistry()
+    registry.load(['terminal-1', 'terminal-3'], {'terminal-1': 0, 'terminal-2': 1})
+    # terminal-2 was removed earlier, its index stays taken
+    assert registry.getIndexes() == {'terminal-1': 0, 'terminal-2': 1, 'terminal-3': 2}
+    registry.remove('terminal-1')
+    registry.add('terminal-4')
+    registry.add('terminal-2')
+    assert registry.getWhitelistedIndexes() == {'terminal-3': 2, 'terminal-4': 3, 'terminal-2': 1}
+    # records of a removed terminal are still attributed to it (and rejected by the whitelist)
+    assert registry.terminalForIndex(0) == 'terminal-1'
+    assert registry.terminalForIndex(4) is None
+
+
+def test_presence_expires_after_ttl():
+    registry = TerminalRegistry(presenceTtl=__TTL__)
+    assert not registry.isAvailable('terminal-1', now=1000)
+    assert registry.seen('terminal-1', now=1000)
+    assert not registry.seen('terminal-1', now=1000 + __TTL__)
+    assert registry.isAvailable('terminal-1', now=1000 + 2 * __TTL__)
+    assert not registry.isAvailable('terminal-1', now=1001 + 2 * __TTL__)
+    registry.seen('terminal-2', now=1000)
+    assert registry.getAvailable(now=1001 + 2 * __TTL__) == []
+    assert registry.getAvailable(now=1000 + __TTL__) == ['terminal-1', 'terminal-2']
+    # away longer than ttl - appears again
+    assert registry.seen('terminal-1', now=1001 + 2 * __TTL__)
+
+
+def test_records_keep_terminal_present():
+    registry = TerminalRegistry(presenceTtl=__TTL__)
+    registry.recordScans('terminal-1', 3, now=1000)
+    registry.recordError('terminal-2', now=1000)
+    registry.recordDuplicates('terminal-3', 2, now=1000)
+    assert registry.getAvailable(now=1000 + __TTL__) == ['terminal-1', 'terminal-2', 'terminal-3']
+
+
+def test_counters_per_terminal():
+    registry = TerminalRegistry()
+    assert registry.getStats('terminal-1') == \
+        {'last_seen': None, 'scans': 0, 'last_scan': None, 'errors': 0, 'duplicates': 0}
+    registry.seen('terminal-1', now=900)
+    registry.recordScans('terminal-1', 3, now=1000)
+    registry.recordScans('terminal-1', 2, now=1100)
+    registry.recordError('terminal-1', now=1200)
+    registry.recordDuplicates('terminal-1', 4, now=1300)
+    registry.recordScans('terminal-2', 1, now=1000)
+    assert registry.getStats('terminal-1') == \
+        {'last_seen': 1300, 'scans': 5, 'last_scan': 1100, 'errors': 1, 'duplicates': 4}
+    assert registry.getAllStats() == {
+        'terminal-1': registry.getStats('terminal-1'),
+        'terminal-2': {'last_seen': 1000, 'scans': 1, 'last_scan': 1000, 'errors': 0, 'duplicates': 0}}
+
+
+def test_owned_terminals():
+    assert TerminalRegistry().isOwned('terminal-1')
+    registry = TerminalRegistry(owned=['terminal-1'])
+    assert registry.isOwned('terminal-1')
+    assert not registry.isOwned('terminal-2')
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+import datetime
+
+import pytest
+
+from src.data import EmployeesDataBase, NoDataError
+
+__SHIFT__ = datetime.timedelta(hours=8)
+__ENTRANCES__ = [datetime.datetime(2024, 3, day, 8, 0) for day in (1, 4, 5, 6)] + \
+                [datetime.datetime(2024, 3, 7, 22, 0)]
+
+
+def __report_line(entrance, leave):
+    return f"{entrance.strftime('%d/%m/%Y %H:%M:%S')};{leave.strftime('%d/%m/%Y %H:%M:%S')};" \
+        f"{int((leave - entrance).total_seconds())}\n"
+
+
+def __read(path):
+    with open(path, 'r') as report:
+        return report.read()
+
+
+@pytest.fixture(params=['pickle', 'sqlite'])
+def database(dataDir, request):
+    database = EmployeesDataBase(request.param, dataDir=dataDir)
+    database.addEmployee(1001, 'emp-1', 'Alice Smith')
+    database.addEntries([(1001, 'terminal-1', date) for entrance in __ENTRANCES__
+                         for date in (entrance, entrance + __SHIFT__)])
+    yield database
+    database.close()
+
+
+@pytest.mark.parametrize('start, end', [
+    (None, None),
+    # entrance at start is included, entrance at end isn't
+    (datetime.datetime(2024, 3, 4, 8, 0), datetime.datetime(2024, 3, 6, 8, 0)),
+    # session which started before start isn't included even though it ends in the range
+    (datetime.datetime(2024, 3, 7, 23, 0), None),
+    (None, datetime.datetime(2024, 3, 4, 8, 1))
+])
+def test_range_report_matches_hand_built_one(database, start, end):
+    expected = ''.join(__report_line(entrance, entrance + __SHIFT__) for entrance in __ENTRANCES__
+                       if (start is None or entrance >= start) and (end is None or entrance < end))
+    if expected == '':
+        with pytest.raises(NoDataError):
+            database.generateReport(1001, start, end)
+        return
+    assert __read(database.generateReport(1001, start, end)) == expected
+    assert database.getWorkTime(1001, start, end) == 8 * 60 * 60 * expected.count('\n')
+
+
+def test_parallel_reports_match_serial_ones(dataDir):
+    database = EmployeesDataBase('pickle', dataDir=dataDir)
+    for employee in range(6):
+        database.addEmployee(1001 + employee, f'emp-{employee}', f'Employee {employee}')
+        # the last employee has only an open session - no report
+        entrances = __ENTRANCES__[:employee + 1] if employee < 5 else []
+        database.addEntries([(1001 + employee, 'terminal-1', date) for entrance in entrances
+                             for date in (entrance, entrance + __SHIFT__)])
+    database.addEntry(1006, 'terminal-1', __ENTRANCES__[0])
+    (start, end) = (datetime.datetime(2024, 3, 4), None)
+
+    serial = database.generateReports(start=start, end=end, workers=1)
+    serialReports = [(rfid_uid, __read(path)) for (rfid_uid, path, _) in serial]
+    parallel = database.generateReports(start=start, end=end, workers=2)
+    assert [(rfid_uid, __read(path)) for (rfid_uid, path, _) in parallel] == serialReports
+    assert [rfid_uid for (rfid_uid, _) in serialReports] == [1002, 1003, 1004, 1005]
+    for (rfid_uid, report) in serialReports:
+        assert report == __read(database.generateReport(rfid_uid, start, end))
+
+    subset = database.generateReports([1005, 1003], start=start, end=end, workers=2)
+    assert [(rfid_uid, __read(path)) for (rfid_uid, path, _) in subset] == \
+        [serialReports[3], serialReports[1]]
+    database.close()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+import datetime
+
+import pytest
+
+from src.data import EmployeesDataBase, NoSuchEmployeeError
+
+__ENTRANCE__ = datetime.datetime(2024, 3, 4, 8, 0)
+__LEAVE__ = datetime.datetime(2024, 3, 4, 16, 0)
+
+
+def __reopen(database, backend, dataDir, checkpoint):
+    if checkpoint:
+        database.checkpoint()
+    database.close()
+    return EmployeesDataBase(backend, dataDir=dataDir)
+
+
+@pytest.mark.parametrize('checkpoint', [False, True])
+@pytest.mark.parametrize('backend', ['pickle', 'sqlite'])
+def test_rfid_change_in_the_middle_of_session(dataDir, backend, checkpoint):
+    database = EmployeesDataBase(backend, dataDir=dataDir)
+    database.addEmployee(1001, 'emp-1', 'Alice')
+    database.addEntry(1001, 'terminal-1', __ENTRANCE__)
+    # card replaced while the employee is at work
+    database.modifyEmpRFID(1001, 2001)
+    database = __reopen(database, backend, dataDir, checkpoint)
+
+    database.addEntry(2001, 'terminal-2', __LEAVE__)
+    assert database.getWorkTime(2001) == 8 * 60 * 60
+    database = __reopen(database, backend, dataDir, checkpoint)
+    assert database.getEmployeesDataSummary() == [
+        ('emp-1', 'Alice', 2001, [(4, 3, 2024, 8, 0, 'terminal-1'), (4, 3, 2024, 16, 0, 'terminal-2')])]
+    assert database.getWorkTime(2001) == 8 * 60 * 60
+    with pytest.raises(NoSuchEmployeeError):
+        database.getWorkTime(1001)
+    database.close()
+
+
+@pytest.mark.parametrize('checkpoint', [False, True])
+@pytest.mark.parametrize('backend', ['pickle', 'sqlite'])
+def test_deleted_employee_open_session_is_gone(dataDir, backend, checkpoint):
+    database = EmployeesDataBase(backend, dataDir=dataDir)
+    database.addEmployee(1001, 'emp-1', 'Alice')
+    database.addEntry(1001, 'terminal-1', __ENTRANCE__)
+    database.deleteEmployee(1001)
+    database = __reopen(database, backend, dataDir, checkpoint)
+    assert database.getEmployeesDataSummary() == []
+
+    # same card and emp-uid given to a new employee - the old open session isn't paired with its entries
+    database.addEmployee(1001, 'emp-1', 'Bob')
+    database.addEntry(1001, 'terminal-1', __LEAVE__)
+    database = __reopen(database, backend, dataDir, checkpoint)
+    assert database.getWorkTime(1001) == 0
+    database.addEntry(1001, 'terminal-1', __LEAVE__ + datetime.timedelta(hours=8))
+    assert database.getWorkTime(1001) == 8 * 60 * 60
+    database = __reopen(database, backend, dataDir, checkpoint)
+    assert database.getEmployeesDataSummary() == [
+        ('emp-1', 'Bob', 1001, [(4, 3, 2024, 16, 0, 'terminal-1'), (5, 3, 2024, 0, 0, 'terminal-1')])]
+    database.close()
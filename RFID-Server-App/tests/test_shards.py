@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+import datetime
+
+import pytest
+
+from src.data import NoSuchEmployeeError, RfidAlreadyUsedError
+from src.shards import ShardedDataBase
+
+__DATES__ = [datetime.datetime(2024, 3, day, hour, 0) for day in (4, 5) for hour in (8, 16)]
+
+
+def __entry(date, terminal):
+    return (date.day, date.month, date.year, date.hour, date.minute, terminal)
+
+
+@pytest.fixture
+def database(dataDir):
+    database = ShardedDataBase(2, dataDir=dataDir)
+    yield database
+    database.close()
+
+
+def __rfid_of_other_shard(database, rfid_uid):
+    return next(other for other in range(rfid_uid + 1000, rfid_uid + 1100)
+                if database.shardOf(other) != database.shardOf(rfid_uid))
+
+
+def test_employee_is_moved_to_shard_of_new_rfid(database):
+    database.addEmployee(1001, 'emp-1', 'Alice')
+    database.addEmployee(1002, 'emp-2', 'Bob')
+    database.addEntries([(1001, 'terminal-1', date) for date in __DATES__])
+    newRfid = __rfid_of_other_shard(database, 1001)
+
+    database.modifyEmpRFID(1001, newRfid)
+    assert database.getEmployeeData(newRfid) == \
+        ('emp-1', 'Alice', newRfid, [__entry(date, 'terminal-1') for date in __DATES__])
+    assert database.getWorkTime(newRfid) == 2 * 8 * 60 * 60
+    with pytest.raises(NoSuchEmployeeError):
+        database.getEmpName(1001)
+    assert sorted(rfid_uid for (_, _, rfid_uid, _) in database.getEmployeesDataSummary(False)) == \
+        sorted([1002, newRfid])
+
+
+def test_move_to_used_rfid_changes_nothing(database):
+    database.addEmployee(1001, 'emp-1', 'Alice')
+    usedRfid = __rfid_of_other_shard(database, 1001)
+    database.addEmployee(usedRfid, 'emp-2', 'Bob')
+
+    with pytest.raises(RfidAlreadyUsedError):
+        database.modifyEmpRFID(1001, usedRfid)
+    with pytest.raises(NoSuchEmployeeError):
+        database.modifyEmpRFID(1003, __rfid_of_other_shard(database, 1003))
+    assert database.getEmpName(1001) == 'Alice'
+    assert database.getEmpName(usedRfid) == 'Bob'
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+import datetime
+import os
+import sqlite3
+
+import pytest
+
+from src.data import EmployeesDataBase
+from src.storage import SqliteStorage, dateToMinutes, minutesToDate, minutesToMonth, monthToMinutes
+
+__DATES__ = [datetime.datetime(2024, 3, 4, 8) + datetime.timedelta(hours=4 * index) for index in range(7)]
+
+
+def __entry(date, terminal='terminal-1'):
+    return (date.day, date.month, date.year, date.hour, date.minute, terminal)
+
+
+def __minutes(dates):
+    return [dateToMinutes(date) for date in dates]
+
+
+def __open(dataDir, batchSize=2):
+    storage = SqliteStorage(dataDir, batchSize=batchSize)
+    storage.load()
+    return storage
+
+
+def test_sessions_are_paired_incrementally(dataDir):
+    storage = __open(dataDir)
+    storage.addEmployee('emp-1', 1001, 'Alice')
+    storage.addEntries([('emp-1', minutes, 'terminal-1') for minutes in __minutes(__DATES__[:5])])
+    minutes = __minutes(__DATES__)
+    assert storage.getWorkPeriods('emp-1') == [(minutes[0], minutes[1]), (minutes[2], minutes[3])]
+    assert storage.getWorkTime('emp-1', minutes[1], None) == minutes[3] - minutes[2]
+
+    # late entry flips entrance/leave of every entry after it
+    late = dateToMinutes(__DATES__[0] + datetime.timedelta(hours=2))
+    storage.addEntries([('emp-1', late, 'terminal-2')])
+    assert storage.getWorkPeriods('emp-1') == [(minutes[0], late), (minutes[1], minutes[2]), (minutes[3], minutes[4])]
+    assert storage.historyLength('emp-1') == 6
+    storage.close()
+
+
+def test_open_session_survives_reopening(dataDir):
+    storage = __open(dataDir)
+    storage.addEmployee('emp-1', 1001, 'Alice')
+    storage.addEntries([('emp-1', minutes, 'terminal-1') for minutes in __minutes(__DATES__[:3])])
+    storage.close()
+
+    storage = __open(dataDir)
+    assert storage.emp_rfid_dict == {'emp-1': 1001}
+    # entrance of the open session was stored with the rest
+    storage.addEntries([('emp-1', dateToMinutes(__DATES__[3]), 'terminal-1')])
+    minutes = __minutes(__DATES__)
+    assert storage.getWorkPeriods('emp-1') == [(minutes[0], minutes[1]), (minutes[2], minutes[3])]
+    assert storage.getHistory('emp-1') == [__entry(date) for date in __DATES__[:4]]
+    storage.modifyEmpRFID('emp-1', 2001)
+    storage.modifyEmpName('emp-1', 'Alice Smith')
+    storage.close()
+
+    storage = __open(dataDir)
+    assert (storage.emp_rfid_dict, storage.emp_name_dict) == ({'emp-1': 2001}, {'emp-1': 'Alice Smith'})
+    storage.deleteEmployee('emp-1')
+    storage.close()
+
+    storage = __open(dataDir)
+    assert storage.getHistories() == {}
+    storage.close()
+
+
+def __month_date(offset, day):
+    month = minutesToMonth(dateToMinutes(datetime.datetime.now())) + offset
+    return minutesToDate(monthToMinutes(month)).replace(day=day, hour=8)
+
+
+@pytest.mark.parametrize('policy', ['archive', 'drop'])
+def test_retention_removes_first_sessions_on_checkpoint(dataDir, policy):
+    database = EmployeesDataBase('sqlite', dataDir=dataDir, retentionMonths=2, retentionPolicy=policy)
+    database.addEmployee(1001, 'emp-1', 'Alice')
+    # 3 sessions past retention period, 1 inside it and an open one
+    entrances = [__month_date(-4, 2), __month_date(-4, 3), __month_date(-3, 2), __month_date(-1, 2)]
+    dates = [date for entrance in entrances for date in (entrance, entrance + datetime.timedelta(hours=8))]
+    dates.append(__month_date(-1, 3))
+    database.addEntries([(1001, 'terminal-1', date) for date in dates])
+    database.save()
+    database.close()
+
+    database = EmployeesDataBase('sqlite', dataDir=dataDir, retentionMonths=2, retentionPolicy=policy)
+    # regular saves don't apply retention
+    assert database.getWorkTime(1001) == 4 * 8 * 60 * 60
+    database.checkpoint()
+    (_, _, _, history) = database.getEmployeesDataSummary()[0]
+    assert history == [__entry(date) for date in dates[6:]]
+    assert database.getWorkTime(1001) == 8 * 60 * 60
+    database.close()
+
+    archivePath = os.path.join(dataDir, 'archive', 'history.sqlite')
+    if policy == 'archive':
+        connection = sqlite3.connect(archivePath)
+        archived = connection.execute('SELECT timestamp FROM entries ORDER BY timestamp').fetchall()
+        connection.close()
+        assert [row[0] for row in archived] == __minutes(dates[:6])
+    else:
+        assert not os.path.exists(archivePath)
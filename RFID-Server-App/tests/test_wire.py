@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+from datetime import datetime
+
+import pytest
+
+from src.wire import FORMAT_BATCH, FORMAT_BINARY, decodeBatch, decodeRecord, encodeBatch, encodeRecord, \
+    encodeRecordJson
+
+__TERMINALS__ = ['terminal-0', 'terminal-1']
+__DATE__ = datetime(2024, 3, 4, 8, 15, 42)
+
+
+def __terminal_for_index(index):
+    return __TERMINALS__[index] if index < len(__TERMINALS__) else None
+
+
+@pytest.mark.parametrize('rfid_uid', [0, 1001, 2**64 - 1])
+def test_binary_record_round_trip(rfid_uid):
+    payload = encodeRecord(rfid_uid, 1, __DATE__)
+    assert payload[0] == FORMAT_BINARY
+    assert decodeRecord(payload, __terminal_for_index) == (rfid_uid, 'terminal-1', __DATE__)
+
+
+def test_json_record_round_trip():
+    payload = encodeRecordJson(1001, 'terminal-1', __DATE__)
+    # JSON records carry the date to the minute
+    assert decodeRecord(payload, __terminal_for_index) == (1001, 'terminal-1', __DATE__.replace(second=0))
+    assert decodeRecord(payload.encode('utf-8'), __terminal_for_index)[1] == 'terminal-1'
+
+
+def test_terminal_of_topic_takes_precedence():
+    assert decodeRecord(encodeRecord(1001, 0, __DATE__), __terminal_for_index, 'terminal-7')[1] == 'terminal-7'
+    assert decodeRecord(encodeRecordJson(1001, 'terminal-1', __DATE__), __terminal_for_index,
+                        'terminal-7')[1] == 'terminal-7'
+
+
+def test_unknown_terminal_index():
+    assert decodeRecord(encodeRecord(1001, 9, __DATE__), __terminal_for_index) == (1001, None, __DATE__)
+
+
+@pytest.mark.parametrize('payload', [
+    encodeRecord(1001, 1, __DATE__)[:-1],
+    b'{"rfid_uid": 1001}',
+    '{"rfid_uid": 1001, "terminal_id": "terminal-1", "rfid_date": 5}',
+    'not a record'
+])
+def test_malformed_record(payload):
+    with pytest.raises(ValueError):
+        decodeRecord(payload, __terminal_for_index)
+
+
+def test_batch_round_trip():
+    payloads = [encodeRecord(1001, 0, __DATE__), encodeRecordJson(1002, 'terminal-1', __DATE__),
+                encodeRecord(1003, 1, __DATE__)]
+    batch = encodeBatch(payloads)
+    assert batch[0] == FORMAT_BATCH
+    decoded = decodeBatch(batch)
+    assert decoded == [payloads[0], payloads[1].encode('utf-8'), payloads[2]]
+    assert [decodeRecord(payload, __terminal_for_index)[0] for payload in decoded] == [1001, 1002, 1003]
+
+
+@pytest.mark.parametrize('payload', [encodeRecord(1001, 0, __DATE__), encodeRecordJson(1001, 'terminal-1', __DATE__)])
+def test_record_is_not_a_batch(payload):
+    assert decodeBatch(payload) == [payload]
+
+
+# cut in the last item, in the header of the last item, in the header of the batch
+@pytest.mark.parametrize('end', [-1, -20, 2])
+def test_truncated_batch(end):
+    batch = encodeBatch([encodeRecord(1001, 0, __DATE__), encodeRecord(1002, 0, __DATE__)])
+    with pytest.raises(ValueError):
+        decodeBatch(batch[:end])